@@ -0,0 +1,177 @@
+import asyncio
+import sys
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import ANALYTICS_UTC_OFFSET_HOURS
+from app.database import AsyncSessionLocal
+from app.models import Order, OrderItem, Product, SalesDaily, ProductSalesDaily, CourierSpendDaily
+
+# an order is booked the first time it reaches one of these, and un-booked if it's cancelled afterwards
+COUNTED_STATUSES = ("paid", "processing", "shipped", "completed")
+
+
+def local_day(moment: datetime = None) -> date:
+    return ((moment or datetime.utcnow()) + timedelta(hours=ANALYTICS_UTC_OFFSET_HOURS)).date()
+
+
+def _insert(db: AsyncSession):
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+class SalesAnalytics:
+    """Incremental daily rollups of paid orders.
+
+    ``sync_order`` runs in the same transaction as the status change that
+    triggered it. Booking is claimed with a conditional update of
+    ``orders.analytics_day``, so an order is counted exactly once however
+    many notifications, status polls or tracking refreshes see it paid. Each
+    rollup row is bumped with an INSERT ... ON CONFLICT DO UPDATE.
+    """
+
+    def __init__(self):
+        self.booked = 0
+        self.reversed = 0
+
+    async def _bump(self, db: AsyncSession, model, keys: dict, increments: dict, **assign):
+        insert = _insert(db)
+        stmt = insert(model).values(**keys, **increments, **assign)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={
+                **{column: getattr(model, column) + stmt.excluded[column] for column in increments},
+                **{column: stmt.excluded[column] for column in assign},
+            },
+        )
+        await db.execute(stmt)
+
+    async def _claim(self, db: AsyncSession, order_id: str, day: date | None) -> date | None:
+        """Set (or clear, when ``day`` is None) the order's booking day; returns the day it was booked on."""
+        if day is not None:
+            stmt = update(Order).where(Order.id == order_id, Order.analytics_day.is_(None)).values(analytics_day=day)
+            return day if (await db.execute(stmt)).rowcount == 1 else None
+        booked = await db.scalar(select(Order.analytics_day).where(Order.id == order_id))
+        if booked is None:
+            return None
+        stmt = update(Order).where(Order.id == order_id, Order.analytics_day == booked).values(analytics_day=None)
+        return booked if (await db.execute(stmt)).rowcount == 1 else None
+
+    async def _apply(self, db: AsyncSession, order: Order, day: date, sign: int):
+        items = (await db.scalars(select(OrderItem).where(OrderItem.order_id == order.id))).all()
+        units = sum(i.quantity for i in items)
+        revenue = sum(i.price * i.quantity for i in items)
+        shipping = order.shipping_cost or 0
+        await self._bump(db, SalesDaily, {"day": day},
+                         {"orders": sign, "units": sign * units, "revenue": sign * revenue, "shipping": sign * shipping})
+        if order.courier_company:
+            await self._bump(db, CourierSpendDaily, {"day": day, "courier_company": order.courier_company},
+                             {"orders": sign, "shipping": sign * shipping})
+
+        lines: dict[tuple, list] = {}
+        for item in items:
+            if not item.product_id:
+                continue
+            line = lines.setdefault((item.product_id, item.variant_name or ""), [item.product_name, 0, 0.0])
+            line[1] += item.quantity
+            line[2] += item.price * item.quantity
+        # fixed order so concurrent bookings touching the same products can't deadlock
+        for (product_id, variant_name), (name, qty, amount) in sorted(lines.items()):
+            await self._bump(db, ProductSalesDaily, {"day": day, "product_id": product_id, "variant_name": variant_name},
+                             {"units": sign * qty, "revenue": sign * amount}, product_name=name)
+        for product_id in sorted({p for p, _ in lines}):
+            qty = sum(q for (p, _), (_, q, _) in lines.items() if p == product_id)
+            await db.execute(update(Product).where(Product.id == product_id)
+                             .values(sold_count=func.coalesce(Product.sold_count, 0) + sign * qty))
+
+    async def sync_order(self, db: AsyncSession, order: Order, day: date = None) -> bool:
+        """Book or un-book ``order`` after a status change; True when product sold counts moved."""
+        if order.status in COUNTED_STATUSES:
+            booked = await self._claim(db, order.id, day or local_day())
+            if booked is None:
+                return False
+            await self._apply(db, order, booked, 1)
+            self.booked += 1
+            return True
+        if order.status == "cancelled":
+            booked = await self._claim(db, order.id, None)
+            if booked is None:
+                return False
+            await self._apply(db, order, booked, -1)
+            self.reversed += 1
+            return True
+        return False
+
+    async def report(self, db: AsyncSession, date_from: date, date_to: date, top: int = 10) -> dict:
+        def in_range(model):
+            return model.day >= date_from, model.day <= date_to
+
+        daily = (await db.scalars(select(SalesDaily).where(*in_range(SalesDaily)).order_by(SalesDaily.day))).all()
+        best = (await db.execute(
+            select(ProductSalesDaily.product_id, ProductSalesDaily.variant_name,
+                   func.max(ProductSalesDaily.product_name),
+                   func.sum(ProductSalesDaily.units), func.sum(ProductSalesDaily.revenue))
+            .where(*in_range(ProductSalesDaily))
+            .group_by(ProductSalesDaily.product_id, ProductSalesDaily.variant_name)
+            .having(func.sum(ProductSalesDaily.units) > 0)
+            .order_by(func.sum(ProductSalesDaily.units).desc(), ProductSalesDaily.product_id)
+            .limit(top)
+        )).all()
+        couriers = (await db.execute(
+            select(CourierSpendDaily.courier_company, func.sum(CourierSpendDaily.orders), func.sum(CourierSpendDaily.shipping))
+            .where(*in_range(CourierSpendDaily))
+            .group_by(CourierSpendDaily.courier_company)
+            .having(func.sum(CourierSpendDaily.orders) > 0)
+            .order_by(func.sum(CourierSpendDaily.shipping).desc())
+        )).all()
+        return {
+            "date_from": date_from.isoformat(),
+            "date_to": date_to.isoformat(),
+            "totals": {
+                "orders": sum(d.orders for d in daily),
+                "units": sum(d.units for d in daily),
+                "revenue": sum(d.revenue for d in daily),
+                "shipping": sum(d.shipping for d in daily),
+            },
+            "daily": [
+                {"day": d.day.isoformat(), "orders": d.orders, "units": d.units, "revenue": d.revenue, "shipping": d.shipping}
+                for d in daily
+            ],
+            "best_sellers": [
+                {"product_id": pid, "variant_name": variant or None, "product_name": name, "units": units, "revenue": revenue}
+                for pid, variant, name, units, revenue in best
+            ],
+            "couriers": [
+                {"courier_company": courier, "orders": orders, "shipping": shipping}
+                for courier, orders, shipping in couriers
+            ],
+        }
+
+    def stats(self) -> dict:
+        return {"booked_orders": self.booked, "reversed_orders": self.reversed}
+
+
+sales_analytics = SalesAnalytics()
+
+
+async def backfill() -> int:
+    """Book paid orders from before the rollups existed, on the day they were last updated."""
+    async with AsyncSessionLocal() as db:
+        orders = (await db.scalars(
+            select(Order).where(Order.status.in_(COUNTED_STATUSES), Order.analytics_day.is_(None))
+        )).all()
+        for order in orders:
+            await sales_analytics.sync_order(db, order, local_day(order.updated_at or order.created_at))
+        await db.commit()
+    return len(orders)
+
+
+if __name__ == "__main__":
+    # python -m app.analytics backfill
+    if sys.argv[1:] != ["backfill"]:
+        print("usage: python -m app.analytics backfill")
+        sys.exit(1)
+    print(f"Booked {asyncio.run(backfill())} orders into the sales rollups")
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import os
+import sys
+from bisect import bisect_left, insort
+from app.config import AREA_INDEX_PATH, AREA_UPSTREAM_LIMIT
+from app.search import normalize, tokenize
+
+MAX_RESULTS = 25
+MIN_QUERY_LENGTH = 3
+
+
+def _area_text(area: dict) -> str:
+    parts = [area.get("name", ""), str(area.get("postal_code", "") or "")]
+    for level in range(1, 4):
+        parts.append(area.get(f"administrative_division_level_{level}_name", "") or "")
+    return " ".join(parts)
+
+
+class AreaIndex:
+    """Prefix index of Biteship areas, answering /api/shipping/areas locally.
+
+    Areas come from upstream responses (``learn``) or an imported area dump
+    (``import_dump``). A query is answered locally when the index holds a
+    full dump, or when an upstream search for a prefix of it came back with
+    fewer than ``upstream_limit`` areas (so it wasn't truncated) and the
+    local search still matches something. Everything learned is appended
+    to a JSON-lines file, so a restart comes back warm; ``load`` rewrites
+    the file without duplicate or redundant records.
+    """
+
+    def __init__(self, path: str, upstream_limit: int):
+        self.path = path
+        self.upstream_limit = upstream_limit
+        self.complete = False
+        self._areas: dict[str, dict] = {}
+        self._area_tokens: dict[str, set[str]] = {}
+        self._entries: list[tuple[str, str]] = []
+        self._covered: set[str] = set()
+        self._pending: list[dict] = []
+        self._flush_lock = asyncio.Lock()
+        self.local_hits = 0
+        self.upstream_misses = 0
+
+    def _add(self, area: dict, bulk: bool = False) -> bool:
+        area_id = area.get("id")
+        if not area_id:
+            return False
+        known = area_id in self._areas
+        self._areas[area_id] = area
+        if known:
+            return False
+        tokens = set(tokenize(_area_text(area)))
+        self._area_tokens[area_id] = tokens
+        for token in tokens:
+            if bulk:
+                self._entries.append((token, area_id))
+            else:
+                insort(self._entries, (token, area_id))
+        return True
+
+    def _is_covered(self, query: str) -> bool:
+        return self.complete or any(query[:i] in self._covered for i in range(MIN_QUERY_LENGTH, len(query) + 1))
+
+    def _minimal_covered(self) -> set[str]:
+        # a covered query under a covered shorter prefix adds nothing
+        return {q for q in self._covered if not any(q[:i] in self._covered for i in range(MIN_QUERY_LENGTH, len(q)))}
+
+    def search(self, query: str, limit: int = MAX_RESULTS) -> list[dict]:
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        # scan the most selective token's prefix range, then check the others per area
+        anchor = max(tokens, key=len)
+        i = bisect_left(self._entries, (anchor, ""))
+        candidates = []
+        seen = set()
+        while i < len(self._entries) and self._entries[i][0].startswith(anchor):
+            area_id = self._entries[i][1]
+            i += 1
+            if area_id in seen:
+                continue
+            seen.add(area_id)
+            area_tokens = self._area_tokens[area_id]
+            if all(any(t.startswith(q) for t in area_tokens) for q in tokens):
+                candidates.append(self._areas[area_id])
+        digits = query.strip()
+        candidates.sort(key=lambda a: (str(a.get("postal_code", "")) != digits, len(a.get("name", "")), a.get("name", "")))
+        return candidates[:limit]
+
+    def lookup(self, query: str) -> list[dict] | None:
+        """Local answer for ``query``, or None when the upstream has to be asked."""
+        normalized = normalize(query).strip()
+        if not self._is_covered(normalized):
+            self.upstream_misses += 1
+            return None
+        areas = self.search(normalized)
+        if not areas and not self.complete:
+            self.upstream_misses += 1
+            return None
+        self.local_hits += 1
+        return areas
+
+    async def learn(self, query: str, areas: list[dict]):
+        normalized = normalize(query).strip()
+        # a full page may be a truncated answer (upstream matching is fuzzy and capped), so longer queries must still ask
+        if len(areas) < self.upstream_limit and not self._is_covered(normalized):
+            self._covered.add(normalized)
+            self._pending.append({"covered": normalized})
+        for area in areas:
+            if self._add(area):
+                self._pending.append({"area": area})
+        await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            records, self._pending = self._pending, []
+            await asyncio.to_thread(self._append, records)
+
+    def _append(self, records: list[dict]):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a") as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        lines = 0
+        with open(self.path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                lines += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "area" in record:
+                    self._add(record["area"], bulk=True)
+                elif "covered" in record:
+                    self._covered.add(record["covered"])
+                elif record.get("complete"):
+                    self.complete = True
+                # {"q": ...} records predate the truncation check and are dropped
+        self._entries.sort()
+        self._covered = set() if self.complete else self._minimal_covered()
+        if lines > self._record_count():
+            self._rewrite()
+            print(f"[Area index] Compacted {lines} records to {self._record_count()}")
+        print(f"[Area index] Loaded {len(self._areas)} areas, complete={self.complete}")
+
+    def _record_count(self) -> int:
+        return int(self.complete) + len(self._covered) + len(self._areas)
+
+    def _rewrite(self):
+        tmp_path = self.path + ".tmp"
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(tmp_path, "w") as f:
+            if self.complete:
+                f.write(json.dumps({"complete": True}) + "\n")
+            for query in sorted(self._covered):
+                f.write(json.dumps({"covered": query}, separators=(",", ":")) + "\n")
+            for area in self._areas.values():
+                f.write(json.dumps({"area": area}, separators=(",", ":")) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def import_dump(self, dump_path: str):
+        """Load a full area dump (JSON list, {"areas": [...]} or JSON lines) and rewrite the index file."""
+        with open(dump_path) as f:
+            raw = f.read()
+        try:
+            data = json.loads(raw)
+            areas = data.get("areas", []) if isinstance(data, dict) else data
+        except ValueError:
+            areas = [json.loads(line) for line in raw.splitlines() if line.strip()]
+        for area in areas:
+            self._add(area, bulk=True)
+        self._entries.sort()
+        self.complete = True
+        self._covered = set()
+        self._rewrite()
+        return len(areas)
+
+    def stats(self) -> dict:
+        return {
+            "areas": len(self._areas),
+            "covered_queries": len(self._covered),
+            "complete": self.complete,
+            "local_hits": self.local_hits,
+            "upstream_misses": self.upstream_misses,
+        }
+
+
+area_index = AreaIndex(AREA_INDEX_PATH, AREA_UPSTREAM_LIMIT)
+
+
+if __name__ == "__main__":
+    # python -m app.area_index import areas.json
+    if len(sys.argv) != 3 or sys.argv[1] != "import":
+        print("usage: python -m app.area_index import <areas.json>")
+        sys.exit(1)
+    area_index.load()
+    count = area_index.import_dump(sys.argv[2])
+    print(f"Imported {count} areas into {area_index.path}")
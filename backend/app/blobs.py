@@ -0,0 +1,248 @@
+import asyncio
+import hashlib
+import os
+import sys
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from fastapi import UploadFile
+from sqlalchemy import select, update, delete, func, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import UPLOAD_MAX_BYTES, BLOB_GC_INTERVAL, BLOB_GC_GRACE
+from app.database import AsyncSessionLocal
+from app.images import UPLOAD_DIR, UPLOAD_URL_PREFIX, RENDITIONS, image_processor
+from app.models import Blob, Product, ProductImage
+
+CHUNK_SIZE = 1024 * 1024
+# one spelling per format, so the same bytes uploaded as .JPG and .jpeg share a blob
+EXTENSIONS = {".jpeg": ".jpg", ".jpe": ".jpg", ".tif": ".tiff"}
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+def blob_filename(image_url: str | None) -> str | None:
+    if not image_url or not image_url.startswith(UPLOAD_URL_PREFIX):
+        return None
+    return image_url[len(UPLOAD_URL_PREFIX):]
+
+
+def _is_original(filename: str) -> bool:
+    stem, ext = os.path.splitext(filename)
+    if ext == ".part" or filename.startswith("."):
+        return False
+    return not any(stem.endswith(f"-{name}") for name in RENDITIONS)
+
+
+class BlobStore:
+    """Content-addressed storage for ``/uploads``.
+
+    Uploads are hashed while they stream to disk and stored as
+    ``<sha256><ext>``, so the same photo uploaded for several products is
+    kept (and rendered) once. Each blob row counts the product images and
+    primary images that point at it; routes call ``retain``/``release`` as
+    they attach and detach images. Blobs nobody references for
+    ``BLOB_GC_GRACE`` (an upload that never got attached, the last product
+    using it deleted) are removed with their renditions by the GC job.
+    """
+
+    def __init__(self, upload_dir: str, max_bytes: int, gc_interval: float, gc_grace: float):
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.gc_interval = gc_interval
+        self.gc_grace = gc_grace
+        self._gc_task: asyncio.Task | None = None
+        # serialises "reuse an existing file" against "GC deletes that file" (one worker process)
+        self._lock = asyncio.Lock()
+        self.stored = 0
+        self.deduplicated = 0
+        self.collected = 0
+        self.bytes_saved = 0
+
+    async def put(self, db: AsyncSession, file: UploadFile) -> tuple[str, bool]:
+        """Stream an upload into the store; returns (filename, whether the content was new).
+
+        The blob row is created or touched, not retained: the upload only
+        counts once a product image references it.
+        """
+        ext = os.path.splitext(file.filename or "image.jpg")[1].lower() or ".jpg"
+        ext = EXTENSIONS.get(ext, ext)
+        partial = os.path.join(self.upload_dir, f".{uuid.uuid4().hex}.part")
+        digest, size = hashlib.sha256(), 0
+        out = await asyncio.to_thread(open, partial, "wb")
+        try:
+            while chunk := await file.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise BlobTooLarge()
+                digest.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+        except BaseException:
+            await asyncio.to_thread(out.close)
+            await asyncio.to_thread(os.remove, partial)
+            raise
+        await asyncio.to_thread(out.close)
+
+        filename = digest.hexdigest() + ext
+        path = os.path.join(self.upload_dir, filename)
+        async with self._lock:
+            existing = await db.get(Blob, filename)
+            if existing is not None and await asyncio.to_thread(os.path.exists, path):
+                await asyncio.to_thread(os.remove, partial)
+                existing.updated_at = datetime.utcnow()
+                created = False
+            else:
+                await asyncio.to_thread(os.replace, partial, path)
+                if existing is None:
+                    db.add(Blob(filename=filename, sha256=digest.hexdigest(), size=size, refcount=0))
+                else:
+                    existing.updated_at = datetime.utcnow()
+                created = True
+            await db.commit()
+        if created:
+            self.stored += 1
+        else:
+            self.deduplicated += 1
+            self.bytes_saved += size
+        return filename, created
+
+    async def discard(self, db: AsyncSession, filename: str):
+        """Drop a just-stored blob that turned out unusable (e.g. not an image)."""
+        async with self._lock:
+            result = await db.execute(delete(Blob).where(Blob.filename == filename, Blob.refcount <= 0))
+            await db.commit()
+            if result.rowcount:
+                await asyncio.to_thread(image_processor.remove, filename)
+
+    async def _adjust(self, db: AsyncSession, image_urls, sign: int):
+        counts = Counter(f for f in map(blob_filename, image_urls) if f)
+        by_amount: dict[int, list[str]] = {}
+        for filename, n in counts.items():
+            by_amount.setdefault(n, []).append(filename)
+        for n, filenames in by_amount.items():
+            await db.execute(
+                update(Blob).where(Blob.filename.in_(sorted(filenames)))
+                .values(refcount=Blob.refcount + sign * n, updated_at=datetime.utcnow())
+            )
+
+    async def retain(self, db: AsyncSession, image_urls):
+        """Count new references (in the caller's transaction); URLs outside /uploads are ignored."""
+        await self._adjust(db, image_urls, 1)
+
+    async def release(self, db: AsyncSession, image_urls):
+        await self._adjust(db, image_urls, -1)
+
+    @staticmethod
+    def _references(filename: str):
+        url = UPLOAD_URL_PREFIX + filename
+        return (
+            select(func.count()).select_from(ProductImage).where(ProductImage.image_url == url).scalar_subquery()
+            + select(func.count()).select_from(Product).where(Product.primary_image == url).scalar_subquery()
+        )
+
+    async def collect(self) -> int:
+        """Delete blobs that have been unreferenced for longer than the grace period; returns how many."""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.gc_grace)
+        async with AsyncSessionLocal() as db:
+            candidates = (await db.scalars(
+                select(Blob.filename).where(Blob.refcount <= 0, Blob.updated_at < cutoff).limit(500)
+            )).all()
+            collected = 0
+            for filename in candidates:
+                async with self._lock:
+                    # counts are maintained by the routes; check the real references before deleting anything
+                    references = await db.scalar(select(self._references(filename)))
+                    if references:
+                        await db.execute(update(Blob).where(Blob.filename == filename).values(refcount=references))
+                        await db.commit()
+                        print(f"[Blobs] Corrected refcount of {filename} to {references}")
+                        continue
+                    result = await db.execute(
+                        delete(Blob).where(Blob.filename == filename, Blob.refcount <= 0, Blob.updated_at < cutoff)
+                    )
+                    await db.commit()
+                    if result.rowcount:
+                        await asyncio.to_thread(image_processor.remove, filename)
+                        collected += 1
+        self.collected += collected
+        return collected
+
+    async def rebuild(self) -> tuple[int, int]:
+        """Register files already in the upload directory and recount every blob from the database.
+
+        Returns (files registered, blobs whose count changed). Files uploaded
+        before the blob store keep their names; only new uploads are deduplicated.
+        """
+        names = [n for n in await asyncio.to_thread(os.listdir, self.upload_dir) if _is_original(n)]
+        async with AsyncSessionLocal() as db:
+            known = set((await db.scalars(select(Blob.filename))).all())
+            registered = 0
+            for name in names:
+                if name in known:
+                    continue
+                size = await asyncio.to_thread(os.path.getsize, os.path.join(self.upload_dir, name))
+                db.add(Blob(filename=name, sha256=None, size=size, refcount=0))
+                registered += 1
+            await db.flush()
+            references = (
+                select(func.count()).select_from(ProductImage)
+                .where(ProductImage.image_url == literal(UPLOAD_URL_PREFIX) + Blob.filename).scalar_subquery()
+                + select(func.count()).select_from(Product)
+                .where(Product.primary_image == literal(UPLOAD_URL_PREFIX) + Blob.filename).scalar_subquery()
+            )
+            result = await db.execute(
+                update(Blob).where(Blob.refcount != references)
+                .values(refcount=references, updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        return registered, result.rowcount
+
+    async def usage(self, db: AsyncSession) -> dict:
+        blobs, size, unreferenced = (await db.execute(
+            select(func.count(), func.coalesce(func.sum(Blob.size), 0), func.count().filter(Blob.refcount <= 0))
+        )).one()
+        return {"blobs": blobs, "bytes": size, "unreferenced": unreferenced}
+
+    async def _gc_loop(self):
+        while True:
+            await asyncio.sleep(self.gc_interval)
+            try:
+                collected = await self.collect()
+                if collected:
+                    print(f"[Blobs] Collected {collected} unreferenced uploads")
+            except Exception as e:
+                print(f"[Blobs] GC failed: {e}")
+
+    def start(self):
+        self._gc_task = asyncio.create_task(self._gc_loop())
+
+    def shutdown(self):
+        if self._gc_task is not None:
+            self._gc_task.cancel()
+            self._gc_task = None
+
+    def stats(self) -> dict:
+        return {
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+            "bytes_saved": self.bytes_saved,
+            "collected": self.collected,
+        }
+
+
+blob_store = BlobStore(UPLOAD_DIR, UPLOAD_MAX_BYTES, BLOB_GC_INTERVAL, BLOB_GC_GRACE)
+
+
+if __name__ == "__main__":
+    # python -m app.blobs rebuild | gc
+    command = sys.argv[1:]
+    if command == ["rebuild"]:
+        registered, recounted = asyncio.run(blob_store.rebuild())
+        print(f"Registered {registered} existing uploads, corrected {recounted} reference counts")
+    elif command == ["gc"]:
+        print(f"Collected {asyncio.run(blob_store.collect())} unreferenced uploads")
+    else:
+        print("usage: python -m app.blobs rebuild | gc")
+        sys.exit(1)
@@ -0,0 +1,131 @@
+import time
+from collections import OrderedDict
+from app.config import CATALOG_CACHE_SIZE
+
+
+class VersionedLRUCache:
+    """Bounded LRU cache of serialized payloads with a version stamp.
+
+    Writers call ``invalidate()``, which bumps the version and drops every entry.
+    Readers take ``version`` before querying the database and pass it back to
+    ``set()``; a payload computed before an invalidation is then discarded
+    instead of being cached stale.
+
+    An entry can be stored with the ids of the products it shows. A change
+    that only touches those products' payloads (stock held or released)
+    calls ``invalidate(product_ids)``, which drops just the entries showing
+    one of them plus the entries stored without ids.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.partial_invalidations = 0
+        self._entries: OrderedDict = OrderedDict()
+        # key -> ids of the products the entry shows; absent when it depends on the whole catalogue
+        self._products: dict = {}
+
+    def get(self, key):
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, version: int, product_ids=None):
+        if version != self.version or self.max_entries <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if product_ids is None:
+            self._products.pop(key, None)
+        else:
+            self._products[key] = frozenset(product_ids)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._products.pop(evicted, None)
+            self.evictions += 1
+
+    def invalidate(self, product_ids=None):
+        self.version += 1
+        if product_ids is None:
+            self._entries.clear()
+            self._products.clear()
+            return
+        product_ids = set(product_ids)
+        self.partial_invalidations += 1
+        for key in list(self._entries):
+            shown = self._products.get(key)
+            if shown is None or not shown.isdisjoint(product_ids):
+                del self._entries[key]
+                self._products.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "version": self.version,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "partial_invalidations": self.partial_invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire ``ttl`` seconds after being set."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Per-process: with several uvicorn workers each keeps (and invalidates) its own copy.
+catalog_cache = VersionedLRUCache(CATALOG_CACHE_SIZE)
@@ -4,8 +4,117 @@ DATABASE_URL = os.environ.get("DATABASE_URL", "")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is required")
 
+
+def _async_database_url(url: str) -> str:
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    if url.startswith("postgresql://") or url.startswith("postgresql+psycopg2://"):
+        # asyncpg spells libpq's sslmode query parameter as ssl
+        return "postgresql+asyncpg://" + url.split("://", 1)[1].replace("sslmode=", "ssl=")
+    return url
+
+
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL", "") or _async_database_url(DATABASE_URL)
+
 JWT_SECRET = os.environ.get("JWT_SECRET", "change-me-in-production")
 MIDTRANS_SERVER_KEY = os.environ.get("MIDTRANS_SERVER_KEY", "")
 MIDTRANS_CLIENT_KEY = os.environ.get("MIDTRANS_CLIENT_KEY", "")
 MIDTRANS_IS_PRODUCTION = os.environ.get("MIDTRANS_IS_PRODUCTION", "false").lower() == "true"
 BITESHIP_API_KEY = os.environ.get("BITESHIP_API_KEY", "")
+BITESHIP_BASE_URL = os.environ.get("BITESHIP_BASE_URL", "https://api.biteship.com")
+
+# Shared upstream HTTP clients (Biteship, Midtrans)
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "15"))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "2"))
+BITESHIP_MAX_CONCURRENCY = int(os.environ.get("BITESHIP_MAX_CONCURRENCY", "10"))
+MIDTRANS_MAX_CONCURRENCY = int(os.environ.get("MIDTRANS_MAX_CONCURRENCY", "10"))
+
+CATALOG_CACHE_SIZE = int(os.environ.get("CATALOG_CACHE_SIZE", "512"))
+# "memory" keeps an in-process inverted index (single node); "postgres" uses full-text/pg_trgm indexes
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "memory").lower()
+
+# "cache": short-TTL per-process user lookup cache; "claims": user fields travel signed inside the JWT
+AUTH_CONTEXT_MODE = os.environ.get("AUTH_CONTEXT_MODE", "cache").lower()
+USER_CONTEXT_TTL = float(os.environ.get("USER_CONTEXT_TTL", "60"))
+
+# bcrypt cost for new hashes; logins transparently rehash passwords stored with a different cost
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+BCRYPT_WORKERS = int(os.environ.get("BCRYPT_WORKERS", str(min(4, os.cpu_count() or 1))))
+BCRYPT_MAX_PENDING = int(os.environ.get("BCRYPT_MAX_PENDING", "64"))
+
+RATE_CACHE_TTL = float(os.environ.get("RATE_CACHE_TTL", "600"))
+RATE_CACHE_SIZE = int(os.environ.get("RATE_CACHE_SIZE", "2048"))
+
+# Local Biteship area index, persisted as JSON lines so restarts keep it warm
+AREA_INDEX_PATH = os.environ.get("AREA_INDEX_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "area_index.jsonl"))
+# Most areas Biteship returns for one /v1/maps/areas search; an answer this long may be truncated,
+# so it is cached but never treated as complete for longer queries
+AREA_UPSTREAM_LIMIT = int(os.environ.get("AREA_UPSTREAM_LIMIT", "10"))
+
+# Longest a payment request waits on an order's background shipping validation before using the submitted cost
+ORDER_VALIDATION_WAIT = float(os.environ.get("ORDER_VALIDATION_WAIT", "10"))
+
+ORDER_SUMMARY_TTL = float(os.environ.get("ORDER_SUMMARY_TTL", "30"))
+
+# Stock held for an unpaid order; a little longer than Midtrans' default 24h payment window
+STOCK_RESERVATION_TTL = float(os.environ.get("STOCK_RESERVATION_TTL", str(25 * 3600)))
+STOCK_SWEEP_INTERVAL = float(os.environ.get("STOCK_SWEEP_INTERVAL", "60"))
+
+# Sales rollups bucket orders by local calendar day (WIB by default)
+ANALYTICS_UTC_OFFSET_HOURS = float(os.environ.get("ANALYTICS_UTC_OFFSET_HOURS", "7"))
+
+# Background Biteship tracking poller (app.tracking); the webhook makes most polls unnecessary
+TRACKING_POLL_INTERVAL = float(os.environ.get("TRACKING_POLL_INTERVAL", "60"))
+TRACKING_BATCH_SIZE = int(os.environ.get("TRACKING_BATCH_SIZE", "50"))
+TRACKING_MAX_INTERVAL = float(os.environ.get("TRACKING_MAX_INTERVAL", str(6 * 3600)))
+# shared secret for POST /api/shipping/webhook, sent as ?token= or the X-Webhook-Token header; while empty every
+# webhook is rejected and shipments are tracked by the poller alone
+BITESHIP_WEBHOOK_TOKEN = os.environ.get("BITESHIP_WEBHOOK_TOKEN", "")
+
+# Bulk shipment booking (POST /api/shipping/create-orders); kept below BITESHIP_MAX_CONCURRENCY so
+# rate quotes and tracking still get connections during a fulfilment run
+BULK_SHIPMENT_CONCURRENCY = int(os.environ.get("BULK_SHIPMENT_CONCURRENCY", "6"))
+BULK_SHIPMENT_MAX_ORDERS = int(os.environ.get("BULK_SHIPMENT_MAX_ORDERS", "1000"))
+
+# Rendered shipping labels, cached per order version (app.labels)
+LABEL_CACHE_SIZE = int(os.environ.get("LABEL_CACHE_SIZE", "2048"))
+LABEL_BATCH_MAX = int(os.environ.get("LABEL_BATCH_MAX", "500"))
+
+# Image uploads (app.images): originals are kept, buyers get resized WebP/AVIF renditions
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", str(min(2, os.cpu_count() or 1))))
+IMAGE_MAX_PENDING = int(os.environ.get("IMAGE_MAX_PENDING", "16"))
+# Content-addressed upload store (app.blobs): unreferenced uploads are deleted after the grace period
+BLOB_GC_INTERVAL = float(os.environ.get("BLOB_GC_INTERVAL", "3600"))
+BLOB_GC_GRACE = float(os.environ.get("BLOB_GC_GRACE", str(24 * 3600)))
+
+# /uploads serving (app.media): content-addressed files are immutable, others revalidate after MEDIA_MAX_AGE
+MEDIA_MAX_AGE = int(os.environ.get("MEDIA_MAX_AGE", "3600"))
+MEDIA_CHUNK_SIZE = int(os.environ.get("MEDIA_CHUNK_SIZE", str(1024 * 1024)))
+
+# Midtrans notifications (app.payment_notifications): recorded by the webhook, applied in batches by a worker
+PAYMENT_NOTIFICATION_BATCH_SIZE = int(os.environ.get("PAYMENT_NOTIFICATION_BATCH_SIZE", "200"))
+PAYMENT_NOTIFICATION_POLL_INTERVAL = float(os.environ.get("PAYMENT_NOTIFICATION_POLL_INTERVAL", "5"))
+
+# Snap tokens (app.payment_sessions): created after checkout, reused until REFRESH_MARGIN seconds before expiry
+PAYMENT_TOKEN_TTL_MINUTES = int(os.environ.get("PAYMENT_TOKEN_TTL_MINUTES", str(24 * 60)))
+PAYMENT_TOKEN_REFRESH_MARGIN = float(os.environ.get("PAYMENT_TOKEN_REFRESH_MARGIN", "600"))
+
+# Payment reconciliation (app.payment_reconciler): pending orders are re-checked with Midtrans every RECHECK seconds
+PAYMENT_RECONCILE_INTERVAL = float(os.environ.get("PAYMENT_RECONCILE_INTERVAL", "60"))
+PAYMENT_RECONCILE_BATCH_SIZE = int(os.environ.get("PAYMENT_RECONCILE_BATCH_SIZE", "100"))
+PAYMENT_RECONCILE_RECHECK = float(os.environ.get("PAYMENT_RECONCILE_RECHECK", "300"))
+# status API calls started per second by the sweep
+PAYMENT_RECONCILE_RATE = float(os.environ.get("PAYMENT_RECONCILE_RATE", "10"))
+PAYMENT_REFRESH_MIN_INTERVAL = float(os.environ.get("PAYMENT_REFRESH_MIN_INTERVAL", "10"))
+
+# Most operations accepted by one POST /api/cart/batch
+CART_BATCH_MAX = int(os.environ.get("CART_BATCH_MAX", "100"))
+
+# Guest carts (app.guest_carts): shoppers who haven't logged in keep their cart out of the database until
+# login/register merges it; "memory" is per process, "redis" is any Redis-compatible server shared by workers
+GUEST_CART_BACKEND = os.environ.get("GUEST_CART_BACKEND", "memory").lower()
+GUEST_CART_REDIS_URL = os.environ.get("GUEST_CART_REDIS_URL", "redis://127.0.0.1:6379/0")
+GUEST_CART_TTL = float(os.environ.get("GUEST_CART_TTL", str(7 * 24 * 3600)))
+GUEST_CART_MAX_ENTRIES = int(os.environ.get("GUEST_CART_MAX_ENTRIES", "50000"))
+GUEST_CART_MAX_LINES = int(os.environ.get("GUEST_CART_MAX_LINES", "50"))
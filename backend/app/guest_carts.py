@@ -0,0 +1,253 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import secrets
+from urllib.parse import urlparse, unquote
+from starlette.requests import Request
+from starlette.responses import Response
+from app.cache import TTLCache
+from app.config import (
+    JWT_SECRET, GUEST_CART_BACKEND, GUEST_CART_REDIS_URL, GUEST_CART_TTL, GUEST_CART_MAX_ENTRIES,
+    GUEST_CART_MAX_LINES,
+)
+
+COOKIE_NAME = "store_guest_cart"
+
+
+class GuestCartStoreError(Exception):
+    """The guest cart store could not be reached or refused a command."""
+
+
+class MemoryCartStore:
+    """Guest carts in this process, as JSON, expiring ``ttl`` seconds after their last write."""
+
+    backend = "memory"
+
+    def __init__(self, max_entries: int, ttl: float):
+        self._carts = TTLCache(max_entries=max_entries, ttl=ttl)
+
+    async def get(self, cart_id: str) -> str | None:
+        return self._carts.get(cart_id)
+
+    async def set(self, cart_id: str, value: str):
+        self._carts.set(cart_id, value)
+
+    async def delete(self, cart_id: str):
+        self._carts.delete(cart_id)
+
+    async def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, **self._carts.stats()}
+
+
+class RedisCartStore:
+    """Guest carts in a Redis-compatible server (Redis, Valkey, KeyDB, Dragonfly), shared by every worker.
+
+    Only GET, SET EX and DEL are needed, so this speaks RESP itself over one
+    connection instead of pulling in a client library. Commands are
+    serialized on that connection (the server is expected to be local); a
+    dropped connection is reopened once before the error is raised.
+    """
+
+    backend = "redis"
+    KEY_PREFIX = "guest_cart:"
+
+    def __init__(self, url: str, ttl: float):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.ttl = max(int(ttl), 1)
+        self._lock = asyncio.Lock()
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self.commands = 0
+        self.connects = 0
+        self.errors = 0
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self.connects += 1
+        if self.password:
+            await self._roundtrip("AUTH", *([self.username] if self.username else []), self.password)
+        if self.db:
+            await self._roundtrip("SELECT", self.db)
+
+    async def _disconnect(self):
+        writer = self._writer
+        self._drop()
+        if writer is not None:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    def _drop(self):
+        """Close the connection without waiting; safe to call while being cancelled."""
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+
+    async def _roundtrip(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts += [f"${len(data)}\r\n".encode(), data, b"\r\n"]
+        self._writer.write(b"".join(parts))
+        await self._writer.drain()
+        return await self._reply()
+
+    async def _reply(self):
+        line = await self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise GuestCartStoreError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            return (await self._reader.readexactly(length + 2))[:-2]
+        raise ConnectionError(f"unexpected reply {line[:32]!r}")
+
+    async def command(self, *args):
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._writer is None:
+                        await self._connect()
+                    self.commands += 1
+                    return await self._roundtrip(*args)
+                except GuestCartStoreError:
+                    self.errors += 1
+                    raise
+                except (OSError, asyncio.IncompleteReadError) as e:
+                    # a stale connection (server restart, idle timeout) gets one fresh try
+                    await self._disconnect()
+                    if attempt:
+                        self.errors += 1
+                        raise GuestCartStoreError(f"{self.host}:{self.port}: {e}") from e
+                except BaseException:
+                    # cancelled mid-exchange: the reply may still be unread, so the connection can't be reused
+                    self._drop()
+                    raise
+
+    async def get(self, cart_id: str) -> str | None:
+        value = await self.command("GET", self.KEY_PREFIX + cart_id)
+        return value.decode() if value is not None else None
+
+    async def set(self, cart_id: str, value: str):
+        await self.command("SET", self.KEY_PREFIX + cart_id, value, "EX", self.ttl)
+
+    async def delete(self, cart_id: str):
+        await self.command("DEL", self.KEY_PREFIX + cart_id)
+
+    async def close(self):
+        async with self._lock:
+            await self._disconnect()
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "server": f"{self.host}:{self.port}/{self.db}",
+            "connected": self._writer is not None,
+            "commands": self.commands,
+            "connects": self.connects,
+            "errors": self.errors,
+        }
+
+
+class GuestCarts:
+    """Carts of shoppers who haven't logged in, kept out of the database.
+
+    A guest cart is a short list of lines (product id, variant, quantity,
+    unit price and a line id) stored as one JSON value under a random id;
+    the id travels in an HMAC-signed cookie, so a forged or guessed cookie
+    is simply ignored. Browsing and filling the cart only reads products
+    and stock. On login or register routes.cart merges the lines into the
+    account's ``CartItem`` rows in one upsert and the guest cart is dropped.
+    """
+
+    def __init__(self, store, secret: str, ttl: float, max_lines: int):
+        self.store = store
+        self._secret = secret.encode()
+        self.ttl = ttl
+        self.max_lines = max_lines
+        self.loads = 0
+        self.saves = 0
+        self.rejected_cookies = 0
+        self.merges = 0
+        self.merged_lines = 0
+
+    def _sign(self, cart_id: str) -> str:
+        return hmac.new(self._secret, f"guest-cart:{cart_id}".encode(), hashlib.sha256).hexdigest()[:32]
+
+    def cart_id(self, request: Request) -> str | None:
+        """The requester's guest cart id, if the cookie is present and its signature checks out."""
+        cookie = request.cookies.get(COOKIE_NAME)
+        if not cookie:
+            return None
+        cart_id, _, signature = cookie.partition(".")
+        if not cart_id or not hmac.compare_digest(signature, self._sign(cart_id)):
+            self.rejected_cookies += 1
+            return None
+        return cart_id
+
+    @staticmethod
+    def new_id() -> str:
+        return secrets.token_urlsafe(18)
+
+    def set_cookie(self, response: Response, cart_id: str):
+        response.set_cookie(
+            COOKIE_NAME, f"{cart_id}.{self._sign(cart_id)}",
+            httponly=True, samesite="lax", path="/", max_age=int(self.ttl)
+        )
+
+    @staticmethod
+    def clear_cookie(response: Response):
+        response.delete_cookie(COOKIE_NAME, path="/")
+
+    async def load(self, cart_id: str) -> list[dict]:
+        self.loads += 1
+        value = await self.store.get(cart_id)
+        return json.loads(value) if value else []
+
+    async def save(self, cart_id: str, lines: list[dict]):
+        self.saves += 1
+        if lines:
+            await self.store.set(cart_id, json.dumps(lines, separators=(",", ":")))
+        else:
+            await self.store.delete(cart_id)
+
+    async def discard(self, cart_id: str):
+        await self.store.delete(cart_id)
+
+    async def shutdown(self):
+        await self.store.close()
+
+    def stats(self) -> dict:
+        return {
+            "store": self.store.stats(),
+            "loads": self.loads,
+            "saves": self.saves,
+            "rejected_cookies": self.rejected_cookies,
+            "merges": self.merges,
+            "merged_lines": self.merged_lines,
+        }
+
+
+_store = (
+    RedisCartStore(GUEST_CART_REDIS_URL, GUEST_CART_TTL) if GUEST_CART_BACKEND == "redis"
+    else MemoryCartStore(GUEST_CART_MAX_ENTRIES, GUEST_CART_TTL)
+)
+guest_carts = GuestCarts(_store, JWT_SECRET, GUEST_CART_TTL, GUEST_CART_MAX_LINES)
@@ -0,0 +1,81 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+from app.config import BCRYPT_ROUNDS, BCRYPT_WORKERS, BCRYPT_MAX_PENDING
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Runs bcrypt on a dedicated bounded thread pool instead of the event loop.
+
+    bcrypt releases the GIL while hashing, so threads give real parallelism.
+    At most ``max_pending`` calls may be queued or running; past that new
+    calls fail fast with ``HasherBusy`` rather than growing the queue.
+    """
+
+    def __init__(self, rounds: int, workers: int, max_pending: int):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+        self.total_seconds = 0.0
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HasherBusy()
+        self.pending += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.pending - self.workers, 0)
+        submitted = time.perf_counter()
+
+        def job():
+            return fn(*args), time.perf_counter()
+
+        try:
+            result, finished = await asyncio.get_running_loop().run_in_executor(self._executor, job)
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        self.total_seconds += finished - submitted
+        return result
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._run(bcrypt.hashpw, password.encode(), bcrypt.gensalt(self.rounds))
+        return hashed.decode()
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._run(bcrypt.checkpw, password.encode(), password_hash.encode())
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        # $2b$10$<salt+hash>: the second field is the cost factor
+        try:
+            return int(password_hash.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return False
+
+    def stats(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "queued": max(self.pending - self.workers, 0),
+            "max_queue_depth": self.max_queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_latency_ms": round(self.total_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_hasher = PasswordHasher(BCRYPT_ROUNDS, BCRYPT_WORKERS, BCRYPT_MAX_PENDING)
@@ -0,0 +1,135 @@
+import asyncio
+import base64
+import random
+import httpx
+from app.config import (
+    BITESHIP_API_KEY, BITESHIP_BASE_URL, BITESHIP_MAX_CONCURRENCY,
+    MIDTRANS_SERVER_KEY, MIDTRANS_MAX_CONCURRENCY,
+    HTTP_TIMEOUT, HTTP_MAX_RETRIES,
+)
+
+RETRY_STATUSES = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class ProviderClient:
+    """Keep-alive connection pool plus concurrency, timeout and retry policy for one upstream API.
+
+    Failures where the request never reached the provider (connect errors,
+    pool timeouts) are retried for any method. Read timeouts and 429/5xx
+    responses are only retried for idempotent calls, i.e. GETs or requests
+    made with ``idempotent=True``.
+    """
+
+    def __init__(self, name: str, base_url: str = "", headers: dict = None,
+                 max_concurrency: int = 10, timeout: float = HTTP_TIMEOUT,
+                 max_retries: int = HTTP_MAX_RETRIES, backoff: float = 0.25):
+        self.name = name
+        self.base_url = base_url
+        self.headers = headers or {}
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._client: httpx.AsyncClient | None = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.in_flight = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                    keepalive_expiry=60,
+                ),
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def request(self, method: str, url: str, *, idempotent: bool = None, **kwargs) -> httpx.Response:
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                async with self._semaphore:
+                    self.in_flight += 1
+                    self.requests += 1
+                    try:
+                        resp = await self.client.request(method, url, **kwargs)
+                    finally:
+                        self.in_flight -= 1
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                if attempt > self.max_retries:
+                    self.failures += 1
+                    raise
+            except (httpx.ReadTimeout, httpx.RemoteProtocolError):
+                if not idempotent or attempt > self.max_retries:
+                    self.failures += 1
+                    raise
+            else:
+                if resp.status_code not in RETRY_STATUSES or not idempotent or attempt > self.max_retries:
+                    return resp
+                await resp.aclose()
+            self.retries += 1
+            await asyncio.sleep(self.backoff * (2 ** (attempt - 1)) * (0.5 + random.random()))
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+        }
+
+
+biteship = ProviderClient(
+    "biteship",
+    base_url=BITESHIP_BASE_URL,
+    headers={
+        "Authorization": f"Bearer {BITESHIP_API_KEY}",
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+    },
+    max_concurrency=BITESHIP_MAX_CONCURRENCY,
+)
+
+# Snap and the Core status API live on different hosts, so callers pass absolute URLs.
+midtrans = ProviderClient(
+    "midtrans",
+    headers={
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+        "Authorization": "Basic " + base64.b64encode(f"{MIDTRANS_SERVER_KEY}:".encode()).decode(),
+    },
+    max_concurrency=MIDTRANS_MAX_CONCURRENCY,
+)
+
+PROVIDERS = (biteship, midtrans)
+
+
+async def close_all():
+    for provider in PROVIDERS:
+        await provider.aclose()
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+from app.config import IMAGE_WORKERS, IMAGE_MAX_PENDING
+
+UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "uploads")
+UPLOAD_URL_PREFIX = "/uploads/"
+
+# rendition name -> target width in px (never upscaled); ProductCard uses card, ProductDetail detail/thumb
+RENDITIONS = {"detail": 1200, "card": 480, "thumb": 160}
+# preferred first; AVIF only where this Pillow build can encode it
+FORMATS = [f for f in ("avif", "webp") if features.check(f)]
+SAVE_OPTIONS = {
+    "avif": {"quality": 55, "speed": 8},
+    "webp": {"quality": 80, "method": 4},
+}
+
+
+class InvalidImage(Exception):
+    pass
+
+
+class ImageBusy(Exception):
+    pass
+
+
+def rendition_filename(filename: str, name: str, fmt: str) -> str:
+    return f"{os.path.splitext(filename)[0]}-{name}.{fmt}"
+
+
+class ImageProcessor:
+    """Resized WebP/AVIF renditions of uploads (stored by app.blobs) on a bounded thread pool.
+
+    Decoding and encoding run on a dedicated pool (Pillow releases the GIL
+    for most of it); like the password hasher, at most ``max_pending`` jobs
+    may be queued or running and past that callers get ``ImageBusy``.
+    Renditions are written next to the original as
+    ``<name>-<rendition>.<format>`` and described by the dict ``process``
+    returns, which is what ``ProductImage.renditions`` stores.
+    """
+
+    def __init__(self, upload_dir: str, workers: int, max_pending: int):
+        self.upload_dir = upload_dir
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="images")
+        self.pending = 0
+        self.processed = 0
+        self.rejected = 0
+        self.bytes_out = 0
+        self.total_seconds = 0.0
+        os.makedirs(upload_dir, exist_ok=True)
+
+    def _render(self, filename: str) -> dict:
+        path = os.path.join(self.upload_dir, filename)
+        try:
+            with Image.open(path) as original:
+                # JPEG decodes straight to a reduced size (1/2 .. 1/8) when that still covers the largest rendition
+                largest = max(RENDITIONS.values())
+                original.draft("RGB", (largest, largest))
+                image = ImageOps.exif_transpose(original)
+                image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+            raise InvalidImage(str(e)) from e
+
+        renditions, written = {}, 0
+        # largest first, each one downscaled from the previous
+        for name, width in sorted(RENDITIONS.items(), key=lambda r: -r[1]):
+            if image.width > width:
+                image = image.resize((width, max(round(image.height * width / image.width), 1)), Image.LANCZOS)
+            entry = {"width": image.width, "height": image.height}
+            for fmt in FORMATS:
+                out_name = rendition_filename(filename, name, fmt)
+                out_path = os.path.join(self.upload_dir, out_name)
+                image.save(out_path + ".part", format=fmt.upper(), **SAVE_OPTIONS[fmt])
+                os.replace(out_path + ".part", out_path)
+                written += os.path.getsize(out_path)
+                entry[fmt] = UPLOAD_URL_PREFIX + out_name
+            renditions[name] = entry
+        self.bytes_out += written
+        return renditions
+
+    async def process(self, filename: str) -> dict:
+        """Generate every rendition of an uploaded file; raises InvalidImage for non-images."""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ImageBusy()
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            renditions = await asyncio.get_running_loop().run_in_executor(self._executor, self._render, filename)
+        finally:
+            self.pending -= 1
+        self.processed += 1
+        self.total_seconds += time.perf_counter() - started
+        return renditions
+
+    def renditions_for(self, image_url: str | None) -> dict | None:
+        """Renditions already on disk for an uploaded image URL (None for external or unprocessed images)."""
+        if not image_url or not image_url.startswith(UPLOAD_URL_PREFIX):
+            return None
+        filename = image_url[len(UPLOAD_URL_PREFIX):]
+        renditions = {}
+        for name in RENDITIONS:
+            entry = {}
+            for fmt in FORMATS:
+                out_path = os.path.join(self.upload_dir, rendition_filename(filename, name, fmt))
+                if not os.path.exists(out_path):
+                    continue
+                if not entry:
+                    try:
+                        with Image.open(out_path) as rendition:  # reads the header only
+                            entry["width"], entry["height"] = rendition.size
+                    except (UnidentifiedImageError, OSError):
+                        continue
+                entry[fmt] = UPLOAD_URL_PREFIX + os.path.basename(out_path)
+            if entry:
+                renditions[name] = entry
+        return renditions or None
+
+    def remove(self, filename: str):
+        for name in RENDITIONS:
+            for fmt in ("avif", "webp"):
+                try:
+                    os.remove(os.path.join(self.upload_dir, rendition_filename(filename, name, fmt)))
+                except FileNotFoundError:
+                    pass
+        try:
+            os.remove(os.path.join(self.upload_dir, filename))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "formats": FORMATS,
+            "pending": self.pending,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "bytes_out": self.bytes_out,
+            "avg_process_ms": round(self.total_seconds / self.processed * 1000, 2) if self.processed else 0.0,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+image_processor = ImageProcessor(UPLOAD_DIR, IMAGE_WORKERS, IMAGE_MAX_PENDING)
+
+
+def renditions_json(image_url: str | None) -> str | None:
+    renditions = image_processor.renditions_for(image_url)
+    return json.dumps(renditions) if renditions else None
+
+
+async def backfill() -> int:
+    """Generate renditions for uploaded images that predate them and record them on products."""
+    from sqlalchemy import select
+    from app.database import AsyncSessionLocal
+    from app.models import Product, ProductImage
+
+    done = 0
+    async with AsyncSessionLocal() as db:
+        images = (await db.scalars(select(ProductImage).where(ProductImage.renditions.is_(None)))).all()
+        products = (await db.scalars(select(Product).where(Product.primary_image_renditions.is_(None)))).all()
+        urls = {i.image_url for i in images} | {p.primary_image for p in products}
+        for url in sorted(u for u in urls if u and u.startswith(UPLOAD_URL_PREFIX)):
+            filename = url[len(UPLOAD_URL_PREFIX):]
+            if not os.path.exists(os.path.join(UPLOAD_DIR, filename)) or image_processor.renditions_for(url):
+                continue
+            try:
+                await image_processor.process(filename)
+                done += 1
+            except InvalidImage as e:
+                print(f"[Images] Skipping {filename}: {e}")
+        for image in images:
+            image.renditions = renditions_json(image.image_url)
+        for product in products:
+            product.primary_image_renditions = renditions_json(product.primary_image)
+        await db.commit()
+    return done
+
+
+if __name__ == "__main__":
+    # python -m app.images backfill
+    if sys.argv[1:] != ["backfill"]:
+        print("usage: python -m app.images backfill")
+        sys.exit(1)
+    print(f"Generated renditions for {asyncio.run(backfill())} images")
@@ -0,0 +1,376 @@
+import asyncio
+import random
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.cache import catalog_cache
+from app.config import STOCK_RESERVATION_TTL, STOCK_SWEEP_INTERVAL
+from app.database import AsyncSessionLocal
+from app.models import Order, OrderItem, Product, ProductVariant, StockReservation, StockShard, gen_id
+
+HELD = "held"
+COMMITTED = "committed"
+RELEASED = "released"
+
+# every status an order can reach after payment; sellers may move a paid order straight to any of them
+PAID_STATUSES = ("paid", "processing", "shipped", "completed")
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id: str, variant_name: str | None):
+        super().__init__(f"insufficient stock for {product_id} {variant_name or ''}".strip())
+        self.product_id = product_id
+        self.variant_name = variant_name
+
+
+def _variant_clause(model, variant_name: str | None):
+    return model.variant_name.is_(None) if variant_name is None else model.variant_name == variant_name
+
+
+def _merge_lines(lines) -> list[tuple[str, str | None, int]]:
+    totals: dict[tuple, int] = {}
+    for product_id, variant_name, quantity in lines:
+        key = (product_id, variant_name or None)
+        totals[key] = totals.get(key, 0) + int(quantity)
+    # one lock order for every order, so two carts touching the same SKUs never deadlock
+    return sorted(((p, v, q) for (p, v), q in totals.items()), key=lambda line: (line[0], line[1] or ""))
+
+
+class StockReservations:
+    """Atomic stock holds for orders.
+
+    Every decrement is a single conditional ``UPDATE ... SET stock = stock - q
+    WHERE stock >= q``, so concurrent checkouts never read-modify-write and a
+    SKU can't go negative. A line uses its variant's stock when the variant
+    row exists and the product's stock otherwise. Holds are released when the
+    order is cancelled or expires, and committed once it's paid.
+
+    Very hot SKUs can be split across ``stock_shards`` rows (``shard``) so
+    concurrent reservations update different rows instead of queueing on one.
+    While sharded the variant/product row only holds what wasn't sharded;
+    ``available`` sums both. ``_sharded`` is just a routing hint; a SKU
+    sharded by another process is found when its row comes up empty.
+    """
+
+    def __init__(self, ttl: float, sweep_interval: float):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._sharded: set[tuple[str, str | None]] = set()
+        self._sweeper: asyncio.Task | None = None
+        self.reserved = 0
+        self.rejected = 0
+        self.committed = 0
+        self.reacquired = 0
+        self.released = 0
+        self.expired = 0
+
+    async def _variant_id(self, db: AsyncSession, product_id: str, variant_name: str | None) -> str | None:
+        if variant_name is None:
+            return None
+        return await db.scalar(
+            select(ProductVariant.id)
+            .where(ProductVariant.product_id == product_id, ProductVariant.variant_name == variant_name)
+            .limit(1)
+        )
+
+    async def _take(self, db: AsyncSession, product_id: str, variant_id: str | None, quantity: int) -> bool:
+        if variant_id:
+            stmt = update(ProductVariant).where(ProductVariant.id == variant_id, ProductVariant.stock >= quantity) \
+                .values(stock=ProductVariant.stock - quantity)
+        else:
+            stmt = update(Product).where(Product.id == product_id, Product.stock >= quantity) \
+                .values(stock=Product.stock - quantity)
+        return (await db.execute(stmt)).rowcount == 1
+
+    async def _take_from_shards(self, db: AsyncSession, product_id: str, variant_name: str | None, quantity: int) -> bool | None:
+        """None when the SKU has no shards at all."""
+        shard_ids = (await db.scalars(
+            select(StockShard.id).where(StockShard.product_id == product_id, _variant_clause(StockShard, variant_name))
+        )).all()
+        if not shard_ids:
+            return None
+        # start at a random shard so concurrent reservations spread over the rows
+        start = random.randrange(len(shard_ids))
+        for shard_id in shard_ids[start:] + shard_ids[:start]:
+            result = await db.execute(
+                update(StockShard).where(StockShard.id == shard_id, StockShard.stock >= quantity)
+                .values(stock=StockShard.stock - quantity)
+            )
+            if result.rowcount == 1:
+                return True
+        return False
+
+    async def _put_back(self, db: AsyncSession, product_id: str, variant_name: str | None, quantity: int):
+        shard_id = await db.scalar(
+            select(StockShard.id).where(StockShard.product_id == product_id, _variant_clause(StockShard, variant_name))
+            .order_by(func.random()).limit(1)
+        )
+        if shard_id:
+            await db.execute(update(StockShard).where(StockShard.id == shard_id).values(stock=StockShard.stock + quantity))
+            return
+        variant_id = await self._variant_id(db, product_id, variant_name)
+        if variant_id:
+            await db.execute(update(ProductVariant).where(ProductVariant.id == variant_id).values(stock=ProductVariant.stock + quantity))
+        else:
+            await db.execute(update(Product).where(Product.id == product_id).values(stock=Product.stock + quantity))
+
+    async def reserve(self, db: AsyncSession, order_id: str, lines) -> list[StockReservation]:
+        """Hold stock for ``lines`` of (product_id, variant_name, quantity) inside the caller's transaction.
+
+        Raises ``OutOfStock`` on the first line that can't be covered; the
+        caller rolls back, which undoes the decrements already made.
+        """
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl)
+        reservations = []
+        for product_id, variant_name, quantity in _merge_lines(lines):
+            variant_id = await self._variant_id(db, product_id, variant_name)
+            held_variant = variant_name if variant_id else None
+            key = (product_id, held_variant)
+            if key in self._sharded:
+                ok = await self._take_from_shards(db, product_id, held_variant, quantity)
+                if ok is None:
+                    self._sharded.discard(key)
+                if not ok:
+                    # stock the seller added to the row while the SKU was sharded
+                    ok = await self._take(db, product_id, variant_id, quantity)
+            else:
+                ok = await self._take(db, product_id, variant_id, quantity)
+                # the hint set is per process: a SKU sharded elsewhere shows up as an empty row
+                if not ok and await self._take_from_shards(db, product_id, held_variant, quantity):
+                    self._sharded.add(key)
+                    ok = True
+            if not ok:
+                self.rejected += 1
+                raise OutOfStock(product_id, variant_name)
+            reservations.append(StockReservation(
+                id=gen_id(), order_id=order_id, product_id=product_id, variant_name=held_variant,
+                quantity=quantity, status=HELD, expires_at=expires_at,
+            ))
+        db.add_all(reservations)
+        self.reserved += 1
+        return reservations
+
+    async def _claim(self, db: AsyncSession, order_id: str, status: str) -> list:
+        # the status flip is the claim: of two concurrent releases only one gets rows back
+        return (await db.execute(
+            update(StockReservation)
+            .where(StockReservation.order_id == order_id, StockReservation.status == HELD)
+            .values(status=status)
+            .returning(StockReservation.product_id, StockReservation.variant_name, StockReservation.quantity)
+        )).all()
+
+    async def release(self, db: AsyncSession, order_id: str) -> int:
+        rows = await self._claim(db, order_id, RELEASED)
+        for product_id, variant_name, quantity in rows:
+            await self._put_back(db, product_id, variant_name, quantity)
+        if rows:
+            self.released += 1
+        return len(rows)
+
+    async def commit(self, db: AsyncSession, order_id: str) -> int:
+        rows = await self._claim(db, order_id, COMMITTED)
+        if rows:
+            self.committed += 1
+        return len(rows)
+
+    async def reacquire(self, db: AsyncSession, order_id: str) -> bool:
+        """Hold stock again for an order whose holds were all released (cancelled, then paid after all).
+
+        Returns False when there is nothing to re-take (holds still held or
+        committed, or an order from before reservations). Runs in a
+        savepoint: raises ``OutOfStock`` with nothing taken if the goods
+        have sold since.
+        """
+        statuses = set((await db.scalars(
+            select(StockReservation.status).where(StockReservation.order_id == order_id).distinct()
+        )).all())
+        if statuses != {RELEASED}:
+            return False
+        lines = (await db.execute(
+            select(OrderItem.product_id, OrderItem.variant_name, OrderItem.quantity)
+            .where(OrderItem.order_id == order_id, OrderItem.product_id.is_not(None))
+        )).all()
+        async with db.begin_nested():
+            await self.reserve(db, order_id, lines)
+        self.reacquired += 1
+        return True
+
+    async def sync_order(self, db: AsyncSession, order: Order) -> bool:
+        """Settle an order's holds after a status change; True when stock moved.
+
+        A cancelled order that becomes paid again (a Snap retry after a
+        denied or expired attempt) takes its stock back first; that raises
+        ``OutOfStock`` when the goods are gone.
+        """
+        if order.status == "cancelled":
+            return await self.release(db, order.id) > 0
+        if order.status in PAID_STATUSES:
+            if await self.commit(db, order.id):
+                return False
+            if await self.reacquire(db, order.id):
+                await self.commit(db, order.id)
+                return True
+        return False
+
+    async def available(self, db: AsyncSession, product_id: str, variant_name: str | None) -> int:
+        variant_name = variant_name or None
+        variant_id = await self._variant_id(db, product_id, variant_name)
+        if variant_id:
+            stock = await db.scalar(select(ProductVariant.stock).where(ProductVariant.id == variant_id))
+        else:
+            stock = await db.scalar(select(Product.stock).where(Product.id == product_id))
+        held_variant = variant_name if variant_id else None
+        sharded = await db.scalar(
+            select(func.coalesce(func.sum(StockShard.stock), 0))
+            .where(StockShard.product_id == product_id, _variant_clause(StockShard, held_variant))
+        )
+        return (stock or 0) + (sharded or 0)
+
+    async def available_many(self, db: AsyncSession, lines) -> dict[tuple[str, str | None], int]:
+        """``available`` for several (product_id, variant_name) pairs in three queries."""
+        keys = {(product_id, variant_name or None) for product_id, variant_name in lines}
+        if not keys:
+            return {}
+        product_ids = sorted({product_id for product_id, _ in keys})
+        product_stock = dict((await db.execute(
+            select(Product.id, Product.stock).where(Product.id.in_(product_ids))
+        )).all())
+        variant_stock = {(p, v): stock for p, v, stock in (await db.execute(
+            select(ProductVariant.product_id, ProductVariant.variant_name, ProductVariant.stock)
+            .where(ProductVariant.product_id.in_(product_ids))
+        )).all()}
+        sharded = {(p, v): stock for p, v, stock in (await db.execute(
+            select(StockShard.product_id, StockShard.variant_name, func.sum(StockShard.stock))
+            .where(StockShard.product_id.in_(product_ids))
+            .group_by(StockShard.product_id, StockShard.variant_name)
+        )).all()}
+        available = {}
+        for product_id, variant_name in keys:
+            if variant_name is not None and (product_id, variant_name) in variant_stock:
+                stock, held_variant = variant_stock[(product_id, variant_name)], variant_name
+            else:
+                stock, held_variant = product_stock.get(product_id), None
+            available[(product_id, variant_name)] = (stock or 0) + (sharded.get((product_id, held_variant)) or 0)
+        return available
+
+    async def load_sharded(self, db: AsyncSession):
+        rows = (await db.execute(select(StockShard.product_id, StockShard.variant_name).distinct())).all()
+        self._sharded = {(p, v) for p, v in rows}
+
+    async def unshard(self, db: AsyncSession, product_id: str, variant_name: str | None) -> int:
+        """Fold a SKU's shards back into its variant/product row; returns the amount moved."""
+        variant_name = variant_name if await self._variant_id(db, product_id, variant_name or None) else None
+        shards = (await db.scalars(
+            select(StockShard).where(StockShard.product_id == product_id, _variant_clause(StockShard, variant_name))
+            .with_for_update()
+        )).all()
+        total = sum(s.stock for s in shards)
+        await db.execute(delete(StockShard).where(StockShard.id.in_([s.id for s in shards])))
+        self._sharded.discard((product_id, variant_name))
+        if total:
+            await self._put_back(db, product_id, variant_name, total)
+        return total
+
+    async def shard(self, db: AsyncSession, product_id: str, variant_name: str | None, shards: int) -> int:
+        """Move a SKU's stock into ``shards`` rows; returns the amount sharded."""
+        await self.unshard(db, product_id, variant_name)
+        variant_id = await self._variant_id(db, product_id, variant_name or None)
+        variant_name = variant_name if variant_id else None
+        model, row_id = (ProductVariant, variant_id) if variant_id else (Product, product_id)
+        total = await db.scalar(select(model.stock).where(model.id == row_id).with_for_update()) or 0
+        await db.execute(update(model).where(model.id == row_id).values(stock=0))
+        base, extra = divmod(total, shards)
+        db.add_all([
+            StockShard(id=gen_id(), product_id=product_id, variant_name=variant_name, shard=i, stock=base + (1 if i < extra else 0))
+            for i in range(shards)
+        ])
+        self._sharded.add((product_id, variant_name))
+        return total
+
+    async def expire(self) -> int:
+        """Release holds past their deadline and cancel the orders that never got paid."""
+        async with AsyncSessionLocal() as db:
+            order_ids = (await db.scalars(
+                select(StockReservation.order_id)
+                .where(StockReservation.status == HELD, StockReservation.expires_at < datetime.utcnow())
+                .distinct()
+            )).all()
+            expired = 0
+            for order_id in order_ids:
+                order = await db.scalar(select(Order).where(Order.id == order_id))
+                if order and order.status in PAID_STATUSES:
+                    # paid (and possibly shipped) goods must never go back on sale
+                    await self.commit(db, order_id)
+                    continue
+                if order and order.status not in ("pending", "cancelled"):
+                    continue
+                if order and order.status == "pending":
+                    order.status = "cancelled"
+                    order.updated_at = datetime.utcnow()
+                expired += await self.release(db, order_id) > 0
+            await db.commit()
+        if expired:
+            self.expired += expired
+            catalog_cache.invalidate()
+        return expired
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.expire()
+                async with AsyncSessionLocal() as db:
+                    await self.load_sharded(db)
+            except Exception as e:
+                print(f"[Stock] Reservation sweep failed: {e}")
+
+    async def start(self):
+        async with AsyncSessionLocal() as db:
+            await self.load_sharded(db)
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    def shutdown(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    def stats(self) -> dict:
+        return {
+            "reserved_orders": self.reserved,
+            "rejected": self.rejected,
+            "committed_orders": self.committed,
+            "reacquired_orders": self.reacquired,
+            "released_orders": self.released,
+            "expired_orders": self.expired,
+            "sharded_skus": len(self._sharded),
+        }
+
+
+stock_reservations = StockReservations(STOCK_RESERVATION_TTL, STOCK_SWEEP_INTERVAL)
+
+
+async def _cli(command: str, slug: str, variant_name: str | None, shards: int):
+    async with AsyncSessionLocal() as db:
+        await stock_reservations.load_sharded(db)
+        product_id = await db.scalar(select(Product.id).where(Product.slug == slug))
+        if not product_id:
+            print(f"Unknown product {slug}")
+            return
+        if command == "shard":
+            moved = await stock_reservations.shard(db, product_id, variant_name, shards)
+            print(f"Split {moved} units of {slug} {variant_name or ''} across {shards} shards")
+        else:
+            moved = await stock_reservations.unshard(db, product_id, variant_name)
+            print(f"Folded {moved} units of {slug} {variant_name or ''} back")
+        await db.commit()
+
+
+if __name__ == "__main__":
+    # python -m app.inventory shard <slug> [variant] [--shards=N] | unshard <slug> [variant]
+    args = [a for a in sys.argv[1:] if not a.startswith("--shards")]
+    shards = int(next((a.split("=", 1)[1] for a in sys.argv[1:] if a.startswith("--shards=")), "8"))
+    if len(args) not in (2, 3) or args[0] not in ("shard", "unshard"):
+        print("usage: python -m app.inventory shard|unshard <product-slug> [variant] [--shards=N]")
+        sys.exit(1)
+    asyncio.run(_cli(args[0], args[1], args[2] if len(args) == 3 else None, shards))
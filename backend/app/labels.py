@@ -0,0 +1,378 @@
+import html
+import json
+import os
+import zlib
+from collections import defaultdict
+from string import Template
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.cache import VersionedLRUCache
+from app.config import LABEL_CACHE_SIZE
+from app.models import Order, OrderItem, User
+from app.routes.products import SELLER_CONFIG_PATH
+
+LABEL_CSS = """
+  @media print {
+    body { margin: 0; }
+    .no-print { display: none !important; }
+    .label { page-break-after: always; break-after: page; }
+    .label:last-of-type { page-break-after: auto; break-after: auto; }
+  }
+  body { font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; margin: 20px; color: #333; }
+  .label { max-width: 400px; margin: 0 auto; border: 2px solid #333; padding: 20px; }
+  .label + .label { margin-top: 20px; }
+  .header { display: flex; align-items: center; border-bottom: 2px solid #333; padding-bottom: 12px; margin-bottom: 12px; }
+  .header h2 { margin: 0; font-size: 18px; }
+  .section { margin-bottom: 12px; }
+  .section-title { font-size: 11px; text-transform: uppercase; color: #888; margin-bottom: 4px; letter-spacing: 0.5px; }
+  .section p { margin: 2px 0; font-size: 13px; }
+  .courier-badge { background: #333; color: #fff; padding: 6px 12px; font-weight: bold; font-size: 14px; display: inline-block; border-radius: 4px; margin-bottom: 8px; }
+  .waybill { font-family: monospace; font-size: 16px; font-weight: bold; letter-spacing: 1px; }
+  table { width: 100%; border-collapse: collapse; font-size: 13px; }
+  th { text-align: left; padding: 6px 8px; background: #f5f5f5; border-bottom: 2px solid #ddd; font-size: 11px; text-transform: uppercase; }
+  .barcode { text-align: center; padding: 12px 0; font-family: monospace; font-size: 14px; letter-spacing: 3px; border: 1px dashed #ccc; margin-top: 12px; }
+  .print-btn { display: block; margin: 20px auto; padding: 10px 30px; background: #333; color: #fff; border: none; border-radius: 6px; font-size: 14px; cursor: pointer; }
+"""
+
+# compiled once; every substituted value is HTML-escaped by _label_html
+DOCUMENT_TEMPLATE = Template("""<!DOCTYPE html>
+<html lang="id">
+<head>
+<meta charset="utf-8" />
+<title>$title</title>
+<style>$css</style>
+</head>
+<body>
+$labels
+<button class="no-print print-btn" onclick="window.print()">Cetak Label</button>
+</body>
+</html>""")
+
+LABEL_TEMPLATE = Template("""<div class="label">
+  <div class="header">
+    $logo
+    <div>
+      <h2>$seller_name</h2>
+      <p style="margin:2px 0;font-size:12px;color:#666;">$seller_phone</p>
+    </div>
+  </div>
+
+  <div class="courier-badge">$courier</div>
+  $waybill
+  $etd
+
+  <div class="section">
+    <div class="section-title">Pengirim</div>
+    <p><strong>$seller_name</strong></p>
+    <p>$seller_address</p>
+    <p>$seller_city</p>
+    <p>$seller_phone</p>
+  </div>
+
+  <div class="section">
+    <div class="section-title">Penerima</div>
+    <p><strong>$recipient_name</strong></p>
+    <p>$recipient_address</p>
+    <p>$recipient_phone</p>
+  </div>
+
+  <div class="section">
+    <div class="section-title">Isi Paket (${total_weight}g)</div>
+    <table>
+      <tr><th>Produk</th><th style="text-align:center;">Qty</th><th style="text-align:right;">Berat</th></tr>
+      $items
+    </table>
+  </div>
+
+  <div class="barcode">
+    $barcode
+  </div>
+
+  <p style="text-align:center;font-size:11px;color:#999;margin-top:8px;">$footer</p>
+</div>""")
+
+ITEM_TEMPLATE = Template("""
+        <tr>
+            <td style="padding:6px 8px;border-bottom:1px solid #eee;">$name</td>
+            <td style="padding:6px 8px;border-bottom:1px solid #eee;text-align:center;">$quantity</td>
+            <td style="padding:6px 8px;border-bottom:1px solid #eee;text-align:right;">${weight}g</td>
+        </tr>""")
+
+
+def _label_data(order: Order, items: list[OrderItem], buyer: User | None, seller, logo: str) -> dict:
+    courier = (order.courier_company or "").upper()
+    if order.courier_service_name:
+        courier += f" - {order.courier_service_name}"
+    lines = [(item.product_name, item.quantity, (item.weight or 500) * item.quantity) for item in items]
+    return {
+        "logo": logo,
+        "seller_name": seller.name,
+        "seller_phone": seller.phone or "",
+        "seller_address": seller.address or "-",
+        "seller_city": f"{seller.city or ''} {seller.postal_code or ''}".strip(),
+        "courier": courier,
+        "waybill": order.waybill_id or "",
+        "etd": order.shipping_etd or "",
+        "recipient_name": order.destination_contact_name or (buyer.name if buyer else "-"),
+        "recipient_address": order.shipping_address or "-",
+        "recipient_phone": order.destination_contact_phone or (buyer.phone if buyer else "") or "",
+        "items": lines,
+        "total_weight": sum(weight for _, _, weight in lines),
+        "barcode": order.waybill_id or order.id[:12].upper(),
+        "footer": f"Order #{order.id[:8]} \u2022 {order.created_at.strftime('%d/%m/%Y') if order.created_at else ''}",
+    }
+
+
+def _label_html(data: dict) -> str:
+    e = html.escape
+    return LABEL_TEMPLATE.substitute(
+        logo=f'<img src="{e(data["logo"])}" alt="Logo" style="height:50px;margin-right:12px;border-radius:6px;" />' if data["logo"] else "",
+        seller_name=e(data["seller_name"]),
+        seller_phone=e(data["seller_phone"]),
+        seller_address=e(data["seller_address"]),
+        seller_city=e(data["seller_city"]),
+        courier=e(data["courier"]),
+        waybill=f'<div class="waybill">{e(data["waybill"])}</div>' if data["waybill"] else "",
+        etd=f'<p style="font-size:12px;color:#666;">ETD: {e(data["etd"])}</p>' if data["etd"] else "",
+        recipient_name=e(data["recipient_name"]),
+        recipient_address=e(data["recipient_address"]),
+        recipient_phone=e(data["recipient_phone"]),
+        total_weight=data["total_weight"],
+        items="".join(ITEM_TEMPLATE.substitute(name=e(name), quantity=qty, weight=weight) for name, qty, weight in data["items"]),
+        barcode=e(data["barcode"]),
+        footer=e(data["footer"]),
+    )
+
+
+# --- PDF -------------------------------------------------------------------
+# A hand-rolled writer is enough here: labels are text, rules and boxes in the
+# 14 standard PDF fonts, so there is nothing to embed. One A6 page per label.
+
+PAGE_WIDTH, PAGE_HEIGHT = 298, 420
+MARGIN = 16
+FONTS = {"F1": "Helvetica", "F2": "Helvetica-Bold", "F3": "Courier-Bold"}
+# rough average glyph width per point of font size, for wrapping and centring
+GLYPH_WIDTH = {"F1": 0.5, "F2": 0.55, "F3": 0.6}
+
+
+def _pdf_text(value: str) -> str:
+    value = value.encode("cp1252", "replace").decode("latin-1")
+    return value.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").replace("\r", "").replace("\n", " ")
+
+
+def _wrap(value: str, size: float, width: float, font: str = "F1") -> list[str]:
+    per_line = max(int(width / (size * GLYPH_WIDTH[font])), 1)
+    lines, current = [], ""
+    for word in value.split():
+        while len(word) > per_line:
+            if current:
+                lines.append(current)
+                current = ""
+            lines.append(word[:per_line])
+            word = word[per_line:]
+        candidate = f"{current} {word}".strip()
+        if len(candidate) > per_line:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+    return lines or [""]
+
+
+class _PdfPage:
+    def __init__(self):
+        self.ops: list[str] = []
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def text(self, x: float, y: float, value: str, size: float = 9, font: str = "F1", gray: float = 0):
+        self.ops.append(f"BT /{font} {size} Tf {gray} g {x:.1f} {y:.1f} Td ({_pdf_text(value)}) Tj ET")
+
+    def text_width(self, value: str, size: float, font: str = "F1") -> float:
+        return len(value) * size * GLYPH_WIDTH[font]
+
+    def rect(self, x: float, y: float, w: float, h: float, fill: float = None, dash: bool = False, width: float = 1):
+        dash_op = "[3 2] 0 d" if dash else "[] 0 d"
+        paint = f"{fill} g f" if fill is not None else "S"
+        self.ops.append(f"{width} w {dash_op} {x:.1f} {y:.1f} {w:.1f} {h:.1f} re {paint}")
+
+    def rule(self, y: float, width: float = 0.5, gray: float = 0):
+        self.ops.append(f"{width} w [] 0 d {gray} G {MARGIN + 8} {y:.1f} m {PAGE_WIDTH - MARGIN - 8} {y:.1f} l S 0 G")
+
+    def line(self, value: str, size: float = 9, font: str = "F1", gray: float = 0, indent: float = 0, leading: float = 1.3):
+        self.y -= size * leading
+        self.text(MARGIN + 8 + indent, self.y, value, size, font, gray)
+
+    def paragraph(self, value: str, size: float = 9, font: str = "F1", max_lines: int = 4):
+        lines = _wrap(value, size, PAGE_WIDTH - 2 * MARGIN - 16, font)
+        for line in lines[:max_lines]:
+            self.line(line, size, font)
+
+    def content(self) -> bytes:
+        return "\n".join(self.ops).encode("latin-1")
+
+
+def _label_pdf_page(data: dict) -> bytes:
+    page = _PdfPage()
+    inner = PAGE_WIDTH - 2 * MARGIN - 16
+    page.rect(MARGIN, MARGIN, PAGE_WIDTH - 2 * MARGIN, PAGE_HEIGHT - 2 * MARGIN, width=1.5)
+    page.y -= 6
+    page.line(data["seller_name"], 13, "F2")
+    if data["seller_phone"]:
+        page.line(data["seller_phone"], 8, gray=0.4)
+    page.y -= 6
+    page.rule(page.y, 1.5)
+
+    if data["courier"]:
+        page.y -= 22
+        badge_width = min(page.text_width(data["courier"], 11, "F2") + 16, inner)
+        page.rect(MARGIN + 8, page.y - 5, badge_width, 18, fill=0.2)
+        page.text(MARGIN + 16, page.y, data["courier"], 11, "F2", gray=1)
+    if data["waybill"]:
+        page.line(data["waybill"], 13, "F3", leading=1.6)
+    if data["etd"]:
+        page.line(f"ETD: {data['etd']}", 8, gray=0.4)
+
+    page.y -= 4
+    page.line("PENGIRIM", 7, gray=0.5)
+    page.line(data["seller_name"], 9, "F2")
+    page.paragraph(data["seller_address"], max_lines=2)
+    if data["seller_city"]:
+        page.line(data["seller_city"])
+
+    page.y -= 4
+    page.line("PENERIMA", 7, gray=0.5)
+    page.line(data["recipient_name"], 10, "F2")
+    page.paragraph(data["recipient_address"], max_lines=4)
+    if data["recipient_phone"]:
+        page.line(data["recipient_phone"])
+
+    page.y -= 4
+    page.line(f"ISI PAKET ({data['total_weight']}g)", 7, gray=0.5)
+    qty_x, weight_right = PAGE_WIDTH - MARGIN - 80, PAGE_WIDTH - MARGIN - 8
+    # leave room for the barcode box and footer below the table
+    room = max(int((page.y - MARGIN - 70) / 11), 1)
+    items = data["items"]
+    shown = items if len(items) <= room else items[:room - 1]
+    for name, qty, weight in shown:
+        page.y -= 11
+        page.text(MARGIN + 8, page.y, _wrap(name, 8, inner - 90)[0], 8)
+        page.text(qty_x, page.y, str(qty), 8)
+        page.text(weight_right - page.text_width(f"{weight}g", 8), page.y, f"{weight}g", 8)
+    if len(shown) < len(items):
+        page.line(f"+{len(items) - len(shown)} produk lainnya", 8, gray=0.4)
+
+    box_y = MARGIN + 24
+    page.rect(MARGIN + 8, box_y, inner, 28, dash=True, width=0.75)
+    page.text(PAGE_WIDTH / 2 - page.text_width(data["barcode"], 11, "F3") / 2, box_y + 10, data["barcode"], 11, "F3")
+    page.text(PAGE_WIDTH / 2 - page.text_width(data["footer"], 7) / 2, MARGIN + 8, data["footer"], 7, gray=0.5)
+    return page.content()
+
+
+def build_pdf(pages: list[bytes]) -> bytes:
+    objects: list[bytes] = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(b"")  # filled in once the page tree exists
+    pages_ref = add(b"")
+    fonts = " ".join(
+        f"/{name} {add(f'<< /Type /Font /Subtype /Type1 /BaseFont /{base} /Encoding /WinAnsiEncoding >>'.encode())} 0 R"
+        for name, base in FONTS.items()
+    )
+    kids = []
+    for content in pages:
+        stream = zlib.compress(content)
+        contents = add(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        kids.append(add(
+            f"<< /Type /Page /Parent {pages_ref} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << {fonts} >> >> /Contents {contents} 0 R >>".encode()
+        ))
+    objects[catalog - 1] = f"<< /Type /Catalog /Pages {pages_ref} 0 R >>".encode()
+    objects[pages_ref - 1] = f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(out)
+
+
+class LabelRenderer:
+    """Shipping labels for one or many orders, as one HTML document or one PDF.
+
+    Orders and buyers are loaded with one query each; items only for orders
+    whose label isn't cached. A rendered label (HTML fragment and PDF page)
+    is cached under the order's ``updated_at`` plus the buyer and seller
+    fields printed on it, so any change to what the label shows is a new key.
+    """
+
+    def __init__(self, max_entries: int):
+        self.cache = VersionedLRUCache(max_entries)
+        self.rendered = 0
+        self._seller_config = (None, {})
+
+    def _seller_logo(self) -> str:
+        try:
+            mtime = os.path.getmtime(SELLER_CONFIG_PATH)
+        except OSError:
+            return ""
+        if self._seller_config[0] != mtime:
+            try:
+                with open(SELLER_CONFIG_PATH) as f:
+                    self._seller_config = (mtime, json.load(f))
+            except (OSError, ValueError):
+                return ""
+        return self._seller_config[1].get("profile_picture", "") or ""
+
+    async def render(self, db: AsyncSession, order_ids: list[str], seller) -> list[tuple[str, bytes]]:
+        """(HTML fragment, PDF page content) per order, in the order given; unknown ids are skipped."""
+        found = {o.id: o for o in (await db.scalars(select(Order).where(Order.id.in_(order_ids)))).all()}
+        orders = [found[order_id] for order_id in dict.fromkeys(order_ids) if order_id in found]
+        user_ids = {o.user_id for o in orders}
+        buyers = {u.id: u for u in (await db.scalars(select(User).where(User.id.in_(user_ids)))).all()} if user_ids else {}
+
+        logo = self._seller_logo()
+        seller_key = (seller.id, seller.name, seller.phone, seller.address, seller.city, seller.postal_code, logo)
+        keys, labels = {}, {}
+        for order in orders:
+            buyer = buyers.get(order.user_id)
+            keys[order.id] = (order.id, order.updated_at, buyer.name if buyer else None, buyer.phone if buyer else None, seller_key)
+            cached = self.cache.get(keys[order.id])
+            if cached is not None:
+                labels[order.id] = cached
+
+        missing = [o.id for o in orders if o.id not in labels]
+        if missing:
+            version = self.cache.version
+            items = defaultdict(list)
+            for item in (await db.scalars(select(OrderItem).where(OrderItem.order_id.in_(missing)))).all():
+                items[item.order_id].append(item)
+            for order in orders:
+                if order.id in labels:
+                    continue
+                data = _label_data(order, items[order.id], buyers.get(order.user_id), seller, logo)
+                labels[order.id] = (_label_html(data), _label_pdf_page(data))
+                self.cache.set(keys[order.id], labels[order.id], version)
+                self.rendered += 1
+        return [labels[o.id] for o in orders]
+
+    def html_document(self, labels: list[tuple[str, bytes]], title: str) -> str:
+        return DOCUMENT_TEMPLATE.substitute(title=html.escape(title), css=LABEL_CSS, labels="\n".join(h for h, _ in labels))
+
+    def pdf_document(self, labels: list[tuple[str, bytes]]) -> bytes:
+        return build_pdf([page for _, page in labels])
+
+    def stats(self) -> dict:
+        return {"rendered": self.rendered, **self.cache.stats()}
+
+
+label_renderer = LabelRenderer(LABEL_CACHE_SIZE)
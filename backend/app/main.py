@@ -1,16 +1,57 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
-from app.database import engine, Base
-from app.routes import auth, products, cart, orders, payment, upload, shipping
+from app.database import async_engine, AsyncSessionLocal
+from app.migrations import run_migrations
+from app.routes import auth, products, cart, orders, payment, upload, shipping, analytics
+from app.cache import catalog_cache
+from app.search import search_index
+from app.hashing import password_hasher, HasherBusy
+from app import http_clients
+from app.shipping_rates import rate_quoter
+from app.area_index import area_index
+from app.order_pipeline import order_pipeline
+from app.inventory import stock_reservations
+from app.analytics import sales_analytics
+from app.tracking import shipment_tracker
+from app.labels import label_renderer
+from app.images import image_processor, ImageBusy
+from app.blobs import blob_store
+from app.media import media_files
+from app.payment_notifications import payment_notifications
+from app.payment_sessions import payment_sessions
+from app.payment_reconciler import payment_reconciler
+from app.guest_carts import guest_carts
+import asyncio
 import os
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    Base.metadata.create_all(bind=engine)
+    run_migrations()
+    async with AsyncSessionLocal() as db:
+        await search_index.rebuild(db)
+    await asyncio.to_thread(area_index.load)
+    await order_pipeline.resume()
+    await stock_reservations.start()
+    shipment_tracker.start()
+    blob_store.start()
+    payment_notifications.start()
+    payment_reconciler.start()
     yield
+    payment_reconciler.shutdown()
+    payment_notifications.shutdown()
+    payment_sessions.shutdown()
+    blob_store.shutdown()
+    shipment_tracker.shutdown()
+    stock_reservations.shutdown()
+    order_pipeline.shutdown()
+    await guest_carts.shutdown()
+    await http_clients.close_all()
+    password_hasher.shutdown()
+    image_processor.shutdown()
+    await async_engine.dispose()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -38,6 +79,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(HasherBusy)
+async def hasher_busy_handler(request: Request, exc: HasherBusy):
+    return JSONResponse({"error": "Server sedang sibuk, silakan coba lagi"}, status_code=503, headers={"Retry-After": "1"})
+
+
+@app.exception_handler(ImageBusy)
+async def image_busy_handler(request: Request, exc: ImageBusy):
+    return JSONResponse({"error": "Server sedang memproses gambar lain, silakan coba lagi"}, status_code=503, headers={"Retry-After": "2"})
+
+
 app.include_router(auth.router)
 app.include_router(products.router)
 app.include_router(cart.router)
@@ -45,11 +96,35 @@ app.include_router(orders.router)
 app.include_router(payment.router)
 app.include_router(upload.router)
 app.include_router(shipping.router)
+app.include_router(analytics.router)
 
-uploads_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads")
-os.makedirs(uploads_dir, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=uploads_dir), name="uploads")
+app.mount("/uploads", media_files, name="uploads")
 
 @app.get("/api/health")
 async def health():
     return {"status": "ok"}
+
+
+@app.get("/api/metrics")
+async def metrics():
+    return {
+        "catalog_cache": catalog_cache.stats(),
+        "search": search_index.stats(),
+        "user_context_cache": auth.user_context_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "http_clients": {p.name: p.stats() for p in http_clients.PROVIDERS},
+        "shipping_rates": rate_quoter.stats(),
+        "area_index": area_index.stats(),
+        "order_pipeline": order_pipeline.stats(),
+        "stock": stock_reservations.stats(),
+        "sales_analytics": sales_analytics.stats(),
+        "tracking": shipment_tracker.stats(),
+        "labels": label_renderer.stats(),
+        "images": image_processor.stats(),
+        "blobs": blob_store.stats(),
+        "media": media_files.stats(),
+        "payment_notifications": payment_notifications.stats(),
+        "payment_sessions": payment_sessions.stats(),
+        "payment_reconciler": payment_reconciler.stats(),
+        "guest_carts": guest_carts.stats(),
+    }
@@ -0,0 +1,166 @@
+import os
+import re
+import anyio
+from email.utils import parsedate_to_datetime
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+from starlette.types import Scope, Receive, Send
+from app.config import MEDIA_MAX_AGE, MEDIA_CHUNK_SIZE
+from app.images import UPLOAD_DIR
+
+# app.blobs names uploads <sha256><ext> and renditions <sha256>-<name>.<fmt>: the URL changes whenever the bytes do
+CONTENT_ADDRESSED = re.compile(r"^([0-9a-f]{64}(?:-[a-z]+)?)\.[A-Za-z0-9]+$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _byte_range(header: str, size: int) -> tuple[int, int] | None:
+    """(start, end inclusive) for a single ``bytes=`` range; None to ignore the header, (-1, -1) if unsatisfiable."""
+    match = RANGE.match(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        # malformed or multiple ranges: answering with the whole file is allowed
+        return None
+    if match.group(1) == "":
+        suffix = int(match.group(2))
+        if suffix == 0 or size == 0:
+            return -1, -1
+        return max(size - suffix, 0), size - 1
+    start = int(match.group(1))
+    if start >= size:
+        return -1, -1
+    end = int(match.group(2)) if match.group(2) else size - 1
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+class MediaResponse(FileResponse):
+    """A file (or one byte range of it), handed to the server with ``sendfile`` when it offers that.
+
+    Servers advertising the ASGI ``http.response.zerocopysend`` extension
+    get the open file descriptor and copy it to the socket in the kernel;
+    otherwise the range is read with ``pread`` off the event loop in
+    ``chunk_size`` pieces.
+    """
+
+    def __init__(self, path: str, stat_result: os.stat_result, headers: dict, media: "MediaFiles",
+                 status_code: int = 200, offset: int = 0, count: int | None = None):
+        super().__init__(path, status_code=status_code, headers=headers, stat_result=stat_result)
+        self.media = media
+        self.offset = offset
+        self.count = stat_result.st_size - offset if count is None else count
+        self.headers["content-length"] = str(self.count)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD" or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": self.offset,
+                    "count": self.count,
+                    "more_body": False,
+                })
+            self.media.zero_copy += 1
+            self.media.bytes_sent += self.count
+            return
+        fd = await anyio.to_thread.run_sync(os.open, self.path, os.O_RDONLY)
+        try:
+            position, end = self.offset, self.offset + self.count
+            while position < end:
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, min(self.media.chunk_size, end - position), position)
+                if not chunk:  # truncated underneath us; the client sees a short body
+                    break
+                position += len(chunk)
+                self.media.bytes_sent += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": position < end})
+            if position < end:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            os.close(fd)
+
+
+class MediaFiles(StaticFiles):
+    """``/uploads`` with long-lived caching, validators and byte ranges.
+
+    Content-addressed names (everything app.blobs stores) are served as
+    ``immutable`` for a year, so repeat visits never revalidate product
+    images; their ETag is the content hash itself. Other files (uploads
+    that predate the blob store) get ``max_age`` plus the usual
+    ETag/Last-Modified revalidation. Single byte ranges are answered with
+    206 (video seeking, resumed downloads), honouring ``If-Range``.
+    Uploads are JPEG/PNG/WebP/AVIF and video, all compressed already, so
+    there are no gzip/brotli variants to negotiate.
+    """
+
+    def __init__(self, directory: str, max_age: int, chunk_size: int):
+        super().__init__(directory=directory)
+        self.max_age = max_age
+        self.chunk_size = chunk_size
+        self.responses = 0
+        self.not_modified = 0
+        self.partial = 0
+        self.zero_copy = 0
+        self.bytes_sent = 0
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        self.responses += 1
+        request_headers = Headers(scope=scope)
+        headers = {"accept-ranges": "bytes"}
+        hashed = CONTENT_ADDRESSED.match(os.path.basename(full_path))
+        if hashed:
+            headers["cache-control"] = IMMUTABLE
+            headers["etag"] = f'"{hashed.group(1)}"'
+        else:
+            headers["cache-control"] = f"public, max-age={self.max_age}"
+        response = MediaResponse(full_path, stat_result, headers, self, status_code=status_code)
+        if self.is_not_modified(response.headers, request_headers):
+            self.not_modified += 1
+            return NotModifiedResponse(response.headers)
+
+        range_header = request_headers.get("range")
+        if status_code != 200 or range_header is None or not self._if_range(response.headers, request_headers):
+            return response
+        size = stat_result.st_size
+        byte_range = _byte_range(range_header, size)
+        if byte_range is None:
+            return response
+        if byte_range == (-1, -1):
+            return Response(status_code=416, headers={"content-range": f"bytes */{size}", **headers})
+        start, end = byte_range
+        self.partial += 1
+        response = MediaResponse(full_path, stat_result, headers, self, status_code=206, offset=start, count=end - start + 1)
+        response.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        return response
+
+    @staticmethod
+    def _if_range(response_headers: Headers, request_headers: Headers) -> bool:
+        """Whether a Range request may be answered partially (no If-Range, or it still matches)."""
+        if_range = request_headers.get("if-range")
+        if if_range is None:
+            return True
+        if if_range.startswith(('"', 'W/"')):
+            # weak validators never match for ranges
+            return if_range == response_headers["etag"]
+        try:
+            return parsedate_to_datetime(if_range) == parsedate_to_datetime(response_headers["last-modified"])
+        except (TypeError, ValueError):
+            return False
+
+    def stats(self) -> dict:
+        return {
+            "responses": self.responses,
+            "not_modified": self.not_modified,
+            "partial": self.partial,
+            "zero_copy": self.zero_copy,
+            "bytes_sent": self.bytes_sent,
+        }
+
+
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+media_files = MediaFiles(UPLOAD_DIR, MEDIA_MAX_AGE, MEDIA_CHUNK_SIZE)
@@ -0,0 +1,228 @@
+"""Versioned schema migrations.
+
+Each migration is a function registered with ``@migration(version, name)``
+and runs in its own transaction; applied versions are recorded in
+``schema_migrations``. Migrations must be safe to run against a database
+that already has their changes (create_all on a fresh install builds the
+current models, and installs from before this module never recorded
+anything), so DDL here uses IF NOT EXISTS or checks the inspector first.
+
+    python -m app.migrations            # apply pending migrations
+    python -m app.migrations status     # list applied / pending
+"""
+import sys
+from collections.abc import Callable
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from app.database import engine, Base
+
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = []
+
+# arbitrary key for pg_advisory_lock so two starting processes don't migrate at once
+ADVISORY_LOCK_KEY = 712_401
+
+
+def migration(version: int, name: str):
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def _add_column(conn: Connection, table: str, column: str, ddl_type: str):
+    if column not in {c["name"] for c in inspect(conn).get_columns(table)}:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+
+@migration(1, "baseline")
+def _baseline(conn: Connection):
+    import app.models  # noqa: F401  registers every table on Base.metadata
+    Base.metadata.create_all(bind=conn)
+
+
+@migration(2, "orders.shipping_validation")
+def _order_shipping_validation(conn: Connection):
+    _add_column(conn, "orders", "shipping_validation", "VARCHAR")
+
+
+@migration(3, "hot path indexes")
+def _hot_path_indexes(conn: Connection):
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS ix_products_category ON products (category)",
+        "CREATE INDEX IF NOT EXISTS ix_product_images_product_id ON product_images (product_id)",
+        "CREATE INDEX IF NOT EXISTS ix_product_variants_product_id_variant_name ON product_variants (product_id, variant_name)",
+        "CREATE INDEX IF NOT EXISTS ix_cart_items_product_id ON cart_items (product_id)",
+        # (user_id, created_at) answers both "orders of this user" and its newest-first ordering
+        "CREATE INDEX IF NOT EXISTS ix_orders_user_id_created_at ON orders (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_orders_created_at ON orders (created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_orders_midtrans_order_id ON orders (midtrans_order_id)",
+        "CREATE INDEX IF NOT EXISTS ix_order_items_order_id ON order_items (order_id)",
+        "CREATE INDEX IF NOT EXISTS ix_order_items_product_id ON order_items (product_id)",
+        "CREATE INDEX IF NOT EXISTS ix_stock_reservations_status_expires_at ON stock_reservations (status, expires_at)",
+    ):
+        conn.execute(text(statement))
+
+
+@migration(4, "unique cart line per user, product and variant")
+def _unique_cart_items(conn: Connection):
+    group = "user_id, product_id, COALESCE(variant_name, '')"
+    # fold duplicate lines into the oldest id before the unique index can be built
+    conn.execute(text(
+        "UPDATE cart_items SET quantity = ("
+        " SELECT SUM(c2.quantity) FROM cart_items c2"
+        " WHERE c2.user_id = cart_items.user_id AND c2.product_id = cart_items.product_id"
+        " AND COALESCE(c2.variant_name, '') = COALESCE(cart_items.variant_name, ''))"
+        f" WHERE id IN (SELECT MIN(id) FROM cart_items GROUP BY {group} HAVING COUNT(*) > 1)"
+    ))
+    conn.execute(text(f"DELETE FROM cart_items WHERE id NOT IN (SELECT MIN(id) FROM cart_items GROUP BY {group})"))
+    conn.execute(text(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS uq_cart_items_user_product_variant ON cart_items ({group})"
+    ))
+
+
+@migration(5, "seller dashboard status index")
+def _order_status_index(conn: Connection):
+    # status filter + newest-first keyset paging; courier/tracking filters ride ix_orders_created_at
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_status_created_at ON orders (status, created_at)"))
+
+
+@migration(6, "sales analytics rollups")
+def _sales_rollups(conn: Connection):
+    from app.models import SalesDaily, ProductSalesDaily, CourierSpendDaily
+    for model in (SalesDaily, ProductSalesDaily, CourierSpendDaily):
+        model.__table__.create(bind=conn, checkfirst=True)
+    _add_column(conn, "orders", "analytics_day", "DATE")
+
+
+@migration(7, "shipment tracking state")
+def _shipment_tracking(conn: Connection):
+    _add_column(conn, "orders", "tracking_detail", "TEXT")
+    _add_column(conn, "orders", "tracking_checked_at", "TIMESTAMP")
+    _add_column(conn, "orders", "tracking_next_check_at", "TIMESTAMP")
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_tracking_next_check_at ON orders (tracking_next_check_at)"))
+    # webhook lookups
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_biteship_order_id ON orders (biteship_order_id)"))
+    # shipments already in flight get picked up by the first poll
+    conn.execute(text(
+        "UPDATE orders SET tracking_next_check_at = :now"
+        " WHERE biteship_order_id IS NOT NULL AND biteship_order_id <> ''"
+        " AND status NOT IN ('completed', 'cancelled') AND tracking_next_check_at IS NULL"
+    ), {"now": datetime.utcnow()})
+
+
+@migration(8, "image renditions")
+def _image_renditions(conn: Connection):
+    # existing uploads get theirs from `python -m app.images backfill`
+    _add_column(conn, "product_images", "renditions", "TEXT")
+    _add_column(conn, "products", "primary_image_renditions", "TEXT")
+
+
+@migration(9, "content-addressed upload store")
+def _blob_store(conn: Connection):
+    from app.models import Blob
+    # files already in uploads/ are registered and counted by `python -m app.blobs rebuild`
+    Blob.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration(10, "payment notification inbox")
+def _payment_notifications(conn: Connection):
+    from app.models import PaymentNotification
+    PaymentNotification.__table__.create(bind=conn, checkfirst=True)
+    _add_column(conn, "orders", "payment_status", "VARCHAR")
+
+
+@migration(11, "reusable payment sessions")
+def _payment_sessions(conn: Connection):
+    _add_column(conn, "orders", "payment_redirect_url", "VARCHAR")
+    _add_column(conn, "orders", "payment_token_expires_at", "TIMESTAMP")
+    _add_column(conn, "orders", "payment_token_total", "FLOAT")
+
+
+@migration(12, "payment reconciliation")
+def _payment_reconciliation(conn: Connection):
+    _add_column(conn, "orders", "payment_checked_at", "TIMESTAMP")
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_orders_status_payment_checked_at ON orders (status, payment_checked_at)"
+    ))
+    # orders that already have a Snap session join the sweep
+    conn.execute(text(
+        "UPDATE orders SET payment_checked_at = updated_at"
+        " WHERE midtrans_order_id IS NOT NULL AND payment_checked_at IS NULL"
+    ))
+
+
+@migration(13, "payment session history")
+def _payment_session_history(conn: Connection):
+    from app.models import PaymentSession
+    PaymentSession.__table__.create(bind=conn, checkfirst=True)
+    # only each order's latest Snap order_id was kept before this; earlier ones stay unresolvable
+    conn.execute(text(
+        "INSERT INTO payment_sessions (midtrans_order_id, order_id, created_at, expires_at)"
+        " SELECT midtrans_order_id, id, updated_at, payment_token_expires_at FROM orders"
+        " WHERE midtrans_order_id IS NOT NULL"
+        " AND midtrans_order_id NOT IN (SELECT midtrans_order_id FROM payment_sessions)"
+    ))
+
+
+@migration(14, "product listing sort indexes")
+def _product_sort_indexes(conn: Connection):
+    # the storefront pages by (coalesce(sort column, 0), id); see routes.products.PRODUCT_SORTS
+    for column in ("sold_count", "price", "rating"):
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_products_{column}_id ON products ((coalesce({column}, 0)), id)"
+        ))
+
+
+def _ensure_version_table(conn: Connection):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        " version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def applied_versions(conn: Connection) -> set[int]:
+    return set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+
+
+def run_migrations(bind: Engine = engine) -> list[int]:
+    """Apply pending migrations in order; returns the versions applied."""
+    applied_now = []
+    with bind.connect() as conn:
+        postgres = conn.dialect.name == "postgresql"
+        if postgres:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+        try:
+            _ensure_version_table(conn)
+            done = applied_versions(conn)
+            conn.commit()
+            for version, name, upgrade in MIGRATIONS:
+                if version in done:
+                    continue
+                with conn.begin():
+                    upgrade(conn)
+                    conn.execute(
+                        text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                        {"v": version, "n": name, "t": datetime.utcnow()},
+                    )
+                print(f"[Migrations] Applied {version:04d} {name}")
+                applied_now.append(version)
+        finally:
+            if postgres:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+                conn.commit()
+    return applied_now
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["status"]:
+        with engine.connect() as conn:
+            _ensure_version_table(conn)
+            done = applied_versions(conn)
+            conn.commit()
+        for version, name, _ in MIGRATIONS:
+            print(f"{version:04d} {'applied' if version in done else 'pending':8s} {name}")
+    else:
+        applied = run_migrations()
+        print(f"Applied {len(applied)} migration(s)")
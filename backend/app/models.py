@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Float, Integer, Boolean, Text, DateTime, ForeignKey
+from sqlalchemy import Column, String, Float, Integer, Boolean, Text, Date, DateTime, ForeignKey, Index, func, literal, literal_column
 from sqlalchemy.orm import relationship
 from app.database import Base
 from datetime import datetime
@@ -44,7 +44,16 @@ class Product(Base):
     width = Column(Integer, default=10)
     height = Column(Integer, default=10)
     primary_image = Column(String, nullable=True)
+    # JSON {"detail"|"card"|"thumb": {"width", "height", "webp", "avif"?}} for uploaded images (app.images)
+    primary_image_renditions = Column(Text, nullable=True)
     video_url = Column(String, nullable=True)
+    __table_args__ = (
+        Index("ix_products_category", "category"),
+        # keyset pages of GET /api/products, in the exact expressions of routes.products.PRODUCT_SORTS
+        Index("ix_products_sold_count_id", func.coalesce(sold_count, literal_column("0")), id),
+        Index("ix_products_price_id", func.coalesce(price, literal_column("0")), id),
+        Index("ix_products_rating_id", func.coalesce(rating, literal_column("0")), id),
+    )
     images = relationship("ProductImage", back_populates="product", cascade="all, delete-orphan")
     variants = relationship("ProductVariant", back_populates="product", cascade="all, delete-orphan")
 
@@ -55,7 +64,9 @@ class ProductImage(Base):
     product_id = Column(String, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
     image_url = Column(String, nullable=False)
     display_order = Column(Integer, default=0)
+    renditions = Column(Text, nullable=True)
     product = relationship("Product", back_populates="images")
+    __table_args__ = (Index("ix_product_images_product_id", "product_id"),)
 
 
 class ProductVariant(Base):
@@ -69,6 +80,7 @@ class ProductVariant(Base):
     stock = Column(Integer, default=0)
     is_available = Column(Boolean, default=True)
     product = relationship("Product", back_populates="variants")
+    __table_args__ = (Index("ix_product_variants_product_id_variant_name", "product_id", "variant_name"),)
 
 
 class CartItem(Base):
@@ -81,6 +93,11 @@ class CartItem(Base):
     quantity = Column(Integer, default=1)
     user = relationship("User", back_populates="cart_items")
     product = relationship("Product")
+    __table_args__ = (
+        # NULL variants must collide too, hence coalesce; also serves lookups by user_id
+        Index("uq_cart_items_user_product_variant", user_id, product_id, func.coalesce(variant_name, literal("")), unique=True),
+        Index("ix_cart_items_product_id", product_id),
+    )
 
 
 class Order(Base):
@@ -99,17 +116,43 @@ class Order(Base):
     courier_service_name = Column(String, nullable=True)
     shipping_cost = Column(Float, default=0.0)
     shipping_etd = Column(String, nullable=True)
+    # pending -> validated | adjusted | unverified | skipped, set by app.order_pipeline
+    shipping_validation = Column(String, nullable=True)
+    # day the order was booked into the sales rollups (app.analytics); NULL while not counted
+    analytics_day = Column(Date, nullable=True)
     biteship_order_id = Column(String, nullable=True)
     waybill_id = Column(String, nullable=True)
     tracking_status = Column(String, nullable=True)
     tracking_url = Column(String, nullable=True)
+    # JSON {"history": [...], "driver_name", "driver_phone"}, maintained by app.tracking
+    tracking_detail = Column(Text, nullable=True)
+    tracking_checked_at = Column(DateTime, nullable=True)
+    # when the tracking poller next refreshes this shipment; NULL once there is nothing left to track
+    tracking_next_check_at = Column(DateTime, nullable=True)
     payment_token = Column(String, nullable=True)
+    # the Snap session behind payment_token (app.payment_sessions): reused until it nears expiry or the total changes
+    payment_redirect_url = Column(String, nullable=True)
+    payment_token_expires_at = Column(DateTime, nullable=True)
+    payment_token_total = Column(Float, nullable=True)
     payment_id = Column(String, nullable=True)
     midtrans_order_id = Column(String, nullable=True)
+    # last Midtrans transaction_status applied (app.payment_notifications guards against regressions)
+    payment_status = Column(String, nullable=True)
+    # last time Midtrans was asked about this order (app.payment_reconciler); set once it has a Snap session
+    payment_checked_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     user = relationship("User", back_populates="orders")
     items = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
+    __table_args__ = (
+        Index("ix_orders_user_id_created_at", "user_id", "created_at"),
+        Index("ix_orders_created_at", "created_at"),
+        Index("ix_orders_midtrans_order_id", "midtrans_order_id"),
+        Index("ix_orders_status_created_at", "status", "created_at"),
+        Index("ix_orders_tracking_next_check_at", "tracking_next_check_at"),
+        Index("ix_orders_biteship_order_id", "biteship_order_id"),
+        Index("ix_orders_status_payment_checked_at", "status", "payment_checked_at"),
+    )
 
 
 class OrderItem(Base):
@@ -123,3 +166,103 @@ class OrderItem(Base):
     price = Column(Float, nullable=False)
     weight = Column(Integer, default=500)
     order = relationship("Order", back_populates="items")
+    __table_args__ = (
+        Index("ix_order_items_order_id", "order_id"),
+        Index("ix_order_items_product_id", "product_id"),
+    )
+
+
+class StockReservation(Base):
+    __tablename__ = "stock_reservations"
+    id = Column(String, primary_key=True, default=gen_id)
+    order_id = Column(String, ForeignKey("orders.id", ondelete="CASCADE"), nullable=False, index=True)
+    product_id = Column(String, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    variant_name = Column(String, nullable=True)
+    quantity = Column(Integer, nullable=False)
+    # held -> committed (paid) | released (cancelled / expired)
+    status = Column(String, nullable=False, default="held")
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (Index("ix_stock_reservations_status_expires_at", "status", "expires_at"),)
+
+
+class StockShard(Base):
+    """Slice of a hot SKU's stock; see StockReservations.shard/unshard (python -m app.inventory shard|unshard)."""
+    __tablename__ = "stock_shards"
+    id = Column(String, primary_key=True, default=gen_id)
+    product_id = Column(String, ForeignKey("products.id", ondelete="CASCADE"), nullable=False, index=True)
+    variant_name = Column(String, nullable=True)
+    shard = Column(Integer, nullable=False)
+    stock = Column(Integer, nullable=False, default=0)
+
+
+class SalesDaily(Base):
+    __tablename__ = "sales_daily"
+    day = Column(Date, primary_key=True)
+    orders = Column(Integer, nullable=False, default=0)
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+    shipping = Column(Float, nullable=False, default=0.0)
+
+
+class ProductSalesDaily(Base):
+    __tablename__ = "product_sales_daily"
+    day = Column(Date, primary_key=True)
+    product_id = Column(String, primary_key=True)
+    # "" for lines without a variant, so it can be part of the key
+    variant_name = Column(String, primary_key=True, default="")
+    product_name = Column(String, nullable=False)
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+
+
+class CourierSpendDaily(Base):
+    __tablename__ = "courier_spend_daily"
+    day = Column(Date, primary_key=True)
+    courier_company = Column(String, primary_key=True)
+    orders = Column(Integer, nullable=False, default=0)
+    shipping = Column(Float, nullable=False, default=0.0)
+
+
+class Blob(Base):
+    """An upload in the content-addressed store (app.blobs); ``filename`` is ``<sha256><ext>``."""
+    __tablename__ = "blobs"
+    filename = Column(String, primary_key=True)
+    # NULL for files uploaded before the store, which kept their random names
+    sha256 = Column(String, nullable=True)
+    size = Column(Integer, nullable=False, default=0)
+    # product images + product primary images pointing at /uploads/<filename>
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (Index("ix_blobs_refcount_updated_at", "refcount", "updated_at"),)
+
+
+class PaymentNotification(Base):
+    """A Midtrans payment notification, recorded on receipt and applied by app.payment_notifications."""
+    __tablename__ = "payment_notifications"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # order_id:transaction_id:transaction_status:fraud_status; Midtrans retries collapse onto one row
+    dedupe_key = Column(String, nullable=False, unique=True)
+    # the order_id Midtrans sent: Order.id, Order.midtrans_order_id or an earlier PaymentSession's
+    order_ref = Column(String, nullable=False)
+    transaction_id = Column(String, nullable=True)
+    transaction_status = Column(String, nullable=False)
+    fraud_status = Column(String, nullable=True)
+    payload = Column(Text, nullable=True)
+    received_at = Column(DateTime, default=datetime.utcnow)
+    attempts = Column(Integer, nullable=False, default=0)
+    processed_at = Column(DateTime, nullable=True)
+    # applied | regression | unknown_order | failed | out_of_stock | superseded
+    outcome = Column(String, nullable=True)
+    __table_args__ = (Index("ix_payment_notifications_processed_at_id", "processed_at", "id"),)
+
+
+class PaymentSession(Base):
+    """Every Snap transaction an order was given (app.payment_sessions); a replaced token can still be paid."""
+    __tablename__ = "payment_sessions"
+    # the order_id Snap was given: Order.id for the first token, "<Order.id>-<timestamp>" after Snap refused a reuse
+    midtrans_order_id = Column(String, primary_key=True)
+    order_id = Column(String, ForeignKey("orders.id", ondelete="CASCADE"), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=True)
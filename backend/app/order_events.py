@@ -0,0 +1,25 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.analytics import sales_analytics
+from app.inventory import stock_reservations
+from app.models import Order
+
+# what order_status_changed reports as changed in the order's product payloads
+STOCK_CHANGED = 1
+# sold counts also order the default product listing, so this one reaches beyond the order's products
+SOLD_COUNTS_CHANGED = 2
+
+
+async def order_status_changed(db: AsyncSession, order: Order) -> int:
+    """Side effects of an order status change, in the caller's transaction.
+
+    Settles the order's stock holds and books it into (or out of) the sales
+    rollups. Returns a mask of ``STOCK_CHANGED`` and ``SOLD_COUNTS_CHANGED``,
+    non-zero when product payloads changed, i.e. the caller should
+    invalidate ``catalog_cache`` after commit (only the order's products
+    when just the stock moved).
+    Raises ``OutOfStock`` when a cancelled order is made paid again and its
+    goods have sold since (see StockReservations.reacquire).
+    """
+    restocked = await stock_reservations.sync_order(db, order)
+    booked = await sales_analytics.sync_order(db, order)
+    return (STOCK_CHANGED if restocked else 0) | (SOLD_COUNTS_CHANGED if booked else 0)
@@ -0,0 +1,140 @@
+import asyncio
+from datetime import datetime
+from sqlalchemy import select, update
+from app.config import BITESHIP_API_KEY, ORDER_VALIDATION_WAIT
+from app.database import AsyncSessionLocal
+from app.models import Order, OrderItem, Product
+from app.shipping_rates import rate_quoter
+
+PENDING = "pending"
+VALIDATED = "validated"
+ADJUSTED = "adjusted"
+UNVERIFIED = "unverified"
+SKIPPED = "skipped"
+
+
+class OrderPipeline:
+    """Background stages of order placement that must not hold checkout open.
+
+    ``create_order`` writes the order with the buyer's submitted shipping cost
+    and ``shipping_validation = "pending"``, then hands it to ``submit``. The
+    validation stage re-quotes the chosen courier (usually straight from the
+    rate cache filled at checkout) and corrects ``shipping_cost``/``total``.
+    Updates only apply while the order is still pending, so a stage that
+    loses a race with ``settle`` never overwrites a decided order.
+    """
+
+    def __init__(self, wait_timeout: float):
+        self.wait_timeout = wait_timeout
+        self._tasks: dict[str, asyncio.Task] = {}
+        self.submitted = 0
+        self.outcomes = {VALIDATED: 0, ADJUSTED: 0, UNVERIFIED: 0}
+
+    @staticmethod
+    def needs_validation(destination_area_id: str, courier_company: str, courier_type: str) -> bool:
+        return bool(BITESHIP_API_KEY and destination_area_id and courier_company and courier_type)
+
+    def submit(self, order_id: str):
+        if order_id in self._tasks:
+            return
+        task = asyncio.create_task(self._validate(order_id))
+        self._tasks[order_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(order_id, None))
+        self.submitted += 1
+
+    async def settle(self, order_id: str):
+        """Wait (bounded) for an order's validation in flight; on timeout keep the submitted cost."""
+        task = self._tasks.get(order_id)
+        if task is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(task), self.wait_timeout)
+        except asyncio.TimeoutError:
+            task.cancel()
+            await self._finish(order_id, UNVERIFIED)
+
+    async def wait(self, order_id: str):
+        """Wait for an order's validation in flight however long it takes; unlike ``settle`` it never cuts it short.
+
+        Like ``settle`` it only joins a running task: a pending order always
+        has one (``create_order`` submits it, ``resume`` requeues it after a
+        restart), so an order without one has nothing left to validate.
+        """
+        task = self._tasks.get(order_id)
+        if task is not None:
+            # asyncio.wait neither raises the task's outcome nor cancels it when the waiter is cancelled
+            await asyncio.wait({task})
+
+    async def resume(self):
+        """Requeue orders whose validation was interrupted by a restart."""
+        async with AsyncSessionLocal() as db:
+            order_ids = (await db.scalars(select(Order.id).where(Order.shipping_validation == PENDING))).all()
+        for order_id in order_ids:
+            self.submit(order_id)
+
+    def shutdown(self):
+        # interrupted orders stay pending and are picked up by resume() on the next start
+        for task in list(self._tasks.values()):
+            task.cancel()
+
+    async def _validate(self, order_id: str):
+        from app.routes.shipping import resolve_origin
+
+        # the session is closed before quoting, so a slow Biteship never pins a pooled connection
+        async with AsyncSessionLocal() as db:
+            order = await db.scalar(select(Order).where(Order.id == order_id))
+            if order is None or order.shipping_validation != PENDING:
+                return
+            rows = (await db.execute(
+                select(OrderItem, Product)
+                .outerjoin(Product, Product.id == OrderItem.product_id)
+                .where(OrderItem.order_id == order_id)
+            )).all()
+        rate_items = [
+            {
+                "name": item.product_name[:50],
+                "value": int(item.price),
+                "weight": item.weight or 500,
+                "length": (product.length if product else None) or 10,
+                "width": (product.width if product else None) or 10,
+                "height": (product.height if product else None) or 10,
+                "quantity": item.quantity,
+            }
+            for item, product in rows
+        ]
+        origin_area_id, origin_postal_code = resolve_origin()
+        try:
+            price = await rate_quoter.price_for(
+                origin_area_id, origin_postal_code, order.destination_area_id, order.destination_postal_code,
+                rate_items, order.courier_company, order.courier_type,
+            )
+        except Exception as e:
+            print(f"[Order pipeline] Shipping validation failed for {order_id}: {e}")
+            price = None
+        if not price:
+            await self._finish(order_id, UNVERIFIED)
+        elif price == (order.shipping_cost or 0):
+            await self._finish(order_id, VALIDATED)
+        else:
+            await self._finish(order_id, ADJUSTED, price)
+
+    async def _finish(self, order_id: str, outcome: str, shipping_cost: float = None):
+        values = {"shipping_validation": outcome, "updated_at": datetime.utcnow()}
+        if shipping_cost is not None:
+            values["total"] = Order.total - Order.shipping_cost + shipping_cost
+            values["shipping_cost"] = shipping_cost
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(Order)
+                .where(Order.id == order_id, Order.shipping_validation == PENDING)
+                .values(**values)
+            )
+            await db.commit()
+        if result.rowcount:
+            self.outcomes[outcome] += 1
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._tasks), "submitted": self.submitted, **self.outcomes}
+
+
+order_pipeline = OrderPipeline(ORDER_VALIDATION_WAIT)
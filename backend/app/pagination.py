@@ -0,0 +1,26 @@
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+def clamp_limit(limit: int | None, default: int = DEFAULT_PAGE_SIZE) -> int:
+    return max(1, min(limit or default, MAX_PAGE_SIZE))
+
+
+def encode_cursor(value, row_id: str) -> str:
+    """Opaque keyset cursor: the sort value and id of the last row on the page."""
+    raw = json.dumps([value, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, value_types: tuple = (int, float)) -> tuple | None:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, row_id = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(value, value_types) or not isinstance(row_id, str):
+        return None
+    return value, row_id
@@ -0,0 +1,302 @@
+import asyncio
+import json
+from datetime import datetime
+from sqlalchemy import select, update, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.cache import catalog_cache
+from app.config import PAYMENT_NOTIFICATION_BATCH_SIZE, PAYMENT_NOTIFICATION_POLL_INTERVAL
+from app.database import AsyncSessionLocal
+from app.inventory import OutOfStock
+from app.models import Order, PaymentNotification, PaymentSession
+from app.order_events import order_status_changed
+
+APPLIED = "applied"
+REGRESSION = "regression"
+UNKNOWN_ORDER = "unknown_order"
+FAILED = "failed"
+# paid after the order was cancelled and its stock released, with the goods sold since: needs a refund
+OUT_OF_STOCK = "out_of_stock"
+# a pending or failed status of a Snap transaction the order has since been given a new token for
+SUPERSEDED = "superseded"
+
+# an order whose notifications keep failing to apply has them parked after this many tries
+MAX_ATTEMPTS = 5
+
+# how far along a Midtrans transaction is; a notification never moves an order backwards
+PAYMENT_STAGE = {
+    "pending": 0,
+    "authorize": 1,
+    "capture": 1,
+    "settlement": 2,
+    "deny": 2,
+    "cancel": 2,
+    "expire": 2,
+    "failure": 2,
+    "refund": 3,
+    "partial_refund": 3,
+    "chargeback": 3,
+    "partial_chargeback": 3,
+}
+FAILED_PAYMENTS = {"deny", "cancel", "expire", "failure"}
+PAID_ORDER_STATUSES = {"paid", "processing", "shipped", "completed"}
+
+
+def _insert(db: AsyncSession):
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def dedupe_key(order_ref: str, transaction_id: str | None, transaction_status: str, fraud_status: str | None) -> str:
+    # fraud_status is part of it: a challenged capture is re-sent with "accept" once reviewed
+    return f"{order_ref}:{transaction_id or ''}:{transaction_status}:{fraud_status or ''}"
+
+
+def is_regression(order: Order, transaction_status: str, transaction_id: str | None) -> bool:
+    """Whether applying ``transaction_status`` would move ``order``'s payment backwards."""
+    current = order.payment_status
+    if current is None and order.status in PAID_ORDER_STATUSES:
+        current = "settlement"  # paid before payment_status was recorded
+    if current is None:
+        return False
+    if current in FAILED_PAYMENTS and transaction_id and transaction_id != order.payment_id:
+        # Snap lets the buyer try again (another card, another bank) under the same order_id
+        return False
+    stage, current_stage = PAYMENT_STAGE.get(transaction_status, 0), PAYMENT_STAGE.get(current, 0)
+    if stage < current_stage:
+        return True
+    # settlement, deny, cancel and expire all end a transaction; the first one to arrive wins
+    return stage == current_stage and stage >= 2 and transaction_status != current
+
+
+def is_superseded(order: Order, order_ref: str, transaction_status: str) -> bool:
+    """Whether a status for an earlier Snap session of ``order`` must be left alone.
+
+    A replaced token can still be paid, so its payments apply, but its
+    ``pending`` and its expiry or failure say nothing about the current one.
+    """
+    if order_ref == (order.midtrans_order_id or order.id):
+        return False
+    return transaction_status == "pending" or transaction_status in FAILED_PAYMENTS
+
+
+def apply_payment_status(order: Order, transaction_status: str, fraud_status: str = "accept",
+                         transaction_id: str = None) -> bool:
+    """Apply a Midtrans status to ``order`` unless it is a regression; returns whether it was applied."""
+    from app.routes.payment import _apply_transaction_status
+
+    if is_regression(order, transaction_status, transaction_id):
+        return False
+    _apply_transaction_status(order, transaction_status, fraud_status, transaction_id)
+    order.payment_status = transaction_status
+    return True
+
+
+class PaymentNotifications:
+    """Durable inbox for Midtrans payment notifications.
+
+    The webhook only verifies the signature and inserts the notification
+    keyed by ``dedupe_key`` (ON CONFLICT DO NOTHING), so Midtrans retries
+    of one event collapse onto a single row and the request returns after
+    one small write. A worker drains the inbox in arrival order: each batch
+    loads all its orders in one query, applies every order's notifications
+    in sequence (skipping regressions such as a late ``pending`` after
+    ``settlement``), runs the order side effects once per order and commits
+    once. Each order is applied in its own savepoint, so one that fails is
+    retried on the next batch without holding back the others. Rows left
+    unprocessed by a restart are picked up on the next start.
+    """
+
+    def __init__(self, batch_size: int, poll_interval: float):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake = asyncio.Event()
+        # batches must not overlap or two of them would apply the same rows (one worker process)
+        self._lock = asyncio.Lock()
+        self._worker: asyncio.Task | None = None
+        self.received = 0
+        self.duplicates = 0
+        self.batches = 0
+        self.outcomes = {APPLIED: 0, REGRESSION: 0, UNKNOWN_ORDER: 0, FAILED: 0, OUT_OF_STOCK: 0, SUPERSEDED: 0}
+        self.last_lag_ms = 0.0
+
+    async def record(self, db: AsyncSession, body: dict) -> bool:
+        """Store a (signature-checked) notification; returns False for a duplicate."""
+        return await self.record_many(db, [body]) == 1
+
+    async def record_many(self, db: AsyncSession, bodies: list[dict]) -> int:
+        """Store several notifications in one statement; returns how many were new."""
+        if not bodies:
+            return 0
+        now = datetime.utcnow()
+        rows = []
+        for body in bodies:
+            order_ref = body.get("order_id", "")
+            transaction_id = body.get("transaction_id")
+            transaction_status = body.get("transaction_status", "")
+            fraud_status = body.get("fraud_status", "accept")
+            rows.append({
+                "dedupe_key": dedupe_key(order_ref, transaction_id, transaction_status, fraud_status),
+                "order_ref": order_ref,
+                "transaction_id": transaction_id,
+                "transaction_status": transaction_status,
+                "fraud_status": fraud_status,
+                "payload": json.dumps(body),
+                "received_at": now,
+                "attempts": 0,
+            })
+        insert = _insert(db)
+        stmt = insert(PaymentNotification).values(rows).on_conflict_do_nothing(index_elements=["dedupe_key"])
+        created = (await db.execute(stmt)).rowcount
+        await db.commit()
+        self.received += created
+        self.duplicates += len(rows) - created
+        if created:
+            self._wake.set()
+        return created
+
+    async def process_batch(self) -> int:
+        """Apply one batch of unprocessed notifications; returns how many rows it consumed."""
+        async with self._lock:
+            return await self._process_batch()
+
+    async def _process_batch(self) -> int:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.scalars(
+                select(PaymentNotification)
+                .where(PaymentNotification.processed_at.is_(None))
+                .order_by(PaymentNotification.id)
+                .limit(self.batch_size)
+            )).all()
+            if not rows:
+                return 0
+            now = datetime.utcnow()
+            lag_ms = round(max((now - r.received_at).total_seconds() for r in rows) * 1000, 1)
+
+            refs = sorted({r.order_ref for r in rows})
+            # a ref can also be the order_id of an earlier Snap token the order has since replaced
+            sessions = dict((await db.execute(
+                select(PaymentSession.midtrans_order_id, PaymentSession.order_id)
+                .where(PaymentSession.midtrans_order_id.in_(refs))
+            )).all())
+            orders = (await db.scalars(
+                select(Order)
+                .where(or_(Order.id.in_(sorted(set(refs) | set(sessions.values()))), Order.midtrans_order_id.in_(refs)))
+                .order_by(Order.id)
+            )).all()
+            by_id = {o.id: o for o in orders}
+            by_ref = {ref: by_id[order_id] for ref, order_id in sessions.items() if order_id in by_id}
+            by_ref.update({o.midtrans_order_id: o for o in orders if o.midtrans_order_id})
+            by_ref.update(by_id)
+
+            groups: dict[str, tuple[Order, list[PaymentNotification]]] = {}
+            for row in rows:
+                order = by_ref.get(row.order_ref)
+                if order is None:
+                    row.outcome = UNKNOWN_ORDER
+                    row.processed_at = now
+                    self.outcomes[UNKNOWN_ORDER] += 1
+                else:
+                    groups.setdefault(order.id, (order, []))[1].append(row)
+
+            catalog_changed = False
+            for order_id, (order, group) in groups.items():
+                attempts = {r.id: r.attempts for r in group}
+                try:
+                    # one savepoint per order: a notification that raises only holds back its own order
+                    async with db.begin_nested():
+                        catalog_changed |= await self._apply_order(db, order, group, now)
+                except Exception as e:
+                    await self._attempt_failed(db, order_id, attempts, now, e)
+                    continue
+                for row in group:
+                    self.outcomes[row.outcome] += 1
+            await db.commit()
+        if catalog_changed:
+            catalog_cache.invalidate()
+        self.batches += 1
+        self.last_lag_ms = lag_ms
+        return len(rows)
+
+    async def _apply_order(self, db: AsyncSession, order: Order, rows: list[PaymentNotification], now: datetime) -> bool:
+        """Apply one order's notifications in arrival order; returns whether product payloads changed."""
+        applied = []
+        for row in rows:
+            if is_superseded(order, row.order_ref, row.transaction_status):
+                row.outcome = SUPERSEDED
+            elif apply_payment_status(order, row.transaction_status, row.fraud_status or "accept", row.transaction_id):
+                row.outcome = APPLIED
+                # possibly paid through an earlier token: status checks and refunds go to that transaction
+                order.midtrans_order_id = row.order_ref
+                applied.append(row)
+            else:
+                row.outcome = REGRESSION
+            row.processed_at = now
+        if not applied:
+            return False
+        try:
+            return bool(await order_status_changed(db, order))
+        except OutOfStock:
+            # a retry paid an order whose holds were already released; the money has to go back
+            order.status = "cancelled"
+            for row in applied:
+                row.outcome = OUT_OF_STOCK
+            print(f"[Payments] Order {order.id} was paid after cancellation but its stock is gone; refund it")
+            return False
+
+    async def _attempt_failed(self, db: AsyncSession, order_id: str, attempts: dict[str, int], now: datetime, error: Exception):
+        """Count a failed try against one order's notifications; they are parked after MAX_ATTEMPTS."""
+        print(f"[Payments] Applying notifications for order {order_id} failed: {error}")
+        # the savepoint rollback expired the order and these rows, so they are updated by id rather than through the ORM
+        await db.execute(
+            update(PaymentNotification)
+            .where(PaymentNotification.id.in_(list(attempts)))
+            .values(attempts=PaymentNotification.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        exhausted = [row_id for row_id, count in attempts.items() if count + 1 >= MAX_ATTEMPTS]
+        if exhausted:
+            await db.execute(
+                update(PaymentNotification)
+                .where(PaymentNotification.id.in_(exhausted))
+                .values(outcome=FAILED, processed_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            self.outcomes[FAILED] += len(exhausted)
+            print(f"[Payments] Giving up on {len(exhausted)} notification(s) for order {order_id}")
+
+    async def _work_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                while await self.process_batch() == self.batch_size:
+                    pass
+            except Exception as e:
+                print(f"[Payments] Notification batch failed: {e}")
+
+    def start(self):
+        self._worker = asyncio.create_task(self._work_loop())
+
+    def shutdown(self):
+        # unprocessed rows stay in the inbox for the next start
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "batches": self.batches,
+            "outcomes": self.outcomes,
+            "last_lag_ms": self.last_lag_ms,
+        }
+
+
+payment_notifications = PaymentNotifications(PAYMENT_NOTIFICATION_BATCH_SIZE, PAYMENT_NOTIFICATION_POLL_INTERVAL)
@@ -0,0 +1,179 @@
+import asyncio
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from app.config import (
+    MIDTRANS_SERVER_KEY, MIDTRANS_IS_PRODUCTION, PAYMENT_RECONCILE_INTERVAL, PAYMENT_RECONCILE_BATCH_SIZE,
+    PAYMENT_RECONCILE_RECHECK, PAYMENT_RECONCILE_RATE, PAYMENT_REFRESH_MIN_INTERVAL,
+)
+from app.database import AsyncSessionLocal
+from app.http_clients import midtrans
+from app.models import Order, PaymentSession
+from app.payment_notifications import payment_notifications
+
+STATUS_SANDBOX_URL = "https://api.sandbox.midtrans.com/v2"
+STATUS_PRODUCTION_URL = "https://api.midtrans.com/v2"
+
+
+class PaymentReconciler:
+    """Settles pending orders from the Midtrans status API when their webhook never arrives.
+
+    Every order with a Snap session carries ``payment_checked_at``
+    (set when its token is created). A background sweep picks pending
+    orders not checked for ``recheck`` seconds, asks Midtrans for the status
+    of each of their Snap sessions (``PaymentSession``; a replaced token
+    can still be paid) concurrently (the midtrans client bounds
+    connections; starts are additionally spaced to ``rate`` per second) and
+    records every status that differs from the order's as a notification
+    in one insert, so the notification worker applies it with the same
+    ordering and regression rules as a webhook. ``payment_checked_at`` is
+    bumped for the whole batch in one update. ``GET /api/payment/status``
+    answers from the database and only calls Midtrans on a forced refresh,
+    at most once per ``refresh_min_interval`` per order.
+    """
+
+    def __init__(self, interval: float, batch_size: int, recheck: float, rate: float, refresh_min_interval: float):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.recheck = recheck
+        self.rate = rate
+        self.refresh_min_interval = refresh_min_interval
+        self._sweeper: asyncio.Task | None = None
+        self.checked = 0
+        self.check_failures = 0
+        self.discovered = 0
+        self.refreshes = 0
+        self.refreshes_skipped = 0
+
+    async def _fetch(self, midtrans_order_id: str, delay: float = 0) -> dict | None:
+        """The transaction's status, {} when Midtrans has no transaction yet, None on failure."""
+        if delay:
+            await asyncio.sleep(delay)
+        base_url = STATUS_PRODUCTION_URL if MIDTRANS_IS_PRODUCTION else STATUS_SANDBOX_URL
+        try:
+            resp = await midtrans.get(f"{base_url}/{midtrans_order_id}/status")
+        except Exception as e:
+            print(f"[Payments] Status check of {midtrans_order_id} failed: {e}")
+            return None
+        if resp.status_code != 200:
+            return None
+        data = resp.json()
+        # an order whose buyer hasn't picked a payment method yet is a 200 with status_code "404"
+        return data if data.get("transaction_status") else {}
+
+    @staticmethod
+    async def _refs(orders: list[Order]) -> list[tuple[Order, str]]:
+        """Each order with its current Snap order_id, followed by its earlier ones."""
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(PaymentSession.order_id, PaymentSession.midtrans_order_id)
+                .where(PaymentSession.order_id.in_(sorted(o.id for o in orders)))
+            )).all()
+        earlier: dict[str, set[str]] = {}
+        for order_id, ref in rows:
+            earlier.setdefault(order_id, set()).add(ref)
+        refs = []
+        for order in orders:
+            current = order.midtrans_order_id
+            refs.append((order, current))
+            refs += [(order, ref) for ref in sorted(earlier.get(order.id, ())) if ref != current]
+        return refs
+
+    async def _check(self, orders: list[Order]) -> int:
+        """Query Midtrans for ``orders`` and record what changed; returns how many statuses were new."""
+        spacing = 1 / self.rate if self.rate > 0 else 0
+        refs = await self._refs(orders)
+        responses = await asyncio.gather(*(
+            self._fetch(ref, i * spacing) for i, (order, ref) in enumerate(refs)
+        ))
+        bodies = []
+        for (order, ref), data in zip(refs, responses):
+            if data is None:
+                self.check_failures += 1
+                continue
+            if data and data["transaction_status"] != order.payment_status:
+                # an earlier session's expiry is recorded once (deduplicated) and left alone by the worker
+                bodies.append({**data, "order_id": ref, "source": "reconciliation"})
+        self.checked += len(orders)
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Order)
+                .where(Order.id.in_(sorted(o.id for o in orders)))
+                .values(payment_checked_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            discovered = await payment_notifications.record_many(db, bodies)
+            await db.commit()
+        self.discovered += discovered
+        return discovered
+
+    async def sweep(self) -> int:
+        """Check one batch of pending orders that are due; returns how many were checked."""
+        if not MIDTRANS_SERVER_KEY:
+            return 0
+        cutoff = datetime.utcnow() - timedelta(seconds=self.recheck)
+        async with AsyncSessionLocal() as db:
+            orders = (await db.scalars(
+                select(Order)
+                .where(Order.status == "pending", Order.payment_checked_at <= cutoff)
+                .order_by(Order.payment_checked_at)
+                .limit(self.batch_size)
+            )).all()
+        if orders:
+            await self._check(list(orders))
+        return len(orders)
+
+    async def refresh(self, order: Order) -> bool:
+        """Re-check one order now and apply the result; False when it was checked too recently to ask again."""
+        if not MIDTRANS_SERVER_KEY or not order.midtrans_order_id or order.status != "pending":
+            return False
+        now = datetime.utcnow()
+        if order.payment_checked_at and now - order.payment_checked_at < timedelta(seconds=self.refresh_min_interval):
+            self.refreshes_skipped += 1
+            return False
+        # claimed with a conditional update so concurrent pollers trigger one upstream call between them
+        async with AsyncSessionLocal() as db:
+            claimed = await db.execute(
+                update(Order)
+                .where(Order.id == order.id, Order.payment_checked_at == order.payment_checked_at)
+                .values(payment_checked_at=now)
+            )
+            await db.commit()
+        if claimed.rowcount != 1:
+            self.refreshes_skipped += 1
+            return False
+        self.refreshes += 1
+        if await self._check([order]):
+            await payment_notifications.process_batch()
+        return True
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                while await self.sweep() == self.batch_size:
+                    pass
+            except Exception as e:
+                print(f"[Payments] Reconciliation failed: {e}")
+
+    def start(self):
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    def shutdown(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    def stats(self) -> dict:
+        return {
+            "checked": self.checked,
+            "check_failures": self.check_failures,
+            "discovered": self.discovered,
+            "refreshes": self.refreshes,
+            "refreshes_skipped": self.refreshes_skipped,
+        }
+
+
+payment_reconciler = PaymentReconciler(
+    PAYMENT_RECONCILE_INTERVAL, PAYMENT_RECONCILE_BATCH_SIZE, PAYMENT_RECONCILE_RECHECK,
+    PAYMENT_RECONCILE_RATE, PAYMENT_REFRESH_MIN_INTERVAL,
+)
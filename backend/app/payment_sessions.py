@@ -0,0 +1,245 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from app.config import MIDTRANS_SERVER_KEY, MIDTRANS_IS_PRODUCTION, PAYMENT_TOKEN_TTL_MINUTES, PAYMENT_TOKEN_REFRESH_MARGIN
+from app.database import AsyncSessionLocal
+from app.http_clients import midtrans
+from app.models import Order, OrderItem, PaymentSession, User
+from app.order_pipeline import order_pipeline, PENDING
+
+SNAP_SANDBOX_URL = "https://app.sandbox.midtrans.com/snap/v1/transactions"
+SNAP_PRODUCTION_URL = "https://app.midtrans.com/snap/v1/transactions"
+
+MAX_ATTEMPTS = 3
+
+
+class PaymentSessionError(Exception):
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def _snap_payload(order: Order, order_items: list[OrderItem], user: User, midtrans_order_id: str, ttl_minutes: int) -> dict:
+    item_details = []
+    for oi in order_items:
+        item_details.append({
+            "id": str(oi.product_id) if oi.product_id else oi.id,
+            "price": int(oi.price),
+            "quantity": oi.quantity,
+            "name": (oi.product_name or "Produk")[:50],
+        })
+
+    items_total = sum(int(oi.price) * oi.quantity for oi in order_items)
+
+    shipping_cost = int(order.shipping_cost or 0)
+    if shipping_cost > 0:
+        item_details.append({
+            "id": "shipping",
+            "price": shipping_cost,
+            "quantity": 1,
+            "name": (order.courier_service_name or "Ongkos Kirim")[:50],
+        })
+
+    gross_total = items_total + shipping_cost
+
+    name_parts = (user.name or "").split(" ", 1)
+    first_name = name_parts[0] or user.email.split("@")[0]
+    last_name = name_parts[1] if len(name_parts) > 1 else ""
+
+    customer_details: dict = {
+        "first_name": first_name,
+        "last_name": last_name,
+        "email": user.email,
+        "phone": user.phone or "",
+    }
+
+    shipping_text = order.shipping_address or ""
+    billing_address: dict = {
+        "first_name": first_name,
+        "last_name": last_name,
+        "email": user.email,
+        "phone": user.phone or "",
+        "address": user.address or shipping_text,
+        "city": user.city or "",
+        "country_code": "IDN",
+    }
+    if user.postal_code:
+        billing_address["postal_code"] = user.postal_code
+
+    shipping_address = {
+        **billing_address,
+        "address": shipping_text or user.address or "",
+    }
+
+    customer_details["billing_address"] = billing_address
+    customer_details["shipping_address"] = shipping_address
+
+    return {
+        "transaction_details": {
+            "order_id": midtrans_order_id,
+            "gross_amount": gross_total,
+        },
+        "customer_details": customer_details,
+        "item_details": item_details,
+        "credit_card": {
+            "secure": True,
+        },
+        # the token's lifetime is what payment_token_expires_at records
+        "expiry": {"unit": "minute", "duration": ttl_minutes},
+    }
+
+
+class PaymentSessions:
+    """Snap payment tokens, created ahead of the payment popup and reused until they expire.
+
+    ``prewarm`` starts creating an order's token as soon as the order is
+    committed, once its background shipping validation has finished, so
+    the amount is final. The token, its redirect URL, expiry and the order
+    total it was made for are stored on the order, so opening the popup is
+    normally just reading them back. A token is recreated when it is close
+    to expiry or the total changed; a popup opened while creation is in
+    flight waits for that same request instead of starting another. Only
+    a buyer actually paying cuts the validation short (``settle``). No
+    database session is held while waiting on validation or Midtrans.
+    Every Snap order_id handed out is recorded as a ``PaymentSession``:
+    a replaced token can still be paid, and its notifications and status
+    checks have to find the order.
+    """
+
+    def __init__(self, ttl_minutes: int, refresh_margin: float):
+        self.ttl_minutes = ttl_minutes
+        self.refresh_margin = refresh_margin
+        self._tasks: dict[str, asyncio.Task] = {}
+        self.prewarmed = 0
+        self.created = 0
+        self.reused = 0
+        self.joined = 0
+        self.failures = 0
+
+    def usable(self, order: Order, now: datetime = None) -> bool:
+        now = now or datetime.utcnow()
+        return bool(
+            order.payment_token
+            and order.payment_token_expires_at
+            and order.payment_token_expires_at - timedelta(seconds=self.refresh_margin) > now
+            and order.payment_token_total == order.total
+        )
+
+    @staticmethod
+    def session(order: Order) -> dict:
+        return {"token": order.payment_token, "redirect_url": order.payment_redirect_url}
+
+    def prewarm(self, order_id: str):
+        if not MIDTRANS_SERVER_KEY or order_id in self._tasks:
+            return
+        self._start(order_id)
+        self.prewarmed += 1
+
+    async def token_for(self, order: Order) -> dict:
+        """The order's Snap session, reusing a stored token when possible; raises PaymentSessionError."""
+        if order.status != "pending":
+            raise PaymentSessionError("Pesanan tidak dapat dibayar", 400)
+        if self.usable(order):
+            self.reused += 1
+            return self.session(order)
+        if order.shipping_validation == PENDING:
+            # submit is a no-op while the validation runs; it restarts one that died without finishing
+            order_pipeline.submit(order.id)
+            # the buyer is waiting: bounded, and a prewarm waiting on the same validation resumes with it
+            await order_pipeline.settle(order.id)
+        task = self._tasks.get(order.id)
+        if task is not None:
+            self.joined += 1
+        else:
+            task = self._start(order.id)
+        return await asyncio.shield(task)
+
+    def _start(self, order_id: str) -> asyncio.Task:
+        task = asyncio.create_task(self._create(order_id))
+        self._tasks[order_id] = task
+        task.add_done_callback(lambda t: self._finished(order_id, t))
+        return task
+
+    def _finished(self, order_id: str, task: asyncio.Task):
+        self._tasks.pop(order_id, None)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self.failures += 1
+            print(f"[Payments] Snap token for {order_id} failed: {error}")
+
+    async def _create(self, order_id: str) -> dict:
+        # the amount charged must be final before Snap sees it; waits without cancelling the validation
+        await order_pipeline.wait(order_id)
+        async with AsyncSessionLocal() as db:
+            order = await db.get(Order, order_id)
+            if order is None:
+                raise PaymentSessionError("Pesanan tidak ditemukan", 404)
+            if order.status != "pending":
+                raise PaymentSessionError("Pesanan tidak dapat dibayar", 400)
+            if self.usable(order):
+                return self.session(order)
+            user = await db.get(User, order.user_id)
+            order_items = (await db.scalars(select(OrderItem).where(OrderItem.order_id == order.id))).all()
+
+        snap_url = SNAP_PRODUCTION_URL if MIDTRANS_IS_PRODUCTION else SNAP_SANDBOX_URL
+        midtrans_order_id = order.midtrans_order_id or order.id
+        last_error = ""
+        for attempt in range(MAX_ATTEMPTS):
+            created_at = datetime.utcnow()
+            resp = await midtrans.post(snap_url, json=_snap_payload(order, order_items, user, midtrans_order_id, self.ttl_minutes))
+
+            if resp.status_code == 201:
+                data = resp.json()
+                values = {
+                    "payment_token": data.get("token"),
+                    "payment_redirect_url": data.get("redirect_url"),
+                    "payment_token_expires_at": created_at + timedelta(minutes=self.ttl_minutes),
+                    "payment_token_total": order.total,
+                    "midtrans_order_id": midtrans_order_id,
+                    # from here on the reconciliation sweep checks it if no notification arrives
+                    "payment_checked_at": created_at,
+                }
+                async with AsyncSessionLocal() as db:
+                    await db.execute(update(Order).where(Order.id == order_id).values(**values))
+                    # an earlier token stays payable, so its order_id must keep resolving to this order
+                    await db.merge(PaymentSession(
+                        midtrans_order_id=midtrans_order_id, order_id=order_id,
+                        created_at=created_at, expires_at=values["payment_token_expires_at"],
+                    ))
+                    await db.commit()
+                self.created += 1
+                return {"token": values["payment_token"], "redirect_url": values["payment_redirect_url"]}
+
+            try:
+                error_data = resp.json()
+                msgs = error_data.get("error_messages", [])
+                last_error = "; ".join(msgs) if msgs else "Gagal membuat token pembayaran"
+                if any("already" in m.lower() or "used" in m.lower() or "exist" in m.lower() for m in msgs):
+                    # the previous token's order_id can't be reused once Snap has seen it
+                    midtrans_order_id = f"{order.id}-{int(time.time())}"
+                    continue
+            except Exception:
+                last_error = "Gagal membuat token pembayaran"
+            break
+        raise PaymentSessionError(last_error)
+
+    def shutdown(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._tasks),
+            "prewarmed": self.prewarmed,
+            "created": self.created,
+            "reused": self.reused,
+            "joined": self.joined,
+            "failures": self.failures,
+        }
+
+
+payment_sessions = PaymentSessions(PAYMENT_TOKEN_TTL_MINUTES, PAYMENT_TOKEN_REFRESH_MARGIN)
@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db
+from app.routes.auth import get_current_user
+from app.analytics import sales_analytics, local_day
+from datetime import date, timedelta
+
+router = APIRouter(prefix="/api/analytics")
+
+DEFAULT_RANGE_DAYS = 30
+
+
+@router.get("/sales")
+async def sales_report(
+    request: Request, date_from: str = None, date_to: str = None, top: int = 10,
+    db: AsyncSession = Depends(get_db),
+):
+    user = await get_current_user(request, db)
+    if not user or user.role != "seller":
+        return JSONResponse({"error": "Akses ditolak"}, status_code=403)
+    try:
+        end = date.fromisoformat(date_to) if date_to else local_day()
+        start = date.fromisoformat(date_from) if date_from else end - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    except ValueError:
+        return JSONResponse({"error": "Tanggal tidak valid, gunakan format YYYY-MM-DD"}, status_code=400)
+    if start > end:
+        return JSONResponse({"error": "date_from harus sebelum date_to"}, status_code=400)
+    return await sales_analytics.report(db, start, end, max(1, min(top, 100)))
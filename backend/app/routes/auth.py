@@ -1,10 +1,13 @@
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.models import User, gen_id
-from app.config import JWT_SECRET
-import bcrypt
+from app.config import JWT_SECRET, AUTH_CONTEXT_MODE, USER_CONTEXT_TTL
+from app.cache import TTLCache
+from app.hashing import password_hasher, HasherBusy
+from dataclasses import dataclass
 import re
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
@@ -16,23 +19,57 @@ COOKIE_NAME = "store_auth_token"
 COOKIE_MAX_AGE = 7 * 24 * 60 * 60
 
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+async def hash_password(password: str) -> str:
+    return await password_hasher.hash(password)
 
 
-def verify_password(password: str, password_hash: str) -> bool:
-    return bcrypt.checkpw(password.encode(), password_hash.encode())
+async def verify_password(password: str, password_hash: str) -> bool:
+    return await password_hasher.verify(password, password_hash)
 
 
-def create_token(user_id: str) -> str:
+USER_CONTEXT_FIELDS = ("email", "name", "role", "phone", "address", "city", "province", "postal_code", "area_id")
+
+
+@dataclass(frozen=True)
+class UserContext:
+    """Read-only snapshot of the fields request handlers need from the logged-in user."""
+    id: str
+    email: str
+    name: str
+    role: str
+    phone: str | None = None
+    address: str | None = None
+    city: str | None = None
+    province: str | None = None
+    postal_code: str | None = None
+    area_id: str | None = None
+
+
+def user_context(user: User) -> UserContext:
+    return UserContext(id=user.id, **{f: getattr(user, f) for f in USER_CONTEXT_FIELDS})
+
+
+user_context_cache = TTLCache(max_entries=10000, ttl=USER_CONTEXT_TTL)
+
+
+def create_token(user: User) -> str:
     payload = {
-        "sub": user_id,
+        "sub": user.id,
         "exp": datetime.utcnow() + timedelta(days=7),
     }
+    if AUTH_CONTEXT_MODE == "claims":
+        payload["ctx"] = {f: getattr(user, f) for f in USER_CONTEXT_FIELDS}
     return jwt.encode(payload, JWT_SECRET, algorithm=ALGORITHM)
 
 
-def user_dict(user: User) -> dict:
+def set_auth_cookie(response: JSONResponse, user: User):
+    response.set_cookie(
+        COOKIE_NAME, create_token(user),
+        httponly=True, samesite="lax", path="/", max_age=COOKIE_MAX_AGE
+    )
+
+
+def user_dict(user: User | UserContext) -> dict:
     return {
         "id": user.id, "email": user.email, "name": user.name, "role": user.role,
         "phone": user.phone, "address": user.address, "city": user.city,
@@ -40,39 +77,59 @@ def user_dict(user: User) -> dict:
     }
 
 
-def get_current_user(request: Request, db: Session) -> User | None:
+async def get_current_user(request: Request, db: AsyncSession) -> UserContext | None:
     token = request.cookies.get(COOKIE_NAME)
     if not token:
         return None
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if not user_id:
-            return None
-        return db.query(User).filter(User.id == user_id).first()
     except JWTError:
         return None
+    user_id = payload.get("sub")
+    if not user_id:
+        return None
+    claims = payload.get("ctx")
+    if AUTH_CONTEXT_MODE == "claims" and isinstance(claims, dict):
+        return UserContext(id=user_id, **{f: claims.get(f) for f in USER_CONTEXT_FIELDS})
+    context = user_context_cache.get(user_id)
+    if context is None:
+        user = await db.get(User, user_id)
+        if not user:
+            return None
+        context = user_context(user)
+        user_context_cache.set(user_id, context)
+    return context
+
+
+async def _merge_guest_cart(request: Request, db: AsyncSession, user: User, response: JSONResponse):
+    # routes.cart imports this module for get_current_user
+    from app.routes.cart import merge_guest_cart
+
+    await merge_guest_cart(request, db, user.id, response)
 
 
 @router.post("/login")
-async def login(request: Request, db: Session = Depends(get_db)):
+async def login(request: Request, db: AsyncSession = Depends(get_db)):
     body = await request.json()
     email = body.get("email", "")
     password = body.get("password", "")
-    user = db.query(User).filter(User.email == email).first()
-    if not user or not verify_password(password, user.password_hash):
+    user = await db.scalar(select(User).where(User.email == email))
+    if not user or not await verify_password(password, user.password_hash):
         return JSONResponse({"error": "Email atau password salah"}, status_code=401)
-    token = create_token(user.id)
+    if password_hasher.needs_rehash(user.password_hash):
+        try:
+            user.password_hash = await hash_password(password)
+            await db.commit()
+        except HasherBusy:
+            pass
     response = JSONResponse({"user": user_dict(user)})
-    response.set_cookie(
-        COOKIE_NAME, token,
-        httponly=True, samesite="lax", path="/", max_age=COOKIE_MAX_AGE
-    )
+    set_auth_cookie(response, user)
+    await _merge_guest_cart(request, db, user, response)
     return response
 
 
 @router.post("/register")
-async def register(request: Request, db: Session = Depends(get_db)):
+async def register(request: Request, db: AsyncSession = Depends(get_db)):
     body = await request.json()
     name = body.get("name", "")
     email = body.get("email", "")
@@ -84,30 +141,26 @@ async def register(request: Request, db: Session = Depends(get_db)):
     postal_code = body.get("postal_code", "")
     if not name or not email or not password or not phone:
         return JSONResponse({"error": "Nama, email, password, dan nomor telepon harus diisi"}, status_code=400)
-    existing = db.query(User).filter(User.email == email).first()
+    existing = await db.scalar(select(User).where(User.email == email))
     if existing:
         return JSONResponse({"error": "Email sudah terdaftar"}, status_code=400)
     user = User(
         id=gen_id(), email=email, name=name, phone=phone,
         address=address or None, city=city or None,
         province=province or None, postal_code=postal_code or None,
-        password_hash=hash_password(password), role="buyer",
+        password_hash=await hash_password(password), role="buyer",
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
-    token = create_token(user.id)
+    await db.commit()
     response = JSONResponse({"user": user_dict(user)})
-    response.set_cookie(
-        COOKIE_NAME, token,
-        httponly=True, samesite="lax", path="/", max_age=COOKIE_MAX_AGE
-    )
+    set_auth_cookie(response, user)
+    await _merge_guest_cart(request, db, user, response)
     return response
 
 
 @router.get("/me")
-async def me(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def me(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user:
         return {"user": None}
     return {"user": user_dict(user)}
@@ -117,8 +170,8 @@ EMAIL_REGEX = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
 
 
 @router.post("/change-password")
-async def change_password(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def change_password(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user:
         return JSONResponse({"error": "Silakan login terlebih dahulu"}, status_code=401)
     body = await request.json()
@@ -128,16 +181,18 @@ async def change_password(request: Request, db: Session = Depends(get_db)):
         return JSONResponse({"error": "Password lama dan baru harus diisi"}, status_code=400)
     if len(new_password) < 6:
         return JSONResponse({"error": "Password baru minimal 6 karakter"}, status_code=400)
-    if not verify_password(current_password, user.password_hash):
+    account = await db.get(User, user.id)
+    if not account or not await verify_password(current_password, account.password_hash):
         return JSONResponse({"error": "Password lama salah"}, status_code=400)
-    user.password_hash = hash_password(new_password)
-    db.commit()
+    account.password_hash = await hash_password(new_password)
+    await db.commit()
+    user_context_cache.delete(user.id)
     return {"success": True, "message": "Password berhasil diubah"}
 
 
 @router.post("/change-email")
-async def change_email(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def change_email(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user:
         return JSONResponse({"error": "Silakan login terlebih dahulu"}, status_code=401)
     body = await request.json()
@@ -147,16 +202,21 @@ async def change_email(request: Request, db: Session = Depends(get_db)):
         return JSONResponse({"error": "Email baru dan password harus diisi"}, status_code=400)
     if not EMAIL_REGEX.match(new_email):
         return JSONResponse({"error": "Format email tidak valid"}, status_code=400)
-    if not verify_password(password, user.password_hash):
+    account = await db.get(User, user.id)
+    if not account or not await verify_password(password, account.password_hash):
         return JSONResponse({"error": "Password salah"}, status_code=400)
-    if new_email == user.email:
+    if new_email == account.email:
         return JSONResponse({"error": "Email baru sama dengan email lama"}, status_code=400)
-    existing = db.query(User).filter(User.email == new_email).first()
+    existing = await db.scalar(select(User).where(User.email == new_email))
     if existing:
         return JSONResponse({"error": "Email sudah digunakan oleh akun lain"}, status_code=400)
-    user.email = new_email
-    db.commit()
-    return {"success": True, "message": "Email berhasil diubah", "user": user_dict(user)}
+    account.email = new_email
+    await db.commit()
+    user_context_cache.delete(user.id)
+    # claims-mode tokens carry the email, so hand this session a fresh one
+    response = JSONResponse({"success": True, "message": "Email berhasil diubah", "user": user_dict(account)})
+    set_auth_cookie(response, account)
+    return response
 
 
 @router.post("/logout")
@@ -1,12 +1,29 @@
+from dataclasses import dataclass
 from fastapi import APIRouter, Depends, Request
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import select, update, delete, func, literal_column, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager
 from app.database import get_db
 from app.models import CartItem, Product, ProductVariant, gen_id
 from app.routes.auth import get_current_user
+from app.inventory import stock_reservations
+from app.guest_carts import guest_carts, GuestCartStoreError
+from app.shipping_rates import parcel_signature
+from app.config import CART_BATCH_MAX
 
 router = APIRouter(prefix="/api")
 
+OPERATIONS = ("add", "set", "remove")
+
+
+class CartError(Exception):
+    def __init__(self, message: str, status_code: int, index: int = None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.index = index
+
 
 def cart_item_dict(item: CartItem) -> dict:
     product = item.product
@@ -30,83 +47,396 @@ def cart_item_dict(item: CartItem) -> dict:
     }
 
 
+def cart_summary(items: list[CartItem]) -> dict:
+    """Totals, weight and the stacked parcel (as quoted by app.shipping_rates) for cart lines with products loaded."""
+    lines = [cart_item_dict(item) for item in items if item.product]
+    weight, length, width, height = parcel_signature([{**line["product"], "quantity": line["quantity"]} for line in lines])
+    return {
+        "item_count": len(lines),
+        "quantity": sum(line["quantity"] for line in lines),
+        "subtotal": sum(line["unit_price"] * line["quantity"] for line in lines),
+        "total_weight": weight,
+        "parcel": {"length": length, "width": width, "height": height},
+    }
+
+
+async def cart_view(db: AsyncSession, user_id: str) -> dict:
+    # one joined query; the product columns fill item.product directly
+    items = (await db.scalars(
+        select(CartItem)
+        .join(CartItem.product)
+        .options(contains_eager(CartItem.product))
+        .where(CartItem.user_id == user_id)
+        .order_by(Product.name, CartItem.variant_name, CartItem.id)
+        # quantities are written with UPDATE/upsert statements, so loaded lines are refreshed
+        .execution_options(populate_existing=True)
+    )).all()
+    return {"items": [cart_item_dict(i) for i in items], "summary": cart_summary(items)}
+
+
+def _unit_price(product: Product, variant: ProductVariant | None) -> float:
+    if variant and variant.price is not None:
+        return variant.price
+    if variant and variant.price_modifier:
+        return product.price + variant.price_modifier
+    return product.price
+
+
+def _quantity(op: dict, default: int, index: int) -> int:
+    try:
+        return int(op.get("quantity", default))
+    except (TypeError, ValueError):
+        raise CartError("Jumlah tidak valid", 400, index)
+
+
+@dataclass
+class CartPlan:
+    quantities: dict[tuple, int]  # final quantity of every line touched, in order of first touch
+    prices: dict[tuple, float]  # current unit price of the lines addressed by product
+    absolute: set[tuple]  # lines a set/remove touched; the others only grew by their add operations
+    available: dict[tuple, int]  # stock of the lines that grew
+    last_index: dict[tuple, int]  # the last operation on each line, for error reporting
+
+
+async def plan_cart_operations(db: AsyncSession, current: dict[tuple, tuple[str, int]], operations: list[dict],
+                               lenient: bool = False) -> CartPlan:
+    """Work out what add/set/remove operations do to a cart, without writing anything.
+
+    ``current`` maps each line's (product_id, variant_name) to its (line id,
+    quantity). ``add`` increments a line (creating it), ``set`` makes it an
+    absolute quantity (0 removes it) and ``remove`` deletes it; lines are
+    addressed by ``item_id``, ``product_id`` or ``product_slug``, plus
+    ``variant_name``. Products, variants and the stock of every line that
+    grows are each read in one query. Returns the final quantity of every
+    line touched, in order of first touch, and the current unit price of
+    those addressed by product. Raises CartError with the index of the
+    offending operation; with ``lenient`` (merging a guest cart) unknown
+    products are skipped and quantities are capped at what is in stock.
+    """
+    by_id = {line_id: key for key, (line_id, _) in current.items()}
+    slugs = sorted({op["product_slug"] for op in operations if isinstance(op, dict) and op.get("product_slug")})
+    ids = sorted({op["product_id"] for op in operations if isinstance(op, dict) and op.get("product_id")})
+    products = {}
+    if slugs or ids:
+        for product in (await db.scalars(select(Product).where(or_(Product.slug.in_(slugs), Product.id.in_(ids))))).all():
+            products[product.slug] = products[product.id] = product
+    variants = {}
+    if products:
+        for variant in (await db.scalars(
+            select(ProductVariant).where(ProductVariant.product_id.in_(sorted({p.id for p in products.values()})))
+        )).all():
+            variants.setdefault((variant.product_id, variant.variant_name), variant)
+
+    quantities = {key: quantity for key, (_, quantity) in current.items()}
+    prices: dict[tuple, float] = {}
+    absolute: set[tuple] = set()
+    last_index: dict[tuple, int] = {}
+    for index, op in enumerate(operations):
+        kind = op.get("op") if isinstance(op, dict) else None
+        if kind not in OPERATIONS:
+            raise CartError("Operasi keranjang tidak valid", 400, index)
+        if op.get("item_id"):
+            key = by_id.get(op["item_id"])
+            if key is None:
+                if lenient:
+                    continue
+                raise CartError("Item tidak ditemukan", 404, index)
+        else:
+            product = products.get(op.get("product_id") or op.get("product_slug") or "")
+            if not product:
+                if lenient:
+                    continue
+                raise CartError("Produk tidak ditemukan", 404, index)
+            key = (product.id, op.get("variant_name") or None)
+            prices[key] = _unit_price(product, variants.get(key))
+        if kind == "add":
+            quantity = _quantity(op, 1, index)
+            if quantity <= 0:
+                raise CartError("Jumlah tidak valid", 400, index)
+            quantities[key] = quantities.get(key, 0) + quantity
+        elif kind == "set":
+            quantities[key] = max(_quantity(op, 0, index), 0)
+            absolute.add(key)
+        else:
+            quantities[key] = 0
+            absolute.add(key)
+        last_index[key] = index
+
+    grown = [key for key in last_index if quantities[key] > (current[key][1] if key in current else 0)]
+    available = await stock_reservations.available_many(db, grown)
+    for key in grown:
+        if quantities[key] > available[key]:
+            if not lenient:
+                raise CartError("Stok tidak mencukupi", 409, last_index[key])
+            quantities[key] = max(available[key], current[key][1] if key in current else 0)
+    return CartPlan({key: quantities[key] for key in last_index}, prices, absolute, available, last_index)
+
+
+async def apply_cart_operations(db: AsyncSession, user_id: str, operations: list[dict],
+                                lenient: bool = False) -> dict[tuple, int]:
+    """Apply cart operations (see plan_cart_operations) to a user's cart in the caller's transaction.
+
+    All operations succeed or none do; after a CartError the caller must
+    roll back. The cart is read in one query, removed lines are deleted in
+    one statement and new lines are upserted. Lines that only had ``add``
+    operations are written as increments (``quantity = quantity + n``), so
+    concurrent adds to one line add up instead of overwriting each other;
+    the summed quantity is checked against stock again. Returns the final
+    quantity of every line touched.
+    """
+    existing = {
+        (item.product_id, item.variant_name or None): item
+        for item in (await db.scalars(select(CartItem).where(CartItem.user_id == user_id))).all()
+    }
+    plan = await plan_cart_operations(
+        db, {key: (item.id, item.quantity) for key, item in existing.items()}, operations, lenient
+    )
+
+    removed = sorted(existing[key].id for key, quantity in plan.quantities.items() if quantity == 0 and key in existing)
+    if removed:
+        await db.execute(delete(CartItem).where(CartItem.id.in_(removed), CartItem.user_id == user_id))
+    written: dict[tuple, int] = {}
+    new_lines = {True: [], False: []}
+    for key, quantity in plan.quantities.items():
+        if quantity == 0:
+            continue
+        additive = key not in plan.absolute
+        values = {"unit_price": plan.prices[key]} if key in plan.prices else {}
+        if key in existing:
+            delta = quantity - existing[key].quantity
+            values["quantity"] = CartItem.quantity + delta if additive else quantity
+            result = await db.execute(
+                update(CartItem).where(CartItem.id == existing[key].id).values(**values).returning(CartItem.quantity)
+            )
+            written[key] = result.scalar_one()
+        else:
+            product_id, variant_name = key
+            new_lines[additive].append({
+                "id": gen_id(), "user_id": user_id, "product_id": product_id,
+                "variant_name": variant_name, "unit_price": plan.prices[key], "quantity": quantity,
+            })
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    for additive, lines in new_lines.items():
+        if not lines:
+            continue
+        stmt = insert(CartItem).values(lines)
+        # a concurrent request may have created the same line (uq_cart_items_user_product_variant)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CartItem.user_id, CartItem.product_id, func.coalesce(CartItem.variant_name, literal_column("''"))],
+            set_={
+                "quantity": CartItem.quantity + stmt.excluded.quantity if additive else stmt.excluded.quantity,
+                "unit_price": stmt.excluded.unit_price,
+            },
+        ).returning(CartItem.product_id, CartItem.variant_name, CartItem.quantity)
+        for product_id, variant_name, quantity in (await db.execute(stmt)).all():
+            written[(product_id, variant_name or None)] = quantity
+
+    for key, quantity in written.items():
+        if key in plan.absolute or key not in plan.available or quantity <= plan.available[key]:
+            continue
+        # a concurrent add to the same line took it past the stock checked above
+        if not lenient:
+            raise CartError("Stok tidak mencukupi", 409, plan.last_index[key])
+        line = (CartItem.user_id == user_id, CartItem.product_id == key[0], _variant_is(key[1]))
+        if plan.available[key] > 0:
+            await db.execute(update(CartItem).where(*line).values(quantity=plan.available[key]))
+        else:
+            await db.execute(delete(CartItem).where(*line))
+        written[key] = plan.available[key]
+    return {key: written.get(key, quantity) for key, quantity in plan.quantities.items()}
+
+
+def _variant_is(variant_name: str | None):
+    return CartItem.variant_name.is_(None) if variant_name is None else CartItem.variant_name == variant_name
+
+
+@dataclass
+class GuestLine:
+    """A guest cart line shaped like CartItem, so cart_item_dict and cart_summary serve both."""
+    id: str
+    product_id: str
+    variant_name: str | None
+    quantity: int
+    unit_price: float | None
+    product: Product | None = None
+
+
+async def apply_guest_operations(db: AsyncSession, lines: list[dict], operations: list[dict]) -> list[dict]:
+    """The guest cart ``lines`` after ``operations``; reads products and stock, writes nothing."""
+    current = {(line["product_id"], line["variant_name"]): line for line in lines}
+    plan = await plan_cart_operations(
+        db, {key: (line["id"], line["quantity"]) for key, line in current.items()}, operations
+    )
+    result = [line for key, line in current.items() if key not in plan.quantities]
+    for key, quantity in plan.quantities.items():
+        if quantity == 0:
+            continue
+        line = dict(current.get(key) or {"id": gen_id(), "product_id": key[0], "variant_name": key[1]})
+        line["quantity"] = quantity
+        if key in plan.prices:
+            line["unit_price"] = plan.prices[key]
+        result.append(line)
+    if len(result) > guest_carts.max_lines:
+        raise CartError(f"Keranjang tamu maksimal {guest_carts.max_lines} produk, silakan login", 400)
+    return result
+
+
+async def guest_cart_view(db: AsyncSession, lines: list[dict]) -> dict:
+    products = {}
+    if lines:
+        ids = sorted({line["product_id"] for line in lines})
+        products = {p.id: p for p in (await db.scalars(select(Product).where(Product.id.in_(ids)))).all()}
+    items = [GuestLine(**line, product=products.get(line["product_id"])) for line in lines]
+    # lines whose product was deleted since are dropped, as the CartItem foreign key cascade does
+    items = sorted((i for i in items if i.product), key=lambda i: (i.product.name, i.variant_name or "", i.id))
+    return {"items": [cart_item_dict(i) for i in items], "summary": cart_summary(items)}
+
+
+async def merge_guest_cart(request: Request, db: AsyncSession, user_id: str, response: Response):
+    """Fold the requester's guest cart into ``user_id``'s cart and drop it; called on login and register.
+
+    Quantities add up with what the account already holds, capped at the
+    stock available; products deleted meanwhile are skipped. If the store
+    is unreachable the cookie is kept so the next login tries again.
+    """
+    cart_id = guest_carts.cart_id(request)
+    if not cart_id:
+        return
+    try:
+        lines = await guest_carts.load(cart_id)
+        if lines:
+            await apply_cart_operations(db, user_id, [
+                {"op": "add", "product_id": line["product_id"], "variant_name": line["variant_name"], "quantity": line["quantity"]}
+                for line in lines
+            ], lenient=True)
+            await db.commit()
+            guest_carts.merges += 1
+            guest_carts.merged_lines += len(lines)
+        await guest_carts.discard(cart_id)
+    except GuestCartStoreError as e:
+        print(f"[Cart] Guest cart merge failed: {e}")
+        return
+    guest_carts.clear_cookie(response)
+
+
+def _find_line(view: dict, product_slug: str, variant_name: str | None) -> dict | None:
+    return next((i for i in view["items"] if i["product_slug"] == product_slug and (i["variant_name"] or None) == variant_name), None)
+
+
+async def _apply(request: Request, db: AsyncSession, user, operations: list[dict]) -> tuple[dict, str | None]:
+    """Apply ``operations`` to the user's cart, or to the guest cart when nobody is logged in.
+
+    Returns the updated cart view and, for a guest, the cart id to (re)set
+    the cookie with. Raises CartError or GuestCartStoreError.
+    """
+    if user:
+        try:
+            await apply_cart_operations(db, user.id, operations)
+        except CartError:
+            await db.rollback()
+            raise
+        await db.commit()
+        return await cart_view(db, user.id), None
+    cart_id = guest_carts.cart_id(request) or guest_carts.new_id()
+    lines = await apply_guest_operations(db, await guest_carts.load(cart_id), operations)
+    await guest_carts.save(cart_id, lines)
+    return await guest_cart_view(db, lines), cart_id
+
+
+def _respond(content: dict, guest_cart_id: str | None):
+    if guest_cart_id is None:
+        return content
+    response = JSONResponse(content)
+    # refreshed on every write, like the stored cart's TTL
+    guest_carts.set_cookie(response, guest_cart_id)
+    return response
+
+
+def _store_unavailable(e: GuestCartStoreError) -> JSONResponse:
+    print(f"[Cart] Guest cart store error: {e}")
+    return JSONResponse({"error": "Keranjang sedang tidak tersedia, coba lagi"}, status_code=503)
+
+
 @router.get("/cart")
-async def get_cart(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
-    if not user:
-        return JSONResponse({"error": "Login terlebih dahulu"}, status_code=401)
-    items = db.query(CartItem).filter(CartItem.user_id == user.id).all()
-    return {"items": [cart_item_dict(i) for i in items]}
+async def get_cart(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
+    if user:
+        return await cart_view(db, user.id)
+    cart_id = guest_carts.cart_id(request)
+    try:
+        lines = await guest_carts.load(cart_id) if cart_id else []
+    except GuestCartStoreError as e:
+        return _store_unavailable(e)
+    return await guest_cart_view(db, lines)
 
 
 @router.post("/cart")
-async def add_to_cart(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
-    if not user:
-        return JSONResponse({"error": "Login terlebih dahulu"}, status_code=401)
+async def add_to_cart(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     body = await request.json()
-    product_slug = body.get("product_slug", "")
-    variant_name = body.get("variant_name")
-    quantity = body.get("quantity", 1)
-    product = db.query(Product).filter(Product.slug == product_slug).first()
-    if not product:
-        return JSONResponse({"error": "Produk tidak ditemukan"}, status_code=404)
-
-    unit_price = product.price
-    if variant_name:
-        variant = db.query(ProductVariant).filter(
-            ProductVariant.product_id == product.id,
-            ProductVariant.variant_name == variant_name
-        ).first()
-        if variant and variant.price is not None:
-            unit_price = variant.price
-        elif variant and variant.price_modifier:
-            unit_price = product.price + variant.price_modifier
-
-    existing = db.query(CartItem).filter(
-        CartItem.user_id == user.id,
-        CartItem.product_id == product.id,
-        CartItem.variant_name == variant_name,
-    ).first()
-    if existing:
-        existing.quantity += quantity
-        existing.unit_price = unit_price
-        db.commit()
-        db.refresh(existing)
-        return {"item": cart_item_dict(existing)}
-    item = CartItem(id=gen_id(), user_id=user.id, product_id=product.id, variant_name=variant_name, unit_price=unit_price, quantity=quantity)
-    db.add(item)
-    db.commit()
-    db.refresh(item)
-    return {"item": cart_item_dict(item)}
+    op = {"op": "add", "product_slug": body.get("product_slug", ""), "variant_name": body.get("variant_name"), "quantity": body.get("quantity", 1)}
+    try:
+        view, guest_cart_id = await _apply(request, db, user, [op])
+    except CartError as e:
+        return JSONResponse({"error": e.message}, status_code=e.status_code)
+    except GuestCartStoreError as e:
+        return _store_unavailable(e)
+    return _respond({"item": _find_line(view, op["product_slug"], op["variant_name"] or None), "summary": view["summary"]}, guest_cart_id)
 
 
 @router.put("/cart")
-async def update_cart(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
-    if not user:
-        return JSONResponse({"error": "Login terlebih dahulu"}, status_code=401)
+async def update_cart(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     body = await request.json()
     item_id = body.get("item_id", "")
-    quantity = body.get("quantity", 0)
-    item = db.query(CartItem).filter(CartItem.id == item_id, CartItem.user_id == user.id).first()
-    if not item:
-        return JSONResponse({"error": "Item tidak ditemukan"}, status_code=404)
-    if quantity <= 0:
-        db.delete(item)
-        db.commit()
-        return {"success": True}
-    item.quantity = quantity
-    db.commit()
-    db.refresh(item)
-    return {"item": cart_item_dict(item)}
+    try:
+        view, guest_cart_id = await _apply(request, db, user, [{"op": "set", "item_id": item_id, "quantity": body.get("quantity", 0)}])
+    except CartError as e:
+        return JSONResponse({"error": e.message}, status_code=e.status_code)
+    except GuestCartStoreError as e:
+        return _store_unavailable(e)
+    item = next((i for i in view["items"] if i["id"] == item_id), None)
+    if item is None:
+        return _respond({"success": True, "summary": view["summary"]}, guest_cart_id)
+    return _respond({"item": item, "summary": view["summary"]}, guest_cart_id)
+
+
+@router.post("/cart/batch")
+async def batch_cart(request: Request, db: AsyncSession = Depends(get_db)):
+    """Apply ``{"operations": [{"op": "add"|"set"|"remove", ...}, ...]}`` atomically; returns the updated cart."""
+    user = await get_current_user(request, db)
+    body = await request.json()
+    operations = body.get("operations") if isinstance(body, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return JSONResponse({"error": "Operasi keranjang tidak valid"}, status_code=400)
+    if len(operations) > CART_BATCH_MAX:
+        return JSONResponse({"error": f"Maksimal {CART_BATCH_MAX} operasi per permintaan"}, status_code=400)
+    try:
+        view, guest_cart_id = await _apply(request, db, user, operations)
+    except CartError as e:
+        # nothing is written until every operation has been validated
+        return JSONResponse({"error": e.message, "index": e.index}, status_code=e.status_code)
+    except GuestCartStoreError as e:
+        return _store_unavailable(e)
+    return _respond(view, guest_cart_id)
 
 
 @router.delete("/cart")
-async def clear_cart(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def clear_cart(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user:
-        return JSONResponse({"error": "Login terlebih dahulu"}, status_code=401)
-    db.query(CartItem).filter(CartItem.user_id == user.id).delete()
-    db.commit()
+        cart_id = guest_carts.cart_id(request)
+        response = JSONResponse({"success": True})
+        if cart_id:
+            try:
+                await guest_carts.discard(cart_id)
+            except GuestCartStoreError as e:
+                return _store_unavailable(e)
+            guest_carts.clear_cookie(response)
+        return response
+    await db.execute(delete(CartItem).where(CartItem.user_id == user.id))
+    await db.commit()
     return {"success": True}
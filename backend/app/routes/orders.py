@@ -1,13 +1,27 @@
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select, delete, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from app.database import get_db
 from app.models import Order, OrderItem, CartItem, Product, gen_id
 from app.routes.auth import get_current_user
-from datetime import datetime
+from app.cache import catalog_cache, TTLCache
+from app.inventory import stock_reservations, OutOfStock
+from app.order_events import order_status_changed, SOLD_COUNTS_CHANGED
+from app.order_pipeline import order_pipeline, PENDING, SKIPPED
+from app.payment_sessions import payment_sessions
+from app.pagination import clamp_limit, encode_cursor, decode_cursor
+from app.config import ORDER_SUMMARY_TTL
+from datetime import datetime, timedelta
 
 router = APIRouter(prefix="/api")
 
+DEFAULT_ORDER_PAGE_SIZE = 50
+
+# dashboard aggregates per (scope, filters); a few seconds stale is fine for counts
+order_summary_cache = TTLCache(1024, ORDER_SUMMARY_TTL)
+
 
 def order_to_dict(order: Order) -> dict:
     return {
@@ -23,6 +37,7 @@ def order_to_dict(order: Order) -> dict:
         "courier_service_name": order.courier_service_name,
         "shipping_cost": order.shipping_cost or 0,
         "shipping_etd": order.shipping_etd,
+        "shipping_validation": order.shipping_validation,
         "biteship_order_id": order.biteship_order_id,
         "waybill_id": order.waybill_id,
         "tracking_status": order.tracking_status,
@@ -46,21 +61,128 @@ def order_to_dict(order: Order) -> dict:
     }
 
 
+def order_header_dict(order: Order, item_count: int = 0, units: int = 0) -> dict:
+    return {
+        "id": order.id,
+        "user_id": order.user_id,
+        "total": order.total,
+        "status": order.status,
+        "courier_company": order.courier_company,
+        "courier_service_name": order.courier_service_name,
+        "shipping_cost": order.shipping_cost or 0,
+        "waybill_id": order.waybill_id,
+        "tracking_status": order.tracking_status,
+        "destination_contact_name": order.destination_contact_name,
+        "created_at": order.created_at.isoformat() if order.created_at else None,
+        "item_count": item_count,
+        "units": units,
+    }
+
+
+def _parse_date(value: str, end: bool = False) -> datetime | None:
+    """YYYY-MM-DD or an ISO timestamp; a bare end date covers that whole day."""
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def order_filters(user, status, date_from, date_to, courier, tracking_status) -> list:
+    criteria = []
+    if user.role != "seller":
+        criteria.append(Order.user_id == user.id)
+    if status:
+        criteria.append(Order.status.in_(status.split(",")))
+    if date_from:
+        criteria.append(Order.created_at >= _parse_date(date_from))
+    if date_to:
+        criteria.append(Order.created_at < _parse_date(date_to, end=True))
+    if courier:
+        criteria.append(Order.courier_company == courier)
+    if tracking_status:
+        criteria.append(Order.tracking_status == tracking_status)
+    return criteria
+
+
+async def _order_summary(db: AsyncSession, criteria: list, cache_key: tuple) -> dict:
+    summary = order_summary_cache.get(cache_key)
+    if summary is None:
+        rows = (await db.execute(
+            select(Order.status, func.count(), func.coalesce(func.sum(Order.total), 0))
+            .where(*criteria).group_by(Order.status)
+        )).all()
+        summary = {
+            "total_orders": sum(count for _, count, _ in rows),
+            "total_amount": float(sum(amount for _, _, amount in rows)),
+            "by_status": {status or "unknown": count for status, count, _ in rows},
+            "amount_by_status": {status or "unknown": float(amount) for status, _, amount in rows},
+        }
+        order_summary_cache.set(cache_key, summary)
+    return summary
+
+
 @router.get("/orders")
-async def list_orders(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def list_orders(
+    request: Request,
+    status: str = None, date_from: str = None, date_to: str = None,
+    courier: str = None, tracking_status: str = None,
+    limit: int = None, cursor: str = None, summary: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    user = await get_current_user(request, db)
     if not user:
         return JSONResponse({"error": "Login terlebih dahulu"}, status_code=401)
-    if user.role == "seller":
-        orders = db.query(Order).order_by(Order.created_at.desc()).all()
-    else:
-        orders = db.query(Order).filter(Order.user_id == user.id).order_by(Order.created_at.desc()).all()
-    return {"orders": [order_to_dict(o) for o in orders]}
+    try:
+        criteria = order_filters(user, status, date_from, date_to, courier, tracking_status)
+    except ValueError:
+        return JSONResponse({"error": "Tanggal tidak valid, gunakan format YYYY-MM-DD"}, status_code=400)
+
+    # Always one page, newest first; next_cursor continues it.
+    limit = clamp_limit(limit, DEFAULT_ORDER_PAGE_SIZE)
+    query = select(Order).where(*criteria)
+    if cursor:
+        position = decode_cursor(cursor, (str,))
+        try:
+            position = (datetime.fromisoformat(position[0]), position[1]) if position else None
+        except ValueError:
+            position = None
+        if position is None:
+            return JSONResponse({"error": "Cursor tidak valid"}, status_code=400)
+        query = query.where(tuple_(Order.created_at, Order.id) < tuple_(*position))
+    if not summary:
+        query = query.options(selectinload(Order.items))
+    # one row past the page tells us whether another page exists
+    orders = (await db.scalars(query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit + 1))).all()
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1].created_at.isoformat(), orders[-1].id)
+
+    if not summary:
+        return {"orders": [order_to_dict(o) for o in orders], "next_cursor": next_cursor}
+
+    counts = {}
+    if orders:
+        counts = {
+            order_id: (item_count, units)
+            for order_id, item_count, units in (await db.execute(
+                select(OrderItem.order_id, func.count(), func.coalesce(func.sum(OrderItem.quantity), 0))
+                .where(OrderItem.order_id.in_([o.id for o in orders]))
+                .group_by(OrderItem.order_id)
+            )).all()
+        }
+    scope = user.id if user.role != "seller" else "seller"
+    summary_key = (scope, status, date_from, date_to, courier, tracking_status)
+    return {
+        "orders": [order_header_dict(o, *counts.get(o.id, (0, 0))) for o in orders],
+        "next_cursor": next_cursor,
+        "summary": await _order_summary(db, criteria, summary_key),
+    }
 
 
 @router.post("/orders")
-async def create_order(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def create_order(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user:
         return JSONResponse({"error": "Login terlebih dahulu"}, status_code=401)
     body = await request.json()
@@ -75,7 +197,9 @@ async def create_order(request: Request, db: Session = Depends(get_db)):
     shipping_cost = body.get("shipping_cost", 0)
     shipping_etd = body.get("shipping_etd", "")
 
-    cart_items = db.query(CartItem).filter(CartItem.user_id == user.id).all()
+    cart_items = (await db.scalars(
+        select(CartItem).options(selectinload(CartItem.product)).where(CartItem.user_id == user.id)
+    )).all()
     if not cart_items:
         return JSONResponse({"error": "Keranjang kosong"}, status_code=400)
 
@@ -96,45 +220,10 @@ async def create_order(request: Request, db: Session = Depends(get_db)):
             "weight": product.weight or 500,
         })
 
-    validated_shipping_cost = 0.0
-    if destination_area_id and courier_company and courier_type:
-        from app.config import BITESHIP_API_KEY
-        if BITESHIP_API_KEY:
-            import httpx
-            rate_items = [{"name": d["product_name"][:50], "value": int(d["price"]), "weight": d["weight"], "quantity": d["quantity"]} for d in order_items_data]
-            try:
-                rate_payload = {"couriers": courier_company, "destination_area_id": destination_area_id, "items": rate_items}
-                from app.routes.shipping import get_seller_origin
-                origin = get_seller_origin()
-                if origin.get("area_id"):
-                    rate_payload["origin_area_id"] = origin["area_id"]
-                if origin.get("postal_code"):
-                    rate_payload["origin_postal_code"] = int(origin["postal_code"])
-                async with httpx.AsyncClient(timeout=10) as client:
-                    resp = await client.post("https://api.biteship.com/v1/rates/couriers", json=rate_payload, headers={"Authorization": f"Bearer {BITESHIP_API_KEY}", "Content-Type": "application/json"})
-                if resp.status_code == 200:
-                    pricing = resp.json().get("pricing", [])
-                    for p in pricing:
-                        nested_rates = p.get("rates")
-                        if nested_rates and isinstance(nested_rates, list):
-                            for rate in nested_rates:
-                                if rate.get("type") == courier_type:
-                                    validated_shipping_cost = float(rate.get("price", 0))
-                                    break
-                        else:
-                            if p.get("type", p.get("courier_service_code", "")) == courier_type and p.get("price") is not None:
-                                validated_shipping_cost = float(p.get("price", 0))
-                                break
-                if validated_shipping_cost == 0:
-                    validated_shipping_cost = float(shipping_cost)
-            except Exception:
-                validated_shipping_cost = float(shipping_cost)
-        else:
-            validated_shipping_cost = float(shipping_cost)
-    else:
-        validated_shipping_cost = float(shipping_cost)
-
-    total = items_total + validated_shipping_cost
+    # shipping is charged as submitted for now; order_pipeline re-quotes it in the background
+    shipping_cost = float(shipping_cost or 0)
+    needs_validation = order_pipeline.needs_validation(destination_area_id, courier_company, courier_type)
+    total = items_total + shipping_cost
 
     order = Order(
         id=gen_id(), user_id=user.id, total=total,
@@ -146,32 +235,70 @@ async def create_order(request: Request, db: Session = Depends(get_db)):
         courier_company=courier_company,
         courier_type=courier_type,
         courier_service_name=courier_service_name,
-        shipping_cost=validated_shipping_cost,
+        shipping_cost=shipping_cost,
         shipping_etd=shipping_etd,
+        shipping_validation=PENDING if needs_validation else SKIPPED,
         created_at=datetime.utcnow(), updated_at=datetime.utcnow(),
     )
+    order.items = [OrderItem(id=gen_id(), order_id=order.id, **oi_data) for oi_data in order_items_data]
     db.add(order)
-    for oi_data in order_items_data:
-        db.add(OrderItem(id=gen_id(), order_id=order.id, **oi_data))
-    db.query(CartItem).filter(CartItem.user_id == user.id).delete()
-    db.commit()
-    db.refresh(order)
+    await db.flush()
+    try:
+        await stock_reservations.reserve(db, order.id, [
+            (oi["product_id"], oi["variant_name"], oi["quantity"]) for oi in order_items_data
+        ])
+    except OutOfStock as e:
+        await db.rollback()
+        name = next((oi["product_name"] for oi in order_items_data if oi["product_id"] == e.product_id), "")
+        return JSONResponse({"error": f"Stok {name} tidak mencukupi" if name else "Stok tidak mencukupi"}, status_code=409)
+    await db.execute(delete(CartItem).where(CartItem.user_id == user.id))
+    await db.commit()
+    # holding stock only changes these products' payloads, not which products a listing shows
+    catalog_cache.invalidate({oi["product_id"] for oi in order_items_data})
+    if needs_validation:
+        order_pipeline.submit(order.id)
+    payment_sessions.prewarm(order.id)
     return {"order": order_to_dict(order)}
 
 
+@router.get("/orders/{order_id}/status")
+async def get_order_status(order_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
+    if not user:
+        return JSONResponse({"error": "Login terlebih dahulu"}, status_code=401)
+    order = await db.scalar(select(Order).where(Order.id == order_id))
+    if not order or (user.role != "seller" and order.user_id != user.id):
+        return JSONResponse({"error": "Pesanan tidak ditemukan"}, status_code=404)
+    return {
+        "order_id": order.id,
+        "status": order.status,
+        "shipping_validation": order.shipping_validation,
+        "shipping_cost": order.shipping_cost or 0,
+        "total": order.total,
+    }
+
+
 @router.put("/orders")
-async def update_order_status(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def update_order_status(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user or user.role != "seller":
         return JSONResponse({"error": "Akses ditolak"}, status_code=403)
     body = await request.json()
     order_id = body.get("order_id", "")
     status = body.get("status", "")
-    order = db.query(Order).filter(Order.id == order_id).first()
+    order = await db.scalar(select(Order).options(selectinload(Order.items)).where(Order.id == order_id))
     if not order:
         return JSONResponse({"error": "Pesanan tidak ditemukan"}, status_code=404)
     order.status = status
     order.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(order)
+    try:
+        changed = await order_status_changed(db, order)
+    except OutOfStock:
+        await db.rollback()
+        return JSONResponse({"error": "Stok pesanan ini sudah habis, pesanan tidak dapat diaktifkan kembali"}, status_code=409)
+    await db.commit()
+    if changed & SOLD_COUNTS_CHANGED:
+        catalog_cache.invalidate()
+    elif changed:
+        catalog_cache.invalidate({item.product_id for item in order.items if item.product_id})
     return {"order": order_to_dict(order)}
@@ -1,9 +1,17 @@
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select, delete, func, literal_column, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from app.database import get_db
 from app.models import Product, ProductImage, ProductVariant, gen_id
 from app.routes.auth import get_current_user
+from app.cache import catalog_cache
+from app.search import MAX_RESULTS, search_index
+from app.pagination import clamp_limit, encode_cursor, decode_cursor
+from app.images import renditions_json
+from app.blobs import blob_store
+import asyncio
 import json
 import os
 import re
@@ -12,6 +20,14 @@ import string
 
 router = APIRouter(prefix="/api")
 
+# sort key -> column expression; NULLs are folded to 0 so keyset comparisons stay total.
+# The 0 is rendered inline so the statement matches the expression indexes on Product.
+PRODUCT_SORTS = {
+    "price": func.coalesce(Product.price, literal_column("0")),
+    "sold_count": func.coalesce(Product.sold_count, literal_column("0")),
+    "rating": func.coalesce(Product.rating, literal_column("0")),
+}
+
 SELLER_CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "seller_config.json")
 
 
@@ -22,6 +38,10 @@ def load_seller_config():
     return {"username": "seller", "seller_name": "Store", "profile_picture": "", "brand_colors": {}}
 
 
+def _renditions(stored: str | None) -> dict | None:
+    return json.loads(stored) if stored else None
+
+
 def product_to_dict(product: Product) -> dict:
     return {
         "id": product.id,
@@ -39,8 +59,12 @@ def product_to_dict(product: Product) -> dict:
         "width": product.width or 10,
         "height": product.height or 10,
         "primary_image": product.primary_image,
+        "primary_image_renditions": _renditions(product.primary_image_renditions),
         "video_url": product.video_url,
-        "images": [{"id": img.id, "image_url": img.image_url, "display_order": img.display_order} for img in product.images],
+        "images": [
+            {"id": img.id, "image_url": img.image_url, "display_order": img.display_order, "renditions": _renditions(img.renditions)}
+            for img in product.images
+        ],
         "variants": [
             {
                 "id": v.id,
@@ -56,6 +80,14 @@ def product_to_dict(product: Product) -> dict:
     }
 
 
+def _product_query():
+    return select(Product).options(selectinload(Product.images), selectinload(Product.variants))
+
+
+async def _load_product(db: AsyncSession, *criteria) -> Product | None:
+    return await db.scalar(_product_query().where(*criteria))
+
+
 def generate_slug(name: str) -> str:
     base = re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
     suffix = "".join(random.choices(string.ascii_lowercase + string.digits, k=6))
@@ -63,28 +95,106 @@ def generate_slug(name: str) -> str:
 
 
 @router.get("/products")
-async def list_products(category: str = None, search: str = None, db: Session = Depends(get_db)):
-    query = db.query(Product)
+async def list_products(
+    category: str = None, search: str = None,
+    sort: str = None, order: str = "desc", limit: int = None, cursor: str = None,
+    db: AsyncSession = Depends(get_db),
+):
+    # Always one page: DEFAULT_PAGE_SIZE products unless ``limit`` asks for more (up to MAX_PAGE_SIZE).
+    sort = sort or ("relevance" if search else "sold_count")
+    if sort not in PRODUCT_SORTS and not (sort == "relevance" and search):
+        return JSONResponse({"error": f"Urutan tidak valid, gunakan: {', '.join(PRODUCT_SORTS)}"}, status_code=400)
+    if order not in ("asc", "desc"):
+        return JSONResponse({"error": "Arah urutan harus asc atau desc"}, status_code=400)
+    limit = clamp_limit(limit)
+    position = None
+    if cursor:
+        position = decode_cursor(cursor)
+        if position is None:
+            return JSONResponse({"error": "Cursor tidak valid"}, status_code=400)
+
+    cache_key = ("products", category, search, sort, order, limit, cursor)
+    page = catalog_cache.get(cache_key)
+    if page is None:
+        version = catalog_cache.version
+        # Only the relevance ranking is capped; other sorts order and page the full match set.
+        matches = await search_index.search(db, search, MAX_RESULTS if sort == "relevance" else None) if search else None
+        if sort == "relevance":
+            page = await _query_ranked(db, category, matches, limit, int(position[0]) if position else 0)
+        else:
+            page = await _query_products(db, category, matches, sort, order, limit, position)
+        catalog_cache.set(cache_key, page, version, [p["id"] for p in page["products"]])
+    return {**page, "seller": load_seller_config()}
+
+
+def _filtered_products(category: str | None, matches: list[str] | None):
+    query = _product_query()
     if category:
-        query = query.filter(Product.category == category)
-    if search:
-        query = query.filter(Product.name.ilike(f"%{search}%"))
-    products = query.all()
-    seller = load_seller_config()
-    return {"products": [product_to_dict(p) for p in products], "seller": seller}
+        query = query.where(Product.category == category)
+    if matches is not None:
+        query = query.where(Product.id.in_(matches))
+    return query
+
+
+def products_page_query(category, matches, sort: str, order: str, limit: int, position: tuple | None):
+    """One keyset page of the listing, plus one row that tells whether another page exists."""
+    query = _filtered_products(category, matches)
+    sort_col = PRODUCT_SORTS[sort]
+    descending = order == "desc"
+    if position:
+        key = tuple_(sort_col, Product.id)
+        query = query.where(key < tuple_(*position) if descending else key > tuple_(*position))
+    if descending:
+        query = query.order_by(sort_col.desc(), Product.id.desc())
+    else:
+        query = query.order_by(sort_col.asc(), Product.id.asc())
+    return query.limit(limit + 1)
+
+
+async def _query_products(db: AsyncSession, category, matches, sort: str, order: str, limit: int, position: tuple | None) -> dict:
+    products = (await db.scalars(products_page_query(category, matches, sort, order, limit, position))).all()
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        last = products[-1]
+        next_cursor = encode_cursor(getattr(last, sort) or 0, last.id)
+    return {"products": [product_to_dict(p) for p in products], "next_cursor": next_cursor}
+
+
+async def _query_ranked(db: AsyncSession, category, matches: list[str], limit: int, offset: int) -> dict:
+    """Search results in relevance order; the cursor is an offset into the ranked ids."""
+    ids = matches
+    if category and ids:
+        in_category = set((await db.scalars(
+            select(Product.id).where(Product.id.in_(ids), Product.category == category)
+        )).all())
+        ids = [pid for pid in ids if pid in in_category]
+    end = offset + limit
+    page_ids = ids[offset:end]
+    products = (await db.scalars(_filtered_products(None, page_ids))).all() if page_ids else []
+    rank = {pid: i for i, pid in enumerate(page_ids)}
+    products = sorted(products, key=lambda p: rank[p.id])
+    next_cursor = encode_cursor(end, page_ids[-1]) if end < len(ids) else None
+    return {"products": [product_to_dict(p) for p in products], "next_cursor": next_cursor}
 
 
 @router.get("/products/{slug}")
-async def get_product(slug: str, db: Session = Depends(get_db)):
-    product = db.query(Product).filter(Product.slug == slug).first()
-    if not product:
-        return JSONResponse({"error": "Produk tidak ditemukan"}, status_code=404)
-    return {"product": product_to_dict(product)}
+async def get_product(slug: str, db: AsyncSession = Depends(get_db)):
+    cache_key = ("product", slug)
+    payload = catalog_cache.get(cache_key)
+    if payload is None:
+        version = catalog_cache.version
+        product = await _load_product(db, Product.slug == slug)
+        if not product:
+            return JSONResponse({"error": "Produk tidak ditemukan"}, status_code=404)
+        payload = product_to_dict(product)
+        catalog_cache.set(cache_key, payload, version, [payload["id"]])
+    return {"product": payload}
 
 
 @router.post("/products")
-async def create_product(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def create_product(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user or user.role != "seller":
         return JSONResponse({"error": "Akses ditolak"}, status_code=403)
     body = await request.json()
@@ -107,9 +217,17 @@ async def create_product(request: Request, db: Session = Depends(get_db)):
         primary_image=body.get("primary_image"),
         video_url=body.get("video_url"),
     )
+    images = [
+        (img.get("image_url", "") if isinstance(img, dict) else img, img.get("display_order", 0) if isinstance(img, dict) else 0)
+        for img in body.get("images", [])
+    ]
+    # renditions were written at upload time; this only looks them up (off the event loop, it touches disk)
+    renditions = await asyncio.to_thread(lambda: {url: renditions_json(url) for url in {product.primary_image, *(u for u, _ in images)}})
+    product.primary_image_renditions = renditions[product.primary_image]
     db.add(product)
-    for img in body.get("images", []):
-        db.add(ProductImage(id=gen_id(), product_id=product.id, image_url=img.get("image_url", img if isinstance(img, str) else ""), display_order=img.get("display_order", 0) if isinstance(img, dict) else 0))
+    for image_url, display_order in images:
+        db.add(ProductImage(id=gen_id(), product_id=product.id, image_url=image_url, display_order=display_order, renditions=renditions[image_url]))
+    await blob_store.retain(db, [product.primary_image, *(u for u, _ in images)])
     for v in body.get("variants", []):
         db.add(ProductVariant(
             id=gen_id(), product_id=product.id,
@@ -117,26 +235,33 @@ async def create_product(request: Request, db: Session = Depends(get_db)):
             price=v.get("price"), price_modifier=v.get("price_modifier", 0),
             stock=v.get("stock", 0), is_available=v.get("is_available", True),
         ))
-    db.commit()
-    db.refresh(product)
+    await db.commit()
+    catalog_cache.invalidate()
+    product = await _load_product(db, Product.id == product.id)
+    search_index.index_product(product)
     return {"product": product_to_dict(product)}
 
 
 @router.put("/products/{slug}")
-async def update_product(slug: str, request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def update_product(slug: str, request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user or user.role != "seller":
         return JSONResponse({"error": "Akses ditolak"}, status_code=403)
-    product = db.query(Product).filter(Product.slug == slug).first()
+    product = await db.scalar(select(Product).where(Product.slug == slug))
     if not product:
         return JSONResponse({"error": "Produk tidak ditemukan"}, status_code=404)
     body = await request.json()
+    previous_primary_image = product.primary_image
     for field in ["name", "price", "original_price", "category", "description", "stock", "rating", "weight", "length", "width", "height", "primary_image", "video_url", "sold_count"]:
         if field in body:
             setattr(product, field, body[field])
+    if "primary_image" in body and body["primary_image"] != previous_primary_image:
+        product.primary_image_renditions = await asyncio.to_thread(renditions_json, product.primary_image)
+        await blob_store.release(db, [previous_primary_image])
+        await blob_store.retain(db, [product.primary_image])
 
     if "variants" in body:
-        db.query(ProductVariant).filter(ProductVariant.product_id == product.id).delete()
+        await db.execute(delete(ProductVariant).where(ProductVariant.product_id == product.id))
         for v in body["variants"]:
             db.add(ProductVariant(
                 id=gen_id(), product_id=product.id,
@@ -148,26 +273,37 @@ async def update_product(slug: str, request: Request, db: Session = Depends(get_
                 is_available=v.get("is_available", True),
             ))
 
-    db.commit()
-    db.refresh(product)
+    await db.commit()
+    catalog_cache.invalidate()
+    product = await _load_product(db, Product.id == product.id)
+    search_index.index_product(product)
     return {"product": product_to_dict(product)}
 
 
 @router.get("/categories")
-async def list_categories(db: Session = Depends(get_db)):
-    products = db.query(Product.category).distinct().all()
-    categories = sorted([p[0] for p in products if p[0]])
+async def list_categories(db: AsyncSession = Depends(get_db)):
+    categories = catalog_cache.get(("categories",))
+    if categories is None:
+        version = catalog_cache.version
+        rows = (await db.scalars(select(Product.category).distinct())).all()
+        categories = sorted([c for c in rows if c])
+        # names only: stock and sales never change them
+        catalog_cache.set(("categories",), categories, version, ())
     return {"categories": categories}
 
 
 @router.delete("/products/{slug}")
-async def delete_product(slug: str, request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def delete_product(slug: str, request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user or user.role != "seller":
         return JSONResponse({"error": "Akses ditolak"}, status_code=403)
-    product = db.query(Product).filter(Product.slug == slug).first()
+    product = await db.scalar(select(Product).where(Product.slug == slug))
     if not product:
         return JSONResponse({"error": "Produk tidak ditemukan"}, status_code=404)
-    db.delete(product)
-    db.commit()
+    image_urls = (await db.scalars(select(ProductImage.image_url).where(ProductImage.product_id == product.id))).all()
+    await blob_store.release(db, [product.primary_image, *image_urls])
+    await db.delete(product)
+    await db.commit()
+    catalog_cache.invalidate()
+    search_index.remove(product.id)
     return {"success": True}
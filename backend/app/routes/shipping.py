@@ -1,26 +1,28 @@
 from fastapi import APIRouter, Depends, Request
-from fastapi.responses import JSONResponse, HTMLResponse
-from sqlalchemy.orm import Session
-from app.database import get_db
+from fastapi.responses import JSONResponse, HTMLResponse, Response, StreamingResponse
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from app.database import get_db, AsyncSessionLocal
 from app.models import Order, OrderItem, User, gen_id
 from app.routes.auth import get_current_user
-from app.config import BITESHIP_API_KEY
-import httpx
+from app.config import (
+    BITESHIP_API_KEY, BITESHIP_WEBHOOK_TOKEN, BULK_SHIPMENT_CONCURRENCY, BULK_SHIPMENT_MAX_ORDERS, LABEL_BATCH_MAX,
+)
+from app.http_clients import biteship
+from app.area_index import area_index
+from app.cache import catalog_cache
+from app.tracking import shipment_tracker, tracking_detail
+from app.labels import label_renderer
+from app.routes.orders import order_filters
+from app.shipping_rates import rate_quoter, RateQuoteError, DEFAULT_COURIERS
 from datetime import datetime
+import asyncio
+import hmac
 import json
 
 router = APIRouter(prefix="/api/shipping")
 
-BITESHIP_BASE = "https://api.biteship.com"
-DEFAULT_COURIERS = "jne,sicepat,jnt,anteraja,tiki,ninja,idexpress,pos"
-
-
-def biteship_headers():
-    return {
-        "Authorization": f"Bearer {BITESHIP_API_KEY}",
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-    }
 
 
 @router.get("/status")
@@ -29,20 +31,23 @@ async def shipping_status():
 
 
 @router.get("/areas")
-async def search_areas(input: str = "", request: Request = None, db: Session = Depends(get_db)):
-    if not BITESHIP_API_KEY:
-        return {"areas": []}
+async def search_areas(input: str = "", request: Request = None, db: AsyncSession = Depends(get_db)):
     if len(input) < 3:
         return {"areas": []}
-    async with httpx.AsyncClient(timeout=10) as client:
-        resp = await client.get(
-            f"{BITESHIP_BASE}/v1/maps/areas",
-            params={"countries": "ID", "input": input, "type": "single"},
-            headers=biteship_headers(),
-        )
+    areas = area_index.lookup(input)
+    if areas is not None:
+        return {"areas": areas}
+    if not BITESHIP_API_KEY:
+        return {"areas": []}
+    resp = await biteship.get(
+        "/v1/maps/areas",
+        params={"countries": "ID", "input": input, "type": "single"},
+        timeout=10,
+    )
     if resp.status_code == 200:
-        data = resp.json()
-        return {"areas": data.get("areas", [])}
+        areas = resp.json().get("areas", [])
+        await area_index.learn(input, areas)
+        return {"areas": areas}
     return {"areas": []}
 
 
@@ -71,8 +76,16 @@ def get_seller_origin() -> dict:
     return {"area_id": "", "postal_code": ""}
 
 
+def resolve_origin(area_id: str = "", postal_code: str = "") -> tuple[str, str]:
+    origin = get_seller_origin()
+    return (
+        area_id or origin.get("area_id", "") or FALLBACK_ORIGIN_AREA_ID,
+        postal_code or origin.get("postal_code", "") or FALLBACK_ORIGIN_POSTAL_CODE,
+    )
+
+
 @router.post("/rates")
-async def get_rates(request: Request, db: Session = Depends(get_db)):
+async def get_rates(request: Request, db: AsyncSession = Depends(get_db)):
     if not BITESHIP_API_KEY:
         return JSONResponse({"error": "Biteship belum dikonfigurasi"}, status_code=400)
     body = await request.json()
@@ -84,136 +97,17 @@ async def get_rates(request: Request, db: Session = Depends(get_db)):
         return JSONResponse({"error": "Area tujuan diperlukan"}, status_code=400)
 
     destination_postal_code = body.get("destination_postal_code", "")
+    origin_area_id, origin_postal_code = resolve_origin(body.get("origin_area_id", ""), body.get("origin_postal_code", ""))
 
-    origin = get_seller_origin()
-    origin_area_id = body.get("origin_area_id", "") or origin.get("area_id", "") or FALLBACK_ORIGIN_AREA_ID
-    origin_postal_code = body.get("origin_postal_code", "") or origin.get("postal_code", "") or FALLBACK_ORIGIN_POSTAL_CODE
-
-    for item in items:
-        if "length" not in item:
-            item["length"] = 10
-        if "width" not in item:
-            item["width"] = 10
-        if "height" not in item:
-            item["height"] = 10
-        if "weight" not in item:
-            item["weight"] = 500
-
-    payload = {
-        "couriers": couriers,
-        "items": items,
-        "origin_area_id": origin_area_id,
-        "origin_postal_code": int(origin_postal_code),
-        "destination_area_id": destination_area_id,
-    }
-    if destination_postal_code:
-        try:
-            payload["destination_postal_code"] = int(destination_postal_code)
-        except (ValueError, TypeError):
-            pass
-
-    print(f"[Biteship rates] Requesting rates: origin={origin_area_id}, dest={destination_area_id}, items={len(items)}, couriers={couriers}")
-
-    async with httpx.AsyncClient(timeout=15) as client:
-        resp = await client.post(
-            f"{BITESHIP_BASE}/v1/rates/couriers",
-            json=payload,
-            headers=biteship_headers(),
-        )
-
-    print(f"[Biteship rates] Response status={resp.status_code}")
-
-    def _parse_pricing(pricing_data):
-        results = []
-        for p in pricing_data:
-            nested_rates = p.get("rates")
-            if nested_rates and isinstance(nested_rates, list):
-                company = p.get("company", "")
-                for rate in nested_rates:
-                    if rate.get("price") is not None and rate.get("available", True):
-                        results.append({
-                            "courier_company": company,
-                            "courier_type": rate.get("type", rate.get("courier_service_code", "")),
-                            "courier_name": rate.get("courier_name", p.get("courier_name", company)),
-                            "service_name": rate.get("courier_service_name", rate.get("service_name", rate.get("description", ""))),
-                            "description": rate.get("description", ""),
-                            "price": rate.get("price", 0),
-                            "etd": rate.get("shipment_duration_range", ""),
-                            "etd_unit": rate.get("shipment_duration_unit", "days"),
-                        })
-            else:
-                if p.get("price") is not None:
-                    results.append({
-                        "courier_company": p.get("company", p.get("courier_company", "")),
-                        "courier_type": p.get("type", p.get("courier_service_code", "")),
-                        "courier_name": p.get("courier_name", p.get("company", "")),
-                        "service_name": p.get("courier_service_name", p.get("service_name", p.get("description", ""))),
-                        "description": p.get("description", ""),
-                        "price": p.get("price", 0),
-                        "etd": p.get("shipment_duration_range", ""),
-                        "etd_unit": p.get("shipment_duration_unit", "days"),
-                    })
-        results.sort(key=lambda x: x["price"])
-        return results
-
-    results = []
-    if resp.status_code == 200:
-        data = resp.json()
-        pricing = data.get("pricing", [])
-        results = _parse_pricing(pricing)
-        if results:
-            return {"rates": results}
-
-    def _extract_postal_code(area_id_str):
-        if "IDZ" in area_id_str:
-            return area_id_str.split("IDZ")[-1]
-        return ""
-
-    if resp.status_code != 200:
-        postal_fallback = _extract_postal_code(destination_area_id)
-        if postal_fallback and postal_fallback.isdigit():
-            try:
-                fallback_payload = {
-                    "couriers": couriers,
-                    "items": items,
-                    "origin_postal_code": int(origin_postal_code),
-                    "destination_postal_code": int(postal_fallback),
-                }
-                if origin_area_id:
-                    fallback_payload["origin_area_id"] = origin_area_id
-
-                print(f"[Biteship rates] Retrying with postal_code fallback: dest_postal={postal_fallback}")
-                async with httpx.AsyncClient(timeout=15) as client:
-                    resp2 = await client.post(
-                        f"{BITESHIP_BASE}/v1/rates/couriers",
-                        json=fallback_payload,
-                        headers=biteship_headers(),
-                    )
-                if resp2.status_code == 200:
-                    data2 = resp2.json()
-                    results2 = _parse_pricing(data2.get("pricing", []))
-                    if results2:
-                        return {"rates": results2}
-            except Exception as e:
-                print(f"[Biteship rates] Postal fallback error: {e}")
-
-    if resp.status_code != 200:
-        try:
-            err = resp.json()
-            error_msg = err.get("error", "Gagal mendapatkan ongkir")
-            if isinstance(error_msg, dict):
-                error_msg = error_msg.get("message", str(error_msg))
-            print(f"[Biteship rates error] status={resp.status_code} response={err}")
-            return JSONResponse({"error": error_msg, "debug": {"status": resp.status_code, "origin_area_id": origin_area_id}}, status_code=resp.status_code)
-        except Exception:
-            print(f"[Biteship rates error] status={resp.status_code} body={resp.text[:500]}")
-            return JSONResponse({"error": "Gagal mendapatkan ongkir"}, status_code=500)
-
-    return {"rates": []}
+    try:
+        rates = await rate_quoter.quote(origin_area_id, origin_postal_code, destination_area_id, destination_postal_code, couriers, items)
+    except RateQuoteError as e:
+        return JSONResponse(e.body, status_code=e.status_code)
+    return {"rates": rates}
 
 
 @router.get("/origin")
-async def get_origin(request: Request, db: Session = Depends(get_db)):
+async def get_origin(request: Request, db: AsyncSession = Depends(get_db)):
     origin = get_seller_origin()
     return {
         "area_id": origin.get("area_id", ""),
@@ -224,8 +118,8 @@ async def get_origin(request: Request, db: Session = Depends(get_db)):
 
 
 @router.post("/origin")
-async def update_origin(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def update_origin(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user or user.role != "seller":
         return JSONResponse({"error": "Akses ditolak"}, status_code=403)
     body = await request.json()
@@ -251,24 +145,7 @@ async def update_origin(request: Request, db: Session = Depends(get_db)):
     return {"success": True, "area_id": area_id, "postal_code": postal_code}
 
 
-@router.post("/create-order/{order_id}")
-async def create_shipment(order_id: str, request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
-    if not user or user.role != "seller":
-        return JSONResponse({"error": "Akses ditolak"}, status_code=403)
-    if not BITESHIP_API_KEY:
-        return JSONResponse({"error": "Biteship belum dikonfigurasi"}, status_code=400)
-
-    order = db.query(Order).filter(Order.id == order_id).first()
-    if not order:
-        return JSONResponse({"error": "Pesanan tidak ditemukan"}, status_code=404)
-    if order.biteship_order_id:
-        return JSONResponse({"error": "Pengiriman sudah dibuat", "biteship_order_id": order.biteship_order_id}, status_code=400)
-    if order.status not in ("paid", "processing"):
-        return JSONResponse({"error": "Pesanan belum dibayar"}, status_code=400)
-
-    buyer = db.query(User).filter(User.id == order.user_id).first()
-
+def _shipment_payload(order: Order, seller, buyer: User | None) -> dict:
     items_payload = []
     for item in order.items:
         items_payload.append({
@@ -280,14 +157,14 @@ async def create_shipment(order_id: str, request: Request, db: Session = Depends
         })
 
     payload = {
-        "shipper_contact_name": user.name,
-        "shipper_contact_phone": user.phone or "088888888888",
-        "shipper_contact_email": user.email,
-        "shipper_organization": user.name,
-        "origin_contact_name": user.name,
-        "origin_contact_phone": user.phone or "088888888888",
-        "origin_address": user.address or "Alamat toko",
-        "origin_postal_code": int(user.postal_code) if user.postal_code else 10110,
+        "shipper_contact_name": seller.name,
+        "shipper_contact_phone": seller.phone or "088888888888",
+        "shipper_contact_email": seller.email,
+        "shipper_organization": seller.name,
+        "origin_contact_name": seller.name,
+        "origin_contact_phone": seller.phone or "088888888888",
+        "origin_address": seller.address or "Alamat toko",
+        "origin_postal_code": int(seller.postal_code) if seller.postal_code else 10110,
         "destination_contact_name": order.destination_contact_name or (buyer.name if buyer else "Pembeli"),
         "destination_contact_phone": order.destination_contact_phone or (buyer.phone if buyer else "088888888888"),
         "destination_address": order.shipping_address or "Alamat pembeli",
@@ -296,217 +173,287 @@ async def create_shipment(order_id: str, request: Request, db: Session = Depends
         "courier_type": order.courier_type or "reg",
         "delivery_type": "now",
         "order_note": f"Order #{order.id[:8]}",
+        "reference_id": order.id,
         "metadata": {"internal_order_id": order.id},
         "items": items_payload,
     }
 
-    if user.area_id:
-        payload["origin_area_id"] = user.area_id
+    if seller.area_id:
+        payload["origin_area_id"] = seller.area_id
     if order.destination_area_id:
         payload["destination_area_id"] = order.destination_area_id
+    return payload
+
+
+# orders with a Biteship booking request in flight; a second request for the same order is refused
+# rather than booking the courier twice (one worker process, like the rest of the in-process state)
+_booking: set[str] = set()
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.post(
-            f"{BITESHIP_BASE}/v1/orders",
-            json=payload,
-            headers=biteship_headers(),
-        )
 
-    if resp.status_code in (200, 201):
-        data = resp.json()
-        order.biteship_order_id = data.get("id", "")
-        courier_data = data.get("courier", {})
-        order.waybill_id = courier_data.get("waybill_id", "")
-        order.tracking_status = data.get("status", "confirmed")
-        order.tracking_url = courier_data.get("link", "")
-        order.status = "shipped"
-        order.updated_at = datetime.utcnow()
-        db.commit()
-        return {
-            "success": True,
-            "biteship_order_id": order.biteship_order_id,
-            "waybill_id": order.waybill_id,
-            "tracking_url": order.tracking_url,
-            "status": order.tracking_status,
-        }
+async def book_shipment(order_id: str, seller) -> tuple[int, dict]:
+    """Create the Biteship shipment for one paid order; returns (HTTP status, response body).
 
+    No database session is held while Biteship answers: the order is read
+    in one short session and the booking written in another, only if the
+    order is still paid and unbooked by then.
+    """
+    if order_id in _booking:
+        return 409, {"error": "Pengiriman sedang dibuat"}
+    _booking.add(order_id)
     try:
-        err = resp.json()
-        return JSONResponse({"error": err.get("error", "Gagal membuat pengiriman")}, status_code=resp.status_code)
-    except Exception:
-        return JSONResponse({"error": "Gagal membuat pengiriman"}, status_code=500)
+        async with AsyncSessionLocal() as db:
+            order = await db.scalar(select(Order).options(selectinload(Order.items)).where(Order.id == order_id))
+            if not order:
+                return 404, {"error": "Pesanan tidak ditemukan"}
+            if order.biteship_order_id:
+                return 400, {"error": "Pengiriman sudah dibuat", "biteship_order_id": order.biteship_order_id}
+            if order.status not in ("paid", "processing"):
+                return 400, {"error": "Pesanan belum dibayar"}
+            buyer = await db.get(User, order.user_id)
+            payload = _shipment_payload(order, seller, buyer)
+
+        resp = await biteship.post("/v1/orders", json=payload, timeout=30)
+
+        if resp.status_code in (200, 201):
+            data = resp.json()
+            courier_data = data.get("courier", {})
+            # applied to the detached copy first so schedule() sees the new tracking state
+            order.biteship_order_id = data.get("id", "")
+            order.waybill_id = courier_data.get("waybill_id", "")
+            order.tracking_status = data.get("status", "confirmed")
+            order.tracking_url = courier_data.get("link", "")
+            order.status = "shipped"
+            order.updated_at = datetime.utcnow()
+            shipment_tracker.schedule(order, True)
+            async with AsyncSessionLocal() as db:
+                booked = await db.execute(
+                    update(Order)
+                    .where(
+                        Order.id == order_id,
+                        func.coalesce(Order.biteship_order_id, "") == "",
+                        Order.status.in_(("paid", "processing")),
+                    )
+                    .values(
+                        biteship_order_id=order.biteship_order_id,
+                        waybill_id=order.waybill_id,
+                        tracking_status=order.tracking_status,
+                        tracking_url=order.tracking_url,
+                        status=order.status,
+                        updated_at=order.updated_at,
+                        tracking_checked_at=order.tracking_checked_at,
+                        tracking_next_check_at=order.tracking_next_check_at,
+                    )
+                )
+                await db.commit()
+            if booked.rowcount != 1:
+                print(f"[Shipping] Order {order_id} changed while booking; Biteship order {order.biteship_order_id} needs cancelling")
+                return 409, {"error": "Pesanan berubah saat pengiriman dibuat", "biteship_order_id": order.biteship_order_id}
+            return 200, {
+                "success": True,
+                "biteship_order_id": order.biteship_order_id,
+                "waybill_id": order.waybill_id,
+                "tracking_url": order.tracking_url,
+                "status": order.tracking_status,
+            }
+
+        try:
+            err = resp.json()
+            return resp.status_code, {"error": err.get("error", "Gagal membuat pengiriman")}
+        except Exception:
+            return 500, {"error": "Gagal membuat pengiriman"}
+    finally:
+        _booking.discard(order_id)
+
+
+@router.post("/create-order/{order_id}")
+async def create_shipment(order_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
+    if not user or user.role != "seller":
+        return JSONResponse({"error": "Akses ditolak"}, status_code=403)
+    if not BITESHIP_API_KEY:
+        return JSONResponse({"error": "Biteship belum dikonfigurasi"}, status_code=400)
+
+    # the seller was loaded above; the request's connection isn't needed while Biteship books
+    await db.close()
+    status_code, body = await book_shipment(order_id, user)
+    if status_code == 200:
+        return body
+    return JSONResponse(body, status_code=status_code)
+
+
+@router.post("/create-orders")
+async def create_shipments(request: Request, db: AsyncSession = Depends(get_db)):
+    """Book shipments for many orders at once, streaming one NDJSON line per order as it finishes.
+
+    Body: ``{"order_ids": [...]}`` or ``{"all_paid": true}``. Orders that
+    already have a shipment are reported as skipped, so a run can simply be
+    repeated after a partial failure.
+    """
+    user = await get_current_user(request, db)
+    if not user or user.role != "seller":
+        return JSONResponse({"error": "Akses ditolak"}, status_code=403)
+    if not BITESHIP_API_KEY:
+        return JSONResponse({"error": "Biteship belum dikonfigurasi"}, status_code=400)
+    body = await request.json()
+
+    if body.get("all_paid"):
+        order_ids = (await db.scalars(
+            select(Order.id)
+            .where(Order.status.in_(("paid", "processing")), func.coalesce(Order.biteship_order_id, "") == "")
+            .order_by(Order.created_at)
+        )).all()
+    else:
+        order_ids = body.get("order_ids") or []
+        if not isinstance(order_ids, list) or not all(isinstance(i, str) for i in order_ids):
+            return JSONResponse({"error": "order_ids harus berupa daftar id pesanan"}, status_code=400)
+        order_ids = list(dict.fromkeys(order_ids))
+    if len(order_ids) > BULK_SHIPMENT_MAX_ORDERS:
+        return JSONResponse({"error": f"Maksimal {BULK_SHIPMENT_MAX_ORDERS} pesanan per permintaan"}, status_code=400)
+
+    # the bookings open their own sessions; nothing is read through the request's one from here on
+    await db.close()
+    semaphore = asyncio.Semaphore(BULK_SHIPMENT_CONCURRENCY)
+
+    async def one(order_id: str) -> dict:
+        async with semaphore:
+            # book_shipment opens its own short sessions, so concurrent bookings hold no connection while waiting
+            try:
+                status_code, result = await book_shipment(order_id, user)
+            except Exception as e:
+                print(f"[Shipping] Bulk booking of {order_id} failed: {e}")
+                status_code, result = 500, {"error": "Gagal membuat pengiriman"}
+        if status_code == 400 and result.get("biteship_order_id"):
+            outcome = "skipped"
+        else:
+            outcome = "created" if status_code == 200 else "failed"
+        return {"order_id": order_id, "outcome": outcome, "status_code": status_code, **result}
+
+    async def stream():
+        counts = {"created": 0, "skipped": 0, "failed": 0}
+        for finished in asyncio.as_completed([one(order_id) for order_id in order_ids]):
+            line = await finished
+            counts[line["outcome"]] += 1
+            yield json.dumps(line) + "\n"
+        yield json.dumps({"done": True, "total": len(order_ids), **counts}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 
 @router.get("/track/{order_id}")
-async def track_shipment(order_id: str, request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def track_shipment(order_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user:
         return JSONResponse({"error": "Login terlebih dahulu"}, status_code=401)
 
-    order = db.query(Order).filter(Order.id == order_id).first()
+    order = await db.scalar(select(Order).where(Order.id == order_id))
     if not order:
         return JSONResponse({"error": "Pesanan tidak ditemukan"}, status_code=404)
     if user.role != "seller" and order.user_id != user.id:
         return JSONResponse({"error": "Akses ditolak"}, status_code=403)
 
-    if not order.biteship_order_id or not BITESHIP_API_KEY:
-        return {
-            "order_id": order.id,
-            "status": order.tracking_status or order.status,
-            "waybill_id": order.waybill_id,
-            "tracking_url": order.tracking_url,
-            "history": [],
-        }
-
-    async with httpx.AsyncClient(timeout=10) as client:
-        resp = await client.get(
-            f"{BITESHIP_BASE}/v1/orders/{order.biteship_order_id}",
-            headers=biteship_headers(),
-        )
-
-    if resp.status_code == 200:
-        data = resp.json()
-        courier = data.get("courier", {})
-        order.tracking_status = data.get("status", order.tracking_status)
-        order.waybill_id = courier.get("waybill_id", order.waybill_id)
-        order.tracking_url = courier.get("link", order.tracking_url)
-        if data.get("status") in ("delivered", "completed"):
-            order.status = "completed"
-        order.updated_at = datetime.utcnow()
-        db.commit()
-        history = courier.get("history", [])
-        return {
-            "order_id": order.id,
-            "status": data.get("status", ""),
-            "waybill_id": order.waybill_id,
-            "tracking_url": order.tracking_url,
-            "courier_company": order.courier_company,
-            "courier_type": order.courier_type,
-            "driver_name": courier.get("driver_name"),
-            "driver_phone": courier.get("driver_phone"),
-            "history": history,
-        }
+    # kept current by the Biteship webhook and the background poller (app.tracking)
+    detail = tracking_detail(order)
     return {
         "order_id": order.id,
         "status": order.tracking_status or order.status,
         "waybill_id": order.waybill_id,
         "tracking_url": order.tracking_url,
-        "history": [],
+        "courier_company": order.courier_company,
+        "courier_type": order.courier_type,
+        "driver_name": detail.get("driver_name"),
+        "driver_phone": detail.get("driver_phone"),
+        "history": detail.get("history", []),
+        "checked_at": order.tracking_checked_at.isoformat() if order.tracking_checked_at else None,
     }
 
 
+@router.post("/webhook")
+async def biteship_webhook(request: Request, db: AsyncSession = Depends(get_db)):
+    # fails closed: without a shared secret anyone could mark an order delivered (the poller still tracks it)
+    if not BITESHIP_WEBHOOK_TOKEN:
+        return JSONResponse({"error": "Webhook belum dikonfigurasi"}, status_code=403)
+    token = request.query_params.get("token") or request.headers.get("X-Webhook-Token", "")
+    if not hmac.compare_digest(token, BITESHIP_WEBHOOK_TOKEN):
+        return JSONResponse({"error": "Token tidak valid"}, status_code=403)
+    try:
+        body = await request.json()
+    except Exception:
+        # Biteship checks a new webhook URL with an empty POST and expects 200
+        return {"success": True}
+    if not isinstance(body, dict) or not body.get("order_id"):
+        return {"success": True}
+
+    order = await db.scalar(select(Order).where(Order.biteship_order_id == body["order_id"]))
+    if not order:
+        return {"success": True, "ignored": True}
+    changed = await shipment_tracker.apply(
+        db, order, body.get("status"),
+        waybill_id=body.get("courier_waybill_id"),
+        tracking_url=body.get("courier_link"),
+        driver_name=body.get("courier_driver_name"),
+        driver_phone=body.get("courier_driver_phone"),
+        note=body.get("note", ""),
+        updated_at=body.get("updated_at"),
+    )
+    await db.commit()
+    shipment_tracker.webhooks += 1
+    if changed:
+        catalog_cache.invalidate()
+    return {"success": True}
+
+
+def _label_response(labels: list, fmt: str, name: str):
+    if fmt == "pdf":
+        return Response(
+            label_renderer.pdf_document(labels),
+            media_type="application/pdf",
+            headers={"Content-Disposition": f'inline; filename="{name}.pdf"'},
+        )
+    return HTMLResponse(content=label_renderer.html_document(labels, name))
+
+
 @router.get("/label/{order_id}")
-async def shipping_label(order_id: str, request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def shipping_label(order_id: str, request: Request, format: str = "html", db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user or user.role != "seller":
         return JSONResponse({"error": "Akses ditolak"}, status_code=403)
 
-    order = db.query(Order).filter(Order.id == order_id).first()
-    if not order:
+    labels = await label_renderer.render(db, [order_id], user)
+    if not labels:
         return JSONResponse({"error": "Pesanan tidak ditemukan"}, status_code=404)
+    return _label_response(labels, format, f"Label Pengiriman - #{order_id[:8]}")
 
-    buyer = db.query(User).filter(User.id == order.user_id).first()
 
-    seller_logo = ""
-    seller_config_path = "seller_config.json"
-    try:
-        import os
-        if os.path.exists(seller_config_path):
-            with open(seller_config_path) as f:
-                sc = json.load(f)
-                seller_logo = sc.get("profile_picture", "")
-    except Exception:
-        pass
+@router.get("/labels")
+async def shipping_labels(
+    request: Request, order_ids: str = "", status: str = "", date_from: str = "", date_to: str = "",
+    courier: str = "", tracking_status: str = "", format: str = "html", db: AsyncSession = Depends(get_db),
+):
+    """Every requested label in one printable document.
 
-    items_html = ""
-    total_weight = 0
-    for item in order.items:
-        w = (item.weight or 500) * item.quantity
-        total_weight += w
-        items_html += f"""
-        <tr>
-            <td style="padding:6px 8px;border-bottom:1px solid #eee;">{item.product_name}</td>
-            <td style="padding:6px 8px;border-bottom:1px solid #eee;text-align:center;">{item.quantity}</td>
-            <td style="padding:6px 8px;border-bottom:1px solid #eee;text-align:right;">{w}g</td>
-        </tr>"""
-
-    logo_html = ""
-    if seller_logo:
-        logo_html = f'<img src="{seller_logo}" alt="Logo" style="height:50px;margin-right:12px;border-radius:6px;" />'
-
-    courier_display = (order.courier_company or "").upper()
-    if order.courier_service_name:
-        courier_display += f" - {order.courier_service_name}"
-
-    html = f"""<!DOCTYPE html>
-<html lang="id">
-<head>
-<meta charset="utf-8" />
-<title>Label Pengiriman - #{order.id[:8]}</title>
-<style>
-  @media print {{
-    body {{ margin: 0; }}
-    .no-print {{ display: none !important; }}
-  }}
-  body {{ font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; margin: 20px; color: #333; }}
-  .label {{ max-width: 400px; margin: 0 auto; border: 2px solid #333; padding: 20px; }}
-  .header {{ display: flex; align-items: center; border-bottom: 2px solid #333; padding-bottom: 12px; margin-bottom: 12px; }}
-  .header h2 {{ margin: 0; font-size: 18px; }}
-  .section {{ margin-bottom: 12px; }}
-  .section-title {{ font-size: 11px; text-transform: uppercase; color: #888; margin-bottom: 4px; letter-spacing: 0.5px; }}
-  .section p {{ margin: 2px 0; font-size: 13px; }}
-  .courier-badge {{ background: #333; color: #fff; padding: 6px 12px; font-weight: bold; font-size: 14px; display: inline-block; border-radius: 4px; margin-bottom: 8px; }}
-  .waybill {{ font-family: monospace; font-size: 16px; font-weight: bold; letter-spacing: 1px; }}
-  table {{ width: 100%; border-collapse: collapse; font-size: 13px; }}
-  th {{ text-align: left; padding: 6px 8px; background: #f5f5f5; border-bottom: 2px solid #ddd; font-size: 11px; text-transform: uppercase; }}
-  .barcode {{ text-align: center; padding: 12px 0; font-family: monospace; font-size: 14px; letter-spacing: 3px; border: 1px dashed #ccc; margin-top: 12px; }}
-  .print-btn {{ display: block; margin: 20px auto; padding: 10px 30px; background: #333; color: #fff; border: none; border-radius: 6px; font-size: 14px; cursor: pointer; }}
-</style>
-</head>
-<body>
-<div class="label">
-  <div class="header">
-    {logo_html}
-    <div>
-      <h2>{user.name}</h2>
-      <p style="margin:2px 0;font-size:12px;color:#666;">{user.phone or ''}</p>
-    </div>
-  </div>
-
-  <div class="courier-badge">{courier_display}</div>
-  {f'<div class="waybill">{order.waybill_id}</div>' if order.waybill_id else ''}
-  {f'<p style="font-size:12px;color:#666;">ETD: {order.shipping_etd}</p>' if order.shipping_etd else ''}
-
-  <div class="section">
-    <div class="section-title">Pengirim</div>
-    <p><strong>{user.name}</strong></p>
-    <p>{user.address or '-'}</p>
-    <p>{user.city or ''} {user.postal_code or ''}</p>
-    <p>{user.phone or ''}</p>
-  </div>
-
-  <div class="section">
-    <div class="section-title">Penerima</div>
-    <p><strong>{order.destination_contact_name or (buyer.name if buyer else '-')}</strong></p>
-    <p>{order.shipping_address or '-'}</p>
-    <p>{order.destination_contact_phone or (buyer.phone if buyer else '')}</p>
-  </div>
-
-  <div class="section">
-    <div class="section-title">Isi Paket ({total_weight}g)</div>
-    <table>
-      <tr><th>Produk</th><th style="text-align:center;">Qty</th><th style="text-align:right;">Berat</th></tr>
-      {items_html}
-    </table>
-  </div>
-
-  <div class="barcode">
-    {order.waybill_id or order.id[:12].upper()}
-  </div>
-
-  <p style="text-align:center;font-size:11px;color:#999;margin-top:8px;">Order #{order.id[:8]} &bull; {order.created_at.strftime('%d/%m/%Y') if order.created_at else ''}</p>
-</div>
-<button class="no-print print-btn" onclick="window.print()">Cetak Label</button>
-</body>
-</html>"""
-    return HTMLResponse(content=html)
+    Either ``order_ids`` (comma-separated) or the order-list filters, e.g.
+    ``?status=shipped&date_from=2024-05-01&date_to=2024-05-01&format=pdf``.
+    """
+    user = await get_current_user(request, db)
+    if not user or user.role != "seller":
+        return JSONResponse({"error": "Akses ditolak"}, status_code=403)
+
+    if order_ids:
+        ids = [i for i in order_ids.split(",") if i]
+    else:
+        try:
+            criteria = order_filters(user, status, date_from, date_to, courier, tracking_status)
+        except ValueError:
+            return JSONResponse({"error": "Format tanggal tidak valid"}, status_code=400)
+        if not criteria:
+            return JSONResponse({"error": "Pilih pesanan atau filter terlebih dahulu"}, status_code=400)
+        ids = (await db.scalars(
+            select(Order.id).where(*criteria).order_by(Order.created_at).limit(LABEL_BATCH_MAX + 1)
+        )).all()
+    if len(ids) > LABEL_BATCH_MAX:
+        return JSONResponse({"error": f"Maksimal {LABEL_BATCH_MAX} label per permintaan"}, status_code=400)
+
+    labels = await label_renderer.render(db, ids, user)
+    if not labels:
+        return JSONResponse({"error": "Pesanan tidak ditemukan"}, status_code=404)
+    return _label_response(labels, format, f"Label Pengiriman - {len(labels)} pesanan")
@@ -1,55 +1,70 @@
 from fastapi import APIRouter, Depends, Request, UploadFile, File
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from app.database import get_db
 from app.models import Product, ProductImage, gen_id
 from app.routes.auth import get_current_user
-import os
-import uuid
+from app.cache import catalog_cache
+from app.images import image_processor, InvalidImage, UPLOAD_URL_PREFIX
+from app.blobs import blob_store, BlobTooLarge
+import asyncio
+import json
 
 router = APIRouter(prefix="/api")
 
-UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+async def _store_image(db: AsyncSession, file: UploadFile) -> tuple[str, dict] | JSONResponse:
+    """Store the upload in the blob store and make sure it has renditions; returns (filename, renditions)."""
+    try:
+        filename, created = await blob_store.put(db, file)
+    except BlobTooLarge:
+        return JSONResponse({"error": "Ukuran file terlalu besar"}, status_code=413)
+    renditions = None if created else await asyncio.to_thread(image_processor.renditions_for, UPLOAD_URL_PREFIX + filename)
+    if renditions:
+        return filename, renditions
+    try:
+        renditions = await image_processor.process(filename)
+    except InvalidImage:
+        if created:
+            await blob_store.discard(db, filename)
+        return JSONResponse({"error": "File bukan gambar yang valid"}, status_code=400)
+    except Exception:
+        if created:
+            await blob_store.discard(db, filename)
+        raise
+    return filename, renditions
 
 
 @router.post("/upload-image")
-async def upload_image(request: Request, file: UploadFile = File(...), db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def upload_image(request: Request, file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user or user.role != "seller":
         return JSONResponse({"error": "Akses ditolak"}, status_code=403)
 
-    ext = os.path.splitext(file.filename or "image.jpg")[1] or ".jpg"
-    filename = f"{uuid.uuid4().hex}{ext}"
-    filepath = os.path.join(UPLOAD_DIR, filename)
-
-    contents = await file.read()
-    with open(filepath, "wb") as f:
-        f.write(contents)
-
-    image_url = f"/uploads/{filename}"
-    return {"image_url": image_url, "filename": filename}
+    stored = await _store_image(db, file)
+    if isinstance(stored, JSONResponse):
+        return stored
+    filename, renditions = stored
+    return {"image_url": UPLOAD_URL_PREFIX + filename, "filename": filename, "renditions": renditions}
 
 
 @router.post("/products/{slug}/images")
-async def add_product_image(slug: str, request: Request, file: UploadFile = File(...), db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def add_product_image(slug: str, request: Request, file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user or user.role != "seller":
         return JSONResponse({"error": "Akses ditolak"}, status_code=403)
 
-    product = db.query(Product).filter(Product.slug == slug).first()
+    product = await db.scalar(select(Product).options(selectinload(Product.images)).where(Product.slug == slug))
     if not product:
         return JSONResponse({"error": "Produk tidak ditemukan"}, status_code=404)
 
-    ext = os.path.splitext(file.filename or "image.jpg")[1] or ".jpg"
-    filename = f"{uuid.uuid4().hex}{ext}"
-    filepath = os.path.join(UPLOAD_DIR, filename)
-
-    contents = await file.read()
-    with open(filepath, "wb") as f:
-        f.write(contents)
-
-    image_url = f"/uploads/{filename}"
+    stored = await _store_image(db, file)
+    if isinstance(stored, JSONResponse):
+        return stored
+    filename, renditions = stored
+    image_url = UPLOAD_URL_PREFIX + filename
     max_order = max([img.display_order for img in product.images] + [0])
 
     img = ProductImage(
@@ -57,27 +72,32 @@ async def add_product_image(slug: str, request: Request, file: UploadFile = File
         product_id=product.id,
         image_url=image_url,
         display_order=max_order + 1,
+        renditions=json.dumps(renditions),
     )
     db.add(img)
-    db.commit()
+    await blob_store.retain(db, [image_url])
+    await db.commit()
+    catalog_cache.invalidate()
 
-    return {"image": {"id": img.id, "image_url": image_url, "display_order": img.display_order}}
+    return {"image": {"id": img.id, "image_url": image_url, "display_order": img.display_order, "renditions": renditions}}
 
 
 @router.delete("/products/{slug}/images/{image_id}")
-async def delete_product_image(slug: str, image_id: str, request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def delete_product_image(slug: str, image_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user or user.role != "seller":
         return JSONResponse({"error": "Akses ditolak"}, status_code=403)
 
-    product = db.query(Product).filter(Product.slug == slug).first()
+    product = await db.scalar(select(Product).where(Product.slug == slug))
     if not product:
         return JSONResponse({"error": "Produk tidak ditemukan"}, status_code=404)
 
-    image = db.query(ProductImage).filter(ProductImage.id == image_id, ProductImage.product_id == product.id).first()
+    image = await db.scalar(select(ProductImage).where(ProductImage.id == image_id, ProductImage.product_id == product.id))
     if not image:
         return JSONResponse({"error": "Gambar tidak ditemukan"}, status_code=404)
 
-    db.delete(image)
-    db.commit()
+    await db.delete(image)
+    await blob_store.release(db, [image.image_url])
+    await db.commit()
+    catalog_cache.invalidate()
     return {"success": True}
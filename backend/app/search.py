@@ -0,0 +1,239 @@
+import math
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from app.config import SEARCH_BACKEND
+from app.models import Product
+
+# Field weights: a hit in the title matters more than one in the description.
+FIELD_WEIGHTS = {"name": 3.0, "category": 2.0, "variant": 1.5, "description": 1.0}
+PREFIX_FACTOR = 0.8
+FUZZY_FACTOR = 0.6
+MIN_FUZZY_SIMILARITY = 0.4
+MAX_RESULTS = 200
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize(value: str) -> str:
+    value = unicodedata.normalize("NFKD", value or "")
+    return "".join(ch for ch in value if not unicodedata.combining(ch)).lower()
+
+
+def tokenize(value: str) -> list[str]:
+    return _TOKEN_RE.findall(normalize(value))
+
+
+def _trigrams(term: str) -> set[str]:
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _product_fields(product: Product) -> dict:
+    return {
+        "name": product.name or "",
+        "category": product.category or "",
+        "variant": " ".join(v.variant_name or "" for v in product.variants),
+        "description": product.description or "",
+    }
+
+
+class InMemorySearchIndex:
+    """Inverted index over the catalogue for single-node deployments.
+
+    Matches each query term exactly, by prefix (``sneak`` -> ``sneakers``) and
+    by trigram/edit-distance similarity (``dhigt`` -> ``dhigh``). Every query
+    term has to match for a product to be returned; when nothing matches all
+    of them, products matching the most terms are returned instead.
+    """
+
+    backend = "memory"
+
+    def __init__(self):
+        self._postings: dict[str, dict[str, float]] = defaultdict(dict)
+        self._doc_terms: dict[str, set[str]] = {}
+        self._trigram_terms: dict[str, set[str]] = defaultdict(set)
+        self._sorted_terms: list[str] = []
+        self._sorted_dirty = False
+        self.queries = 0
+
+    async def rebuild(self, db: AsyncSession):
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._trigram_terms.clear()
+        products = (await db.scalars(select(Product).options(selectinload(Product.variants)))).all()
+        for product in products:
+            self.index_product(product)
+        print(f"[Search] Indexed {len(products)} products in memory")
+
+    def index_product(self, product: Product):
+        self.remove(product.id)
+        weights: dict[str, float] = defaultdict(float)
+        for field, value in _product_fields(product).items():
+            tokens = tokenize(value)
+            for token in tokens:
+                weights[token] += FIELD_WEIGHTS[field]
+            if field == "name":
+                # "D HIGH" or "D-HIGH" in a title should still match "dhigh"
+                for left, right in zip(tokens, tokens[1:]):
+                    weights[left + right] += FIELD_WEIGHTS[field] / 2
+        for term, weight in weights.items():
+            if term not in self._postings:
+                self._sorted_dirty = True
+                for gram in _trigrams(term):
+                    self._trigram_terms[gram].add(term)
+            self._postings[term][product.id] = weight
+        self._doc_terms[product.id] = set(weights)
+
+    def remove(self, product_id: str):
+        for term in self._doc_terms.pop(product_id, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[term]
+                for gram in _trigrams(term):
+                    self._trigram_terms[gram].discard(term)
+                self._sorted_dirty = True
+
+    def _expand(self, token: str) -> dict[str, float]:
+        """Index terms a query token may stand for, with a match-quality factor."""
+        matches = {}
+        if token in self._postings:
+            matches[token] = 1.0
+        if len(token) >= 2:
+            if self._sorted_dirty:
+                self._sorted_terms = sorted(self._postings)
+                self._sorted_dirty = False
+            i = bisect_left(self._sorted_terms, token)
+            while i < len(self._sorted_terms) and self._sorted_terms[i].startswith(token):
+                matches.setdefault(self._sorted_terms[i], PREFIX_FACTOR)
+                i += 1
+        if len(token) >= 4:
+            grams = _trigrams(token)
+            candidates = set()
+            for gram in grams:
+                candidates |= self._trigram_terms.get(gram, set())
+            max_edits = 1 if len(token) < 8 else 2
+            for term in candidates - matches.keys():
+                term_grams = _trigrams(term)
+                similarity = len(grams & term_grams) / len(grams | term_grams)
+                if similarity >= MIN_FUZZY_SIMILARITY or _edit_distance(token, term, max_edits) <= max_edits:
+                    matches[term] = FUZZY_FACTOR * max(similarity, 0.5)
+        return matches
+
+    async def search(self, db: AsyncSession, query: str, limit: int | None = MAX_RESULTS) -> list[str]:
+        self.queries += 1
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        total_docs = max(len(self._doc_terms), 1)
+        scores: dict[str, float] = defaultdict(float)
+        matched: dict[str, int] = defaultdict(int)
+        for token in tokens:
+            best: dict[str, float] = {}
+            for term, factor in self._expand(token).items():
+                postings = self._postings[term]
+                idf = math.log(1 + total_docs / len(postings))
+                for product_id, weight in postings.items():
+                    score = factor * weight * idf
+                    if score > best.get(product_id, 0.0):
+                        best[product_id] = score
+            for product_id, score in best.items():
+                scores[product_id] += score
+                matched[product_id] += 1
+        if not scores:
+            return []
+        most_matched = max(matched.values())
+        ranked = sorted(
+            (pid for pid in scores if matched[pid] == most_matched),
+            key=lambda pid: (-scores[pid], pid),
+        )
+        return ranked if limit is None else ranked[:limit]
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "documents": len(self._doc_terms), "terms": len(self._postings), "queries": self.queries}
+
+
+class PostgresSearchIndex:
+    """Search backed by Postgres full-text and pg_trgm indexes.
+
+    The indexes are maintained by Postgres itself, so product writes need no
+    extra work here; ``rebuild`` only makes sure they exist.
+    """
+
+    backend = "postgres"
+
+    DOCUMENT_SQL = (
+        "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(category, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(description, '')), 'D')"
+    )
+    SETUP_STATEMENTS = [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        f"CREATE INDEX IF NOT EXISTS ix_products_search_document ON products USING gin (({DOCUMENT_SQL}))",
+        "CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products USING gin (lower(name) gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_product_variants_name_trgm ON product_variants USING gin (lower(variant_name) gin_trgm_ops)",
+    ]
+
+    def __init__(self):
+        self.queries = 0
+
+    async def rebuild(self, db: AsyncSession):
+        for statement in self.SETUP_STATEMENTS:
+            await db.execute(text(statement))
+        await db.commit()
+        print("[Search] Postgres full-text and trigram indexes ready")
+
+    def index_product(self, product: Product):
+        pass
+
+    def remove(self, product_id: str):
+        pass
+
+    async def search(self, db: AsyncSession, query: str, limit: int | None = MAX_RESULTS) -> list[str]:
+        self.queries += 1
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        tsquery = " & ".join(f"{t}:*" for t in tokens)
+        phrase = " ".join(tokens)
+        rows = await db.execute(
+            text(
+                f"SELECT p.id, ts_rank(({self.DOCUMENT_SQL}), to_tsquery('simple', :tsquery)) "
+                "+ word_similarity(:phrase, lower(p.name)) AS rank "
+                "FROM products p "
+                f"WHERE ({self.DOCUMENT_SQL}) @@ to_tsquery('simple', :tsquery) "
+                "OR :phrase <% lower(p.name) "
+                "OR EXISTS (SELECT 1 FROM product_variants v WHERE v.product_id = p.id AND lower(v.variant_name) % :phrase) "
+                "ORDER BY rank DESC, p.id LIMIT :limit"
+            ),
+            # LIMIT NULL returns every match
+            {"tsquery": tsquery, "phrase": phrase, "limit": limit},
+        )
+        return [row[0] for row in rows]
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "queries": self.queries}
+
+
+search_index = PostgresSearchIndex() if SEARCH_BACKEND == "postgres" else InMemorySearchIndex()
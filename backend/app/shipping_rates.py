@@ -0,0 +1,213 @@
+import asyncio
+from app.cache import TTLCache
+from app.config import RATE_CACHE_TTL, RATE_CACHE_SIZE
+from app.http_clients import biteship
+
+DEFAULT_COURIERS = "jne,sicepat,jnt,anteraja,tiki,ninja,idexpress,pos"
+
+
+class RateQuoteError(Exception):
+    def __init__(self, status_code: int, body: dict):
+        super().__init__(body.get("error"))
+        self.status_code = status_code
+        self.body = body
+
+
+def normalize_items(items: list[dict]) -> list[dict]:
+    normalized = []
+    for item in items:
+        item = dict(item)
+        item.setdefault("length", 10)
+        item.setdefault("width", 10)
+        item.setdefault("height", 10)
+        item.setdefault("weight", 500)
+        item.setdefault("quantity", 1)
+        normalized.append(item)
+    return normalized
+
+
+def parcel_signature(items: list[dict]) -> tuple:
+    """Total weight plus the dimensions of the items stacked into one parcel."""
+    total_weight = sum(int(i["weight"]) * int(i["quantity"]) for i in items)
+    length = max((int(i["length"]) for i in items), default=0)
+    width = max((int(i["width"]) for i in items), default=0)
+    height = sum(int(i["height"]) * int(i["quantity"]) for i in items)
+    return total_weight, length, width, height
+
+
+def normalize_couriers(couriers: str) -> str:
+    return ",".join(sorted({c.strip().lower() for c in (couriers or "").split(",") if c.strip()}))
+
+
+def parse_pricing(pricing_data):
+    results = []
+    for p in pricing_data:
+        nested_rates = p.get("rates")
+        if nested_rates and isinstance(nested_rates, list):
+            company = p.get("company", "")
+            for rate in nested_rates:
+                if rate.get("price") is not None and rate.get("available", True):
+                    results.append({
+                        "courier_company": company,
+                        "courier_type": rate.get("type", rate.get("courier_service_code", "")),
+                        "courier_name": rate.get("courier_name", p.get("courier_name", company)),
+                        "service_name": rate.get("courier_service_name", rate.get("service_name", rate.get("description", ""))),
+                        "description": rate.get("description", ""),
+                        "price": rate.get("price", 0),
+                        "etd": rate.get("shipment_duration_range", ""),
+                        "etd_unit": rate.get("shipment_duration_unit", "days"),
+                    })
+        else:
+            if p.get("price") is not None:
+                results.append({
+                    "courier_company": p.get("company", p.get("courier_company", "")),
+                    "courier_type": p.get("type", p.get("courier_service_code", "")),
+                    "courier_name": p.get("courier_name", p.get("company", "")),
+                    "service_name": p.get("courier_service_name", p.get("service_name", p.get("description", ""))),
+                    "description": p.get("description", ""),
+                    "price": p.get("price", 0),
+                    "etd": p.get("shipment_duration_range", ""),
+                    "etd_unit": p.get("shipment_duration_unit", "days"),
+                })
+    results.sort(key=lambda x: x["price"])
+    return results
+
+
+def _extract_postal_code(area_id_str):
+    if "IDZ" in area_id_str:
+        return area_id_str.split("IDZ")[-1]
+    return ""
+
+
+async def _fetch_rates(origin_area_id, origin_postal_code, destination_area_id, destination_postal_code, couriers, items) -> list[dict]:
+    payload = {
+        "couriers": couriers,
+        "items": items,
+        "origin_area_id": origin_area_id,
+        "origin_postal_code": int(origin_postal_code),
+        "destination_area_id": destination_area_id,
+    }
+    if destination_postal_code:
+        try:
+            payload["destination_postal_code"] = int(destination_postal_code)
+        except (ValueError, TypeError):
+            pass
+
+    print(f"[Biteship rates] Requesting rates: origin={origin_area_id}, dest={destination_area_id}, items={len(items)}, couriers={couriers}")
+
+    resp = await biteship.post("/v1/rates/couriers", json=payload, idempotent=True)
+
+    print(f"[Biteship rates] Response status={resp.status_code}")
+
+    if resp.status_code == 200:
+        return parse_pricing(resp.json().get("pricing", []))
+
+    postal_fallback = _extract_postal_code(destination_area_id)
+    if postal_fallback and postal_fallback.isdigit():
+        try:
+            fallback_payload = {
+                "couriers": couriers,
+                "items": items,
+                "origin_postal_code": int(origin_postal_code),
+                "destination_postal_code": int(postal_fallback),
+            }
+            if origin_area_id:
+                fallback_payload["origin_area_id"] = origin_area_id
+
+            print(f"[Biteship rates] Retrying with postal_code fallback: dest_postal={postal_fallback}")
+            resp2 = await biteship.post("/v1/rates/couriers", json=fallback_payload, idempotent=True)
+            if resp2.status_code == 200:
+                results2 = parse_pricing(resp2.json().get("pricing", []))
+                if results2:
+                    return results2
+        except Exception as e:
+            print(f"[Biteship rates] Postal fallback error: {e}")
+
+    try:
+        err = resp.json()
+    except Exception:
+        print(f"[Biteship rates error] status={resp.status_code} body={resp.text[:500]}")
+        raise RateQuoteError(500, {"error": "Gagal mendapatkan ongkir"})
+    error_msg = err.get("error", "Gagal mendapatkan ongkir")
+    if isinstance(error_msg, dict):
+        error_msg = error_msg.get("message", str(error_msg))
+    print(f"[Biteship rates error] status={resp.status_code} response={err}")
+    raise RateQuoteError(resp.status_code, {"error": error_msg, "debug": {"status": resp.status_code, "origin_area_id": origin_area_id}})
+
+
+class RateQuoter:
+    """Caches Biteship courier quotes and coalesces identical in-flight requests.
+
+    Quotes are keyed by origin, destination, courier list and the parcel
+    signature, so a cart whose items still add up to the same parcel is
+    quoted once per TTL. Failed quotes are not cached.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.cache = TTLCache(max_entries, ttl)
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self.upstream_calls = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(origin_area_id, origin_postal_code, destination_area_id, destination_postal_code, couriers, items) -> tuple:
+        return (
+            origin_area_id, str(origin_postal_code or ""),
+            destination_area_id, str(destination_postal_code or ""),
+            normalize_couriers(couriers), parcel_signature(items),
+        )
+
+    def peek(self, key: tuple) -> list[dict] | None:
+        return self.cache.get(key)
+
+    async def quote(self, origin_area_id, origin_postal_code, destination_area_id, destination_postal_code, couriers, items) -> list[dict]:
+        items = normalize_items(items)
+        key = self.make_key(origin_area_id, origin_postal_code, destination_area_id, destination_postal_code, couriers, items)
+        rates = self.cache.get(key)
+        if rates is not None:
+            return rates
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            self.upstream_calls += 1
+            rates = await _fetch_rates(origin_area_id, origin_postal_code, destination_area_id, destination_postal_code, couriers, items)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # mark retrieved so a quote nobody else waited on doesn't log "exception never retrieved"
+            future.exception()
+            raise
+        else:
+            self.cache.set(key, rates)
+            future.set_result(rates)
+            return rates
+        finally:
+            del self._inflight[key]
+
+    async def price_for(self, origin_area_id, origin_postal_code, destination_area_id, destination_postal_code,
+                        items, courier_company: str, courier_type: str) -> float | None:
+        """Price of one courier service, reusing the quote the buyer was shown at checkout when cached."""
+        items = normalize_items(items)
+        for couriers in (DEFAULT_COURIERS, courier_company):
+            rates = self.peek(self.make_key(origin_area_id, origin_postal_code, destination_area_id, destination_postal_code, couriers, items))
+            if rates is not None:
+                break
+        else:
+            rates = await self.quote(origin_area_id, origin_postal_code, destination_area_id, destination_postal_code, courier_company, items)
+        for rate in rates:
+            if rate["courier_company"] == courier_company and rate["courier_type"] == courier_type:
+                return float(rate["price"])
+        return None
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "upstream_calls": self.upstream_calls, "coalesced": self.coalesced, "in_flight": len(self._inflight)}
+
+
+rate_quoter = RateQuoter(RATE_CACHE_TTL, RATE_CACHE_SIZE)
@@ -0,0 +1,215 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.cache import catalog_cache
+from app.config import BITESHIP_API_KEY, TRACKING_POLL_INTERVAL, TRACKING_BATCH_SIZE, TRACKING_MAX_INTERVAL
+from app.database import AsyncSessionLocal
+from app.http_clients import biteship
+from app.models import Order
+from app.order_events import order_status_changed
+
+# Biteship statuses after which the shipment never moves again
+FINAL_STATUSES = {"delivered", "cancelled", "rejected", "returned", "disposed", "courier_not_found"}
+DELIVERED_STATUSES = {"delivered", "completed"}
+
+# first check after a status change; doubled on every poll that finds nothing new, up to TRACKING_MAX_INTERVAL
+ACTIVE_INTERVAL = 10 * 60       # courier on the way to pick up or drop off
+MOVING_INTERVAL = 30 * 60       # picked up, in the courier's network
+WAITING_INTERVAL = 60 * 60      # confirmed, scheduled, on hold
+
+ACTIVE_STATUSES = {"picking_up", "dropping_off", "return_in_transit"}
+MOVING_STATUSES = {"allocated", "picked"}
+
+
+def _base_interval(status: str | None) -> float:
+    if status in ACTIVE_STATUSES:
+        return ACTIVE_INTERVAL
+    if status in MOVING_STATUSES:
+        return MOVING_INTERVAL
+    return WAITING_INTERVAL
+
+
+def tracking_detail(order: Order) -> dict:
+    try:
+        return json.loads(order.tracking_detail) if order.tracking_detail else {}
+    except ValueError:
+        return {}
+
+
+class ShipmentTracker:
+    """Keeps orders' Biteship tracking state in the database.
+
+    Updates arrive two ways: the Biteship webhook pushes status changes as
+    they happen, and a background poller refreshes in-flight shipments in
+    batches as a safety net for missed or unconfigured webhooks. Each order
+    carries its own ``tracking_next_check_at``; polls that find nothing new
+    back off exponentially, a status change (from either source) resets the
+    interval, and shipments in a final state drop out of the poll entirely.
+    The poller holds no database session while Biteship answers: each
+    response is applied to the order re-read under a row lock in its own
+    short transaction, and dropped if a webhook updated the order meanwhile.
+    ``GET /api/shipping/track`` only reads what is stored here.
+    """
+
+    def __init__(self, poll_interval: float, batch_size: int, max_interval: float):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_interval = max_interval
+        self._poller: asyncio.Task | None = None
+        self.polled = 0
+        self.poll_failures = 0
+        self.webhooks = 0
+        self.status_changes = 0
+
+    def schedule(self, order: Order, changed: bool, now: datetime = None):
+        """Set when the poller should next look at ``order``."""
+        now = now or datetime.utcnow()
+        previous = None
+        if order.tracking_checked_at and order.tracking_next_check_at:
+            previous = (order.tracking_next_check_at - order.tracking_checked_at).total_seconds()
+        order.tracking_checked_at = now
+        if order.tracking_status in FINAL_STATUSES or order.status in ("completed", "cancelled"):
+            order.tracking_next_check_at = None
+            return
+        interval = _base_interval(order.tracking_status)
+        if not changed and previous:
+            interval = min(max(interval, previous * 2), self.max_interval)
+        order.tracking_next_check_at = now + timedelta(seconds=interval)
+
+    async def apply(self, db: AsyncSession, order: Order, status: str | None, *, waybill_id: str = None,
+                    tracking_url: str = None, driver_name: str = None, driver_phone: str = None,
+                    history: list = None, note: str = "", updated_at: str = None) -> bool:
+        """Record a tracking update on ``order``; True when product payloads changed (see order_status_changed).
+
+        ``history`` replaces the stored history (a full poll); otherwise a
+        status change appends one entry built from the webhook fields.
+        """
+        now = datetime.utcnow()
+        changed = bool(status) and status != order.tracking_status
+        if order.tracking_status in FINAL_STATUSES and status not in FINAL_STATUSES:
+            # a late, out-of-order webhook must not reopen a finished shipment
+            changed, status = False, order.tracking_status
+
+        detail = tracking_detail(order)
+        if history is not None:
+            detail["history"] = history
+        elif changed:
+            detail.setdefault("history", []).append({
+                "status": status, "note": note or "", "updated_at": updated_at or now.isoformat() + "Z",
+            })
+        if driver_name is not None:
+            detail["driver_name"] = driver_name
+        if driver_phone is not None:
+            detail["driver_phone"] = driver_phone
+        order.tracking_detail = json.dumps(detail)
+        if waybill_id:
+            order.waybill_id = waybill_id
+        if tracking_url:
+            order.tracking_url = tracking_url
+        if status:
+            order.tracking_status = status
+        if status in DELIVERED_STATUSES and order.status != "cancelled":
+            order.status = "completed"
+        order.updated_at = now
+        if changed:
+            self.status_changes += 1
+        self.schedule(order, changed, now)
+        return bool(await order_status_changed(db, order))
+
+    async def apply_biteship_order(self, db: AsyncSession, order: Order, data: dict) -> bool:
+        """Apply a ``GET /v1/orders/{id}`` response."""
+        courier = data.get("courier") or {}
+        return await self.apply(
+            db, order, data.get("status"),
+            waybill_id=courier.get("waybill_id"),
+            tracking_url=courier.get("link"),
+            driver_name=courier.get("driver_name"),
+            driver_phone=courier.get("driver_phone"),
+            history=courier.get("history") or [],
+        )
+
+    async def _fetch(self, biteship_order_id: str) -> dict | None:
+        try:
+            resp = await biteship.get(f"/v1/orders/{biteship_order_id}", timeout=10)
+        except Exception as e:
+            print(f"[Tracking] Poll of {biteship_order_id} failed: {e}")
+            return None
+        if resp.status_code != 200:
+            print(f"[Tracking] Poll of {biteship_order_id} returned {resp.status_code}")
+            return None
+        return resp.json()
+
+    async def poll_due(self) -> int:
+        """Refresh one batch of shipments whose next check is due; returns how many were polled."""
+        if not BITESHIP_API_KEY:
+            return 0
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            due = (await db.execute(
+                select(Order.id, Order.biteship_order_id)
+                .where(Order.tracking_next_check_at <= now)
+                .order_by(Order.tracking_next_check_at)
+                .limit(self.batch_size)
+            )).all()
+        if not due:
+            return 0
+        # no session is held while Biteship answers; the biteship client bounds how many are in flight
+        responses = await asyncio.gather(*(self._fetch(biteship_order_id) for _, biteship_order_id in due))
+        catalog_changed = False
+        async with AsyncSessionLocal() as db:
+            for (order_id, _), data in zip(due, responses):
+                try:
+                    catalog_changed |= await self._apply_poll(db, order_id, data, now)
+                    await db.commit()
+                except Exception as e:
+                    await db.rollback()
+                    print(f"[Tracking] Applying the poll of order {order_id} failed: {e}")
+        if catalog_changed:
+            catalog_cache.invalidate()
+        self.polled += len(due)
+        return len(due)
+
+    async def _apply_poll(self, db: AsyncSession, order_id: str, data: dict | None, started_at: datetime) -> bool:
+        """Apply one polled response to the order as it is now, in the caller's transaction."""
+        order = await db.get(Order, order_id, with_for_update=True, populate_existing=True)
+        if order is None or order.tracking_next_check_at is None:
+            return False
+        if order.tracking_checked_at and order.tracking_checked_at > started_at:
+            # a webhook landed while Biteship was being asked; it is at least as recent as this response
+            return False
+        if data is None:
+            self.poll_failures += 1
+            self.schedule(order, False, started_at)
+            return False
+        return await self.apply_biteship_order(db, order, data)
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                # keep draining while full batches come back, e.g. after downtime
+                while await self.poll_due() == self.batch_size:
+                    pass
+            except Exception as e:
+                print(f"[Tracking] Poll failed: {e}")
+
+    def start(self):
+        self._poller = asyncio.create_task(self._poll_loop())
+
+    def shutdown(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+
+    def stats(self) -> dict:
+        return {
+            "polled": self.polled,
+            "poll_failures": self.poll_failures,
+            "webhooks": self.webhooks,
+            "status_changes": self.status_changes,
+        }
+
+
+shipment_tracker = ShipmentTracker(TRACKING_POLL_INTERVAL, TRACKING_BATCH_SIZE, TRACKING_MAX_INTERVAL)
@@ -0,0 +1,78 @@
+"""Concurrent throughput of async handlers using the sync vs the async session.
+
+Runs two otherwise identical FastAPI endpoints against the configured Postgres:
+one issues its query through the old blocking ``SessionLocal``, the other
+through ``AsyncSessionLocal``. Each query sleeps server-side to stand in for a
+slow catalogue query, so the sync endpoint serializes every request in the
+worker while the async endpoint overlaps them.
+
+    cd backend && DATABASE_URL=postgresql://... python benchmarks/bench_async_db.py
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import text
+from app.database import SessionLocal, AsyncSessionLocal, async_engine
+
+
+def build_app(query_seconds: float) -> FastAPI:
+    bench = FastAPI()
+    stmt = text("SELECT pg_sleep(:s)")
+
+    @bench.get("/sync")
+    async def sync_session():
+        db = SessionLocal()
+        try:
+            db.execute(stmt, {"s": query_seconds})
+        finally:
+            db.close()
+        return {"ok": True}
+
+    @bench.get("/async")
+    async def async_session():
+        async with AsyncSessionLocal() as db:
+            await db.execute(stmt, {"s": query_seconds})
+        return {"ok": True}
+
+    return bench
+
+
+async def run(client: httpx.AsyncClient, path: str, requests: int, concurrency: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            resp = await client.get(path)
+            resp.raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--query-seconds", type=float, default=0.05)
+    args = parser.parse_args()
+
+    bench = build_app(args.query_seconds)
+    transport = httpx.ASGITransport(app=bench)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await run(client, "/async", args.concurrency, args.concurrency)
+        for label, path in (("before (sync session)", "/sync"), ("after (async session)", "/async")):
+            elapsed = await run(client, path, args.requests, args.concurrency)
+            print(f"{label:24s} {args.requests} requests in {elapsed:6.2f}s -> {args.requests / elapsed:8.1f} req/s")
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
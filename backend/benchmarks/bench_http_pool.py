@@ -0,0 +1,107 @@
+"""Connections opened by per-call httpx clients vs the shared ProviderClient pool.
+
+Starts a local keep-alive HTTP stub that counts accepted TCP connections and
+answers every request with a small JSON body, then issues the same rate-quote
+style POSTs through a fresh ``httpx.AsyncClient`` per call (the old pattern)
+and through ``app.http_clients.ProviderClient``.
+
+    cd backend && DATABASE_URL=postgresql://... python benchmarks/bench_http_pool.py
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from app.http_clients import ProviderClient
+
+BODY = b'{"pricing": []}'
+
+
+class StubServer:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.connections = 0
+        self.requests = 0
+        self.server = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                if length:
+                    await reader.readexactly(length)
+                self.requests += 1
+                await asyncio.sleep(self.latency)
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: " + str(len(BODY)).encode() + b"\r\n\r\n" + BODY
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    def reset(self):
+        self.connections = 0
+        self.requests = 0
+
+
+async def per_call_clients(base_url: str, requests: int, concurrency: int):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            async with httpx.AsyncClient(timeout=10) as client:
+                resp = await client.post(f"{base_url}/v1/rates/couriers", json={"items": []})
+                resp.raise_for_status()
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+
+
+async def shared_pool(base_url: str, requests: int, concurrency: int):
+    provider = ProviderClient("stub", base_url=base_url, max_concurrency=concurrency)
+
+    async def one():
+        resp = await provider.post("/v1/rates/couriers", json={"items": []}, idempotent=True)
+        resp.raise_for_status()
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    await provider.aclose()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.005)
+    args = parser.parse_args()
+
+    stub = StubServer(args.latency)
+    base_url = await stub.start()
+    for label, fn in (("per-call AsyncClient", per_call_clients), ("shared ProviderClient", shared_pool)):
+        stub.reset()
+        started = time.perf_counter()
+        await fn(base_url, args.requests, args.concurrency)
+        elapsed = time.perf_counter() - started
+        print(f"{label:22s} {stub.requests} requests over {stub.connections:4d} connections in {elapsed:6.2f}s")
+    stub.server.close()
+    await stub.server.wait_closed()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
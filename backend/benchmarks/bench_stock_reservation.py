@@ -0,0 +1,95 @@
+"""Flash-sale contention on one SKU: throughput and an oversell check.
+
+Creates a throwaway product with ``--stock`` units, then fires ``--orders``
+checkouts at it from ``--clients`` concurrent sessions. Each checkout writes
+an order row and calls ``stock_reservations.reserve`` in one transaction,
+exactly like ``create_order``. Run it with ``--shards N`` to split the SKU
+across N stock_shards rows first.
+
+Afterwards it checks that the number of successful orders equals the units
+taken, and that stock never went below zero.
+
+    cd backend && DATABASE_URL=postgresql://... python benchmarks/bench_stock_reservation.py --shards 8
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, func, select
+from app.database import AsyncSessionLocal, async_engine
+from app.inventory import OutOfStock, stock_reservations
+from app.migrations import run_migrations
+from app.models import Order, Product, StockReservation, User, gen_id
+
+
+async def setup(stock: int, shards: int) -> tuple[str, str]:
+    user_id, product_id = gen_id(), gen_id()
+    async with AsyncSessionLocal() as db:
+        db.add(User(id=user_id, email=f"bench-{user_id}@local", name="bench", password_hash="-"))
+        db.add(Product(id=product_id, name="bench sku", slug=f"bench-{product_id}", price=1, stock=stock))
+        await db.commit()
+        if shards:
+            await stock_reservations.shard(db, product_id, None, shards)
+            await db.commit()
+    return user_id, product_id
+
+
+async def checkout(user_id: str, product_id: str) -> bool:
+    async with AsyncSessionLocal() as db:
+        order_id = gen_id()
+        db.add(Order(id=order_id, user_id=user_id, total=1, status="pending"))
+        await db.flush()
+        try:
+            await stock_reservations.reserve(db, order_id, [(product_id, None, 1)])
+        except OutOfStock:
+            await db.rollback()
+            return False
+        await db.commit()
+        return True
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stock", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=25)
+    parser.add_argument("--shards", type=int, default=0)
+    args = parser.parse_args()
+
+    run_migrations()
+    user_id, product_id = await setup(args.stock, args.shards)
+    sem = asyncio.Semaphore(args.clients)
+
+    async def one():
+        async with sem:
+            return await checkout(user_id, product_id)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(args.orders)))
+    elapsed = time.perf_counter() - started
+
+    async with AsyncSessionLocal() as db:
+        left = await stock_reservations.available(db, product_id, None)
+        held = await db.scalar(select(func.coalesce(func.sum(StockReservation.quantity), 0))
+                               .where(StockReservation.product_id == product_id))
+        await stock_reservations.unshard(db, product_id, None)
+        await db.execute(delete(User).where(User.id == user_id))
+        await db.execute(delete(Product).where(Product.id == product_id))
+        await db.commit()
+    await async_engine.dispose()
+
+    accepted = sum(results)
+    print(f"shards={args.shards} clients={args.clients}: {args.orders} checkouts in {elapsed:6.2f}s "
+          f"-> {args.orders / elapsed:8.1f} orders/s")
+    print(f"accepted={accepted} rejected={args.orders - accepted} held={held} left={left} (initial {args.stock})")
+    oversold = accepted != held or accepted + left != args.stock or left < 0
+    print("OVERSOLD" if oversold else "no oversell")
+    sys.exit(1 if oversold else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,155 @@
+"""Query-plan regression check: hot route queries must not sequential-scan.
+
+Builds the schema through ``app.migrations`` in a throwaway Postgres schema,
+fills it with a large synthetic dataset, ANALYZEs it, then EXPLAINs the
+lookups the routes issue (the same SQLAlchemy statements, bound to realistic
+ids). Any ``Seq Scan`` on a table in the plan fails the run with exit code 1,
+so a dropped index or a query rewritten around one is caught before it ships.
+
+    cd backend && DATABASE_URL=postgresql://... python benchmarks/check_query_plans.py [--scale 1.0]
+"""
+import argparse
+import os
+import sys
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select, text, tuple_
+from app.config import DATABASE_URL
+from app.database import engine
+from app.migrations import run_migrations
+from app.models import (
+    CartItem, Order, OrderItem, PaymentNotification, Product, ProductImage, ProductVariant, StockReservation, User,
+)
+from app.routes.products import products_page_query
+
+
+def seed(conn, users: int, products: int, orders: int):
+    statements = [
+        f"""INSERT INTO users (id, email, name, password_hash, role, created_at)
+            SELECT 'u' || g, 'u' || g || '@bench.local', 'User ' || g, '-', 'buyer', now()
+            FROM generate_series(1, {users}) g""",
+        f"""INSERT INTO products (id, name, slug, price, category, stock, sold_count, rating)
+            SELECT 'p' || g, 'Product ' || g, 'product-' || g, 10000 + g % 500 * 1000,
+                   'category-' || g % 200, 100, g % 1000, (g % 50) / 10.0
+            FROM generate_series(1, {products}) g""",
+        f"""INSERT INTO product_images (id, product_id, image_url, display_order)
+            SELECT 'pi' || g, 'p' || ((g - 1) / 3 + 1), '/uploads/' || g || '.jpg', g % 3
+            FROM generate_series(1, {products * 3}) g""",
+        f"""INSERT INTO product_variants (id, product_id, variant_name, stock, is_available)
+            SELECT 'pv' || g, 'p' || ((g - 1) / 5 + 1), (38 + g % 5)::text, 20, true
+            FROM generate_series(1, {products * 5}) g""",
+        f"""INSERT INTO cart_items (id, user_id, product_id, variant_name, quantity)
+            SELECT 'c' || g, 'u' || g, 'p' || (g % {products} + 1), '40', 1
+            FROM generate_series(1, {users}) g""",
+        f"""INSERT INTO orders (id, user_id, total, status, midtrans_order_id, biteship_order_id,
+                               tracking_next_check_at, created_at, updated_at)
+            SELECT 'o' || g, 'u' || (g % {users} + 1), 100000, 'paid', 'o' || g,
+                   CASE WHEN g % 20 = 0 THEN 'bs' || g END,
+                   CASE WHEN g % 20 = 0 THEN now() + g * interval '1 second' END,
+                   now() - g * interval '1 minute', now()
+            FROM generate_series(1, {orders}) g""",
+        f"""INSERT INTO order_items (id, order_id, product_id, product_name, quantity, price, weight)
+            SELECT 'oi' || g, 'o' || ((g - 1) / 2 + 1), 'p' || (g % {products} + 1), 'Product', 1, 10000, 500
+            FROM generate_series(1, {orders * 2}) g""",
+        f"""INSERT INTO stock_reservations (id, order_id, product_id, quantity, status, expires_at, created_at)
+            SELECT 'r' || g, 'o' || g, 'p' || (g % {products} + 1), 1,
+                   CASE WHEN g % 100 = 0 THEN 'held' ELSE 'committed' END,
+                   now() + interval '1 day', now()
+            FROM generate_series(1, {orders}) g""",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+    conn.execute(text("ANALYZE"))
+
+
+def route_queries(users: int, products: int, orders: int) -> list[tuple[str, object]]:
+    user_id = f"u{users // 2}"
+    product_id = f"p{products // 2}"
+    order_id = f"o{orders // 2}"
+    return [
+        ("auth: user by email", select(User).where(User.email == f"{user_id}@bench.local")),
+        ("products: by slug", select(Product).where(Product.slug == f"product-{products // 2}")),
+        ("products: storefront first page", products_page_query(None, None, "sold_count", "desc", 24, None)),
+        ("products: storefront next page", products_page_query(None, None, "sold_count", "desc", 24, (500, product_id))),
+        ("products: cheapest first", products_page_query(None, None, "price", "asc", 24, (20000.0, product_id))),
+        ("products: best rated", products_page_query(None, None, "rating", "desc", 24, (2.5, product_id))),
+        ("products: by category", products_page_query("category-7", None, "sold_count", "desc", 24, None)),
+        ("products: by category next page", products_page_query("category-7", None, "price", "asc", 24, (20000.0, product_id))),
+        ("products: images (selectinload)", select(ProductImage).where(ProductImage.product_id.in_([product_id, "p1", "p2"]))),
+        ("products: variants (selectinload)", select(ProductVariant).where(ProductVariant.product_id.in_([product_id, "p1", "p2"]))),
+        ("cart: variant price", select(ProductVariant).where(ProductVariant.product_id == product_id, ProductVariant.variant_name == "40")),
+        ("cart: items of user", select(CartItem).where(CartItem.user_id == user_id)),
+        ("cart: existing line", select(CartItem).where(
+            CartItem.user_id == user_id, CartItem.product_id == product_id, CartItem.variant_name == "40")),
+        ("cart: lines of product", select(CartItem.id).where(CartItem.product_id == product_id)),
+        ("orders: buyer history", select(Order).where(Order.user_id == user_id)
+            .order_by(Order.created_at.desc(), Order.id.desc()).limit(51)),
+        ("orders: buyer history next page", select(Order).where(
+            Order.user_id == user_id, tuple_(Order.created_at, Order.id) < tuple_(datetime(2000, 1, 1), order_id))
+            .order_by(Order.created_at.desc(), Order.id.desc()).limit(51)),
+        ("orders: seller newest page", select(Order).order_by(Order.created_at.desc(), Order.id.desc()).limit(51)),
+        ("orders: seller page by status", select(Order).where(Order.status == "paid")
+            .order_by(Order.created_at.desc(), Order.id.desc()).limit(51)),
+        ("orders: by id", select(Order).where(Order.id == order_id)),
+        ("payment: by midtrans order id", select(Order).where(Order.midtrans_order_id == order_id)),
+        ("tracking: due shipments", select(Order).where(Order.tracking_next_check_at <= datetime(2000, 1, 1))
+            .order_by(Order.tracking_next_check_at).limit(50)),
+        ("payments: notification inbox", select(PaymentNotification)
+            .where(PaymentNotification.processed_at.is_(None)).order_by(PaymentNotification.id).limit(200)),
+        ("payments: reconciliation sweep", select(Order)
+            .where(Order.status == "pending", Order.payment_checked_at <= datetime(2000, 1, 1))
+            .order_by(Order.payment_checked_at).limit(100)),
+        ("tracking: webhook order", select(Order).where(Order.biteship_order_id == f"bs{orders // 2}")),
+        ("orders: items (selectinload)", select(OrderItem).where(OrderItem.order_id.in_([order_id, "o1", "o2"]))),
+        ("orders: items of product", select(OrderItem.id).where(OrderItem.product_id == product_id)),
+        ("stock: holds of order", select(StockReservation).where(
+            StockReservation.order_id == order_id, StockReservation.status == "held")),
+        ("stock: expired holds", select(StockReservation.order_id).where(
+            StockReservation.status == "held", StockReservation.expires_at < datetime(2000, 1, 1)).distinct()),
+    ]
+
+
+def seq_scans(plan: dict) -> list[str]:
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name", "?"))
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=float, default=1.0)
+    args = parser.parse_args()
+    users, products, orders = (max(int(n * args.scale), 100) for n in (20_000, 20_000, 200_000))
+
+    schema = f"plan_check_{uuid.uuid4().hex[:8]}"
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+    check_engine = create_engine(DATABASE_URL, connect_args={"options": f"-csearch_path={schema}"})
+    failures = 0
+    try:
+        run_migrations(check_engine)
+        with check_engine.begin() as conn:
+            seed(conn, users, products, orders)
+        with check_engine.connect() as conn:
+            for name, stmt in route_queries(users, products, orders):
+                compiled = stmt.compile(dialect=check_engine.dialect, compile_kwargs={"render_postcompile": True})
+                plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled.string}", compiled.params).scalar()
+                scans = seq_scans(plan[0]["Plan"])
+                failures += bool(scans)
+                print(f"{'FAIL' if scans else 'ok  '} {name}" + (f"  (seq scan on {', '.join(scans)})" if scans else ""))
+    finally:
+        check_engine.dispose()
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+    print(f"{failures} route queries fall back to a sequential scan" if failures else "all route queries use indexes")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,8 @@ import sys
 
 sys.path.insert(0, os.path.dirname(__file__))
 
-from app.database import engine, SessionLocal, Base
+from app.database import SessionLocal
+from app.migrations import run_migrations
 from app.models import User, Product, ProductImage, ProductVariant, gen_id
 
 
@@ -17,7 +18,7 @@ def seed():
     with open(seed_path, "r") as f:
         data = json.load(f)
 
-    Base.metadata.create_all(bind=engine)
+    run_migrations()
     db = SessionLocal()
 
     try:
@@ -1,7 +1,6 @@
 "use client";
 
 import { useState, useEffect } from "react";
-import { useRouter } from "next/navigation";
 import Link from "next/link";
 
 interface CartItem {
@@ -12,33 +11,44 @@ interface CartItem {
   product: { name: string; price: number; primary_image: string; stock: number } | null;
 }
 
+interface CartSummary {
+  item_count: number;
+  quantity: number;
+  subtotal: number;
+}
+
 function formatPrice(price: number): string {
   return new Intl.NumberFormat("id-ID", { style: "currency", currency: "IDR", minimumFractionDigits: 0 }).format(price);
 }
 
 export default function CartPage() {
-  const router = useRouter();
   const [items, setItems] = useState<CartItem[]>([]);
+  const [summary, setSummary] = useState<CartSummary | null>(null);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
-    fetch("/api/auth/me")
-      .then((r) => r.json())
-      .then((data) => { if (!data.user) router.push("/login"); });
-
     fetch("/api/cart")
       .then((r) => r.json())
-      .then((data) => { setItems(data.items || []); setLoading(false); })
+      .then((data) => { setItems(data.items || []); setSummary(data.summary || null); setLoading(false); })
       .catch(() => setLoading(false));
-  }, [router]);
+  }, []);
 
   const updateQuantity = async (itemId: string, quantity: number) => {
-    await fetch("/api/cart", { method: "PUT", headers: { "Content-Type": "application/json" }, body: JSON.stringify({ item_id: itemId, quantity }) });
-    if (quantity <= 0) setItems((prev) => prev.filter((i) => i.id !== itemId));
-    else setItems((prev) => prev.map((i) => (i.id === itemId ? { ...i, quantity } : i)));
+    const res = await fetch("/api/cart/batch", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ operations: [{ op: "set", item_id: itemId, quantity: Math.max(quantity, 0) }] }),
+    });
+    const data = await res.json();
+    if (!res.ok) {
+      alert(data.error || "Gagal memperbarui keranjang");
+      return;
+    }
+    setItems(data.items || []);
+    setSummary(data.summary || null);
   };
 
-  const total = items.reduce((sum, item) => sum + (item.product?.price || 0) * item.quantity, 0);
+  const total = summary?.subtotal ?? 0;
 
   if (loading) return <div className="min-h-screen bg-gray-50 flex items-center justify-center"><div className="text-gray-400">Memuat...</div></div>;
 
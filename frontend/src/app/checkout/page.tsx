@@ -52,6 +52,7 @@ declare global {
 export default function CheckoutPage() {
   const router = useRouter();
   const [items, setItems] = useState<CartItem[]>([]);
+  const [subtotal, setSubtotal] = useState(0);
   const [contactName, setContactName] = useState("");
   const [contactPhone, setContactPhone] = useState("");
   const [address, setAddress] = useState("");
@@ -83,7 +84,7 @@ export default function CheckoutPage() {
       setContactPhone(u.phone || "");
       if (u.address) setAddress(u.address);
     });
-    fetch("/api/cart").then((r) => r.json()).then((data) => { setItems(data.items || []); setLoading(false); });
+    fetch("/api/cart").then((r) => r.json()).then((data) => { setItems(data.items || []); setSubtotal(data.summary?.subtotal || 0); setLoading(false); });
     fetch("/api/shipping/status").then((r) => r.json()).then((data) => setShippingAvailable(data.available)).catch(() => {});
     fetch("/api/payment/client-key").then((r) => r.json()).then((data) => {
       if (data.client_key) {
@@ -172,7 +173,7 @@ export default function CheckoutPage() {
     setLoadingRates(false);
   };
 
-  const itemsTotal = items.reduce((sum, item) => sum + (item.product?.price || 0) * item.quantity, 0);
+  const itemsTotal = subtotal;
   const shippingCost = selectedRate?.price || 0;
   const grandTotal = itemsTotal + shippingCost;
 
@@ -217,7 +218,7 @@ export default function CheckoutPage() {
           return;
         }
         const { token } = await tokenRes.json();
-        const syncStatus = async (oid: string) => { try { await fetch(`/api/payment/status/${oid}`); } catch {} };
+        const syncStatus = async (oid: string) => { try { await fetch(`/api/payment/status/${oid}?refresh=1`); } catch {} };
         if (window.snap && token) {
           window.snap.pay(token, {
             onSuccess: async () => { await syncStatus(order.id); router.push("/orders"); },
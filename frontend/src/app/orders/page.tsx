@@ -34,6 +34,8 @@ interface Order {
   items: Array<{ product_name: string; quantity: number; price: number; variant_name?: string }>;
 }
 
+const ORDER_PAGE_SIZE = 20;
+
 function formatPrice(price: number): string {
   return new Intl.NumberFormat("id-ID", { style: "currency", currency: "IDR", minimumFractionDigits: 0 }).format(price);
 }
@@ -70,6 +72,8 @@ declare global {
 export default function OrdersPage() {
   const router = useRouter();
   const [orders, setOrders] = useState<Order[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [loading, setLoading] = useState(true);
   const [payingOrderId, setPayingOrderId] = useState<string | null>(null);
   const [snapReady, setSnapReady] = useState(false);
@@ -79,7 +83,18 @@ export default function OrdersPage() {
   const [trackingLoading, setTrackingLoading] = useState(false);
 
   const loadOrders = () => {
-    fetch("/api/orders").then((r) => r.json()).then((data) => { setOrders(data.orders || []); setLoading(false); });
+    fetch(`/api/orders?limit=${ORDER_PAGE_SIZE}`).then((r) => r.json()).then((data) => { setOrders(data.orders || []); setNextCursor(data.next_cursor || null); setLoading(false); });
+  };
+
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const data = await fetch(`/api/orders?limit=${ORDER_PAGE_SIZE}&cursor=${encodeURIComponent(nextCursor)}`).then((r) => r.json());
+      setOrders((prev) => [...prev, ...(data.orders || [])]);
+      setNextCursor(data.next_cursor || null);
+    } catch {}
+    setLoadingMore(false);
   };
 
   useEffect(() => {
@@ -102,7 +117,7 @@ export default function OrdersPage() {
       const tokenRes = await fetch("/api/payment/token", { method: "POST", headers: { "Content-Type": "application/json" }, body: JSON.stringify({ order_id: orderId }) });
       if (!tokenRes.ok) { setPayingOrderId(null); return; }
       const { token } = await tokenRes.json();
-      const syncStatus = async () => { try { await fetch(`/api/payment/status/${orderId}`); } catch {} };
+      const syncStatus = async () => { try { await fetch(`/api/payment/status/${orderId}?refresh=1`); } catch {} };
       if (window.snap && token) {
         window.snap.pay(token, {
           onSuccess: async () => { await syncStatus(); loadOrders(); setPayingOrderId(null); },
@@ -236,6 +251,11 @@ export default function OrdersPage() {
                 </div>
               );
             })}
+            {nextCursor && (
+              <button onClick={loadMore} disabled={loadingMore} className="w-full py-2.5 bg-white border rounded-lg text-sm font-medium text-gray-700 hover:bg-gray-50 transition disabled:opacity-50" data-testid="button-load-more-orders">
+                {loadingMore ? "Memuat..." : "Muat Pesanan Lainnya"}
+              </button>
+            )}
           </div>
         )}
       </div>
@@ -1,9 +1,10 @@
 "use client";
 
-import { useState, useMemo, useEffect } from "react";
+import { useState, useEffect } from "react";
 import ProductCard from "@/components/ProductCard";
 import ProductDetail from "@/components/ProductDetail";
 import Navbar from "@/components/Navbar";
+import { Renditions } from "@/components/ResponsiveImage";
 
 interface Variant {
   variant_type: string;
@@ -25,7 +26,9 @@ interface Product {
   stock: number;
   rating: number;
   primary_image: string;
+  primary_image_renditions?: Renditions | null;
   images: string[];
+  image_renditions: (Renditions | null)[];
   variants: Variant[];
 }
 
@@ -36,6 +39,23 @@ interface Seller {
   brand_colors: string[];
 }
 
+const PAGE_SIZE = 24;
+
+function toProduct(p: Record<string, unknown>): Product {
+  return {
+    ...p,
+    images: Array.isArray(p.images) ? p.images.map((img: unknown) => typeof img === "string" ? img : (img as Record<string, string>).image_url || "") : [],
+    image_renditions: Array.isArray(p.images) ? p.images.map((img: unknown) => typeof img === "string" ? null : (img as { renditions?: Renditions | null }).renditions ?? null) : [],
+  } as Product;
+}
+
+function productsUrl(category: string | null, cursor: string | null): string {
+  const params = new URLSearchParams({ limit: String(PAGE_SIZE) });
+  if (category) params.set("category", category);
+  if (cursor) params.set("cursor", cursor);
+  return `/api/products?${params}`;
+}
+
 function formatPrice(price: number): string {
   return new Intl.NumberFormat("id-ID", {
     style: "currency",
@@ -54,58 +74,55 @@ export default function StorePage() {
   const [activeCategory, setActiveCategory] = useState<string | null>(null);
   const [selectedProduct, setSelectedProduct] = useState<Product | null>(null);
   const [cartCount, setCartCount] = useState(0);
-  const [user, setUser] = useState<{ role: string } | null>(null);
   const [toast, setToast] = useState("");
   const [products, setProducts] = useState<Product[]>([]);
+  const [categories, setCategories] = useState<string[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [seller, setSeller] = useState<Seller>({ username: "", seller_name: "Store", profile_picture: null, brand_colors: [] });
   const [loading, setLoading] = useState(true);
 
+  // the first page of the chosen category; later pages are appended by loadMore
   useEffect(() => {
-    fetch("/api/products")
+    let stale = false;
+    fetch(productsUrl(activeCategory, null))
       .then((r) => r.json())
       .then((data) => {
-        const prods = (data.products || []).map((p: Record<string, unknown>) => ({
-          ...p,
-          images: Array.isArray(p.images) ? p.images.map((img: unknown) => typeof img === "string" ? img : (img as Record<string, string>).image_url || "") : [],
-        }));
-        setProducts(prods);
+        if (stale) return;
+        setProducts((data.products || []).map(toProduct));
+        setNextCursor(data.next_cursor || null);
         if (data.seller) setSeller(data.seller);
         setLoading(false);
       })
       .catch(() => setLoading(false));
+    return () => { stale = true; };
+  }, [activeCategory]);
 
-    fetch("/api/auth/me")
+  useEffect(() => {
+    fetch("/api/categories")
       .then((r) => r.json())
-      .then((data) => {
-        if (data.user) {
-          setUser(data.user);
-          fetch("/api/cart")
-            .then((r) => r.json())
-            .then((cartData) => {
-              const items = cartData.items || [];
-              setCartCount(items.reduce((s: number, i: { quantity: number }) => s + i.quantity, 0));
-            });
-        }
-      })
+      .then((data) => setCategories(data.categories || []))
       .catch(() => {});
-  }, []);
 
-  const categories = useMemo(() => {
-    const cats = [...new Set(products.map((p) => p.category))];
-    return cats.sort();
-  }, [products]);
+    // guests have a cart too (kept server-side until they log in)
+    fetch("/api/cart")
+      .then((r) => r.json())
+      .then((cartData) => setCartCount(cartData.summary?.quantity || 0))
+      .catch(() => {});
+  }, []);
 
-  const filteredProducts = useMemo(() => {
-    if (!activeCategory) return products;
-    return products.filter((p) => p.category === activeCategory);
-  }, [products, activeCategory]);
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const data = await fetch(productsUrl(activeCategory, nextCursor)).then((r) => r.json());
+      setProducts((prev) => [...prev, ...(data.products || []).map(toProduct)]);
+      setNextCursor(data.next_cursor || null);
+    } catch {}
+    setLoadingMore(false);
+  };
 
   const addToCart = async (product: Product, variantName?: string, quantity: number = 1) => {
-    if (!user) {
-      window.location.href = "/login";
-      return;
-    }
-
     try {
       const res = await fetch("/api/cart", {
         method: "POST",
@@ -114,7 +131,8 @@ export default function StorePage() {
       });
 
       if (res.ok) {
-        setCartCount((prev) => prev + quantity);
+        const data = await res.json();
+        setCartCount(data.summary?.quantity ?? 0);
         setSelectedProduct(null);
         setToast("Ditambahkan ke keranjang!");
         setTimeout(() => setToast(""), 2000);
@@ -165,7 +183,7 @@ export default function StorePage() {
 
       <main className="max-w-7xl mx-auto px-4 py-6">
         <div className="grid grid-cols-2 md:grid-cols-3 lg:grid-cols-4 xl:grid-cols-5 gap-3">
-          {filteredProducts.map((product) => (
+          {products.map((product) => (
             <ProductCard
               key={product.slug}
               product={product}
@@ -175,11 +193,23 @@ export default function StorePage() {
             />
           ))}
         </div>
-        {filteredProducts.length === 0 && (
+        {products.length === 0 && (
           <div className="text-center py-20 text-gray-400">
             <p>Tidak ada produk ditemukan</p>
           </div>
         )}
+        {nextCursor && (
+          <div className="flex justify-center mt-6">
+            <button
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="px-6 py-2.5 bg-white border rounded-lg text-sm font-medium text-gray-700 hover:bg-gray-50 transition disabled:opacity-50"
+              data-testid="button-load-more"
+            >
+              {loadingMore ? "Memuat..." : "Muat Lebih Banyak"}
+            </button>
+          </div>
+        )}
       </main>
 
       {selectedProduct && (
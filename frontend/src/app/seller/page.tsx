@@ -13,6 +13,11 @@ interface Order {
   items: Array<{ product_name: string; quantity: number; price: number }>;
 }
 interface OriginArea { id: string; name: string; postal_code: number; }
+interface OrderSummary { total_orders: number; amount_by_status: Record<string, number>; }
+
+const ORDER_PAGE_SIZE = 20;
+const PRODUCT_PAGE_SIZE = 100;
+const REVENUE_STATUSES = ["paid", "shipped", "completed"];
 
 function formatPrice(price: number): string {
   return new Intl.NumberFormat("id-ID", { style: "currency", currency: "IDR", minimumFractionDigits: 0 }).format(price);
@@ -40,7 +45,12 @@ function ShippingBadge({ status }: { status?: string }) {
 export default function SellerDashboard() {
   const router = useRouter();
   const [products, setProducts] = useState<Product[]>([]);
+  const [productsCursor, setProductsCursor] = useState<string | null>(null);
+  const [productsLoadingMore, setProductsLoadingMore] = useState(false);
   const [orders, setOrders] = useState<Order[]>([]);
+  const [ordersCursor, setOrdersCursor] = useState<string | null>(null);
+  const [ordersLoadingMore, setOrdersLoadingMore] = useState(false);
+  const [orderSummary, setOrderSummary] = useState<OrderSummary | null>(null);
   const [tab, setTab] = useState<"products" | "orders" | "settings">("products");
   const [loading, setLoading] = useState(true);
   const [user, setUser] = useState<{ name: string; role: string } | null>(null);
@@ -58,11 +68,35 @@ export default function SellerDashboard() {
 
   useEffect(() => {
     fetch("/api/auth/me").then((r) => r.json()).then((data) => { if (!data.user || data.user.role !== "seller") { router.push("/login"); return; } setUser(data.user); });
-    Promise.all([fetch("/api/products").then((r) => r.json()), fetch("/api/orders").then((r) => r.json())]).then(([prodData, orderData]) => { setProducts(prodData.products || []); setOrders(orderData.orders || []); setLoading(false); });
+    Promise.all([fetch(`/api/products?limit=${PRODUCT_PAGE_SIZE}`).then((r) => r.json()), fetch(`/api/orders?limit=${ORDER_PAGE_SIZE}`).then((r) => r.json())]).then(([prodData, orderData]) => { setProducts(prodData.products || []); setProductsCursor(prodData.next_cursor || null); setOrders(orderData.orders || []); setOrdersCursor(orderData.next_cursor || null); setLoading(false); });
+    // counts and revenue come from the summary so the dashboard never loads every order
+    fetch("/api/orders?summary=1&limit=1").then((r) => r.json()).then((data) => { if (data.summary) setOrderSummary(data.summary); }).catch(() => {});
     fetch("/api/shipping/status").then((r) => r.json()).then((data) => setShippingAvailable(data.available)).catch(() => {});
     fetch("/api/shipping/origin").then((r) => r.json()).then((data) => { if (data.area_id) setCurrentOriginId(data.area_id); }).catch(() => {});
   }, [router]);
 
+  const loadMoreProducts = async () => {
+    if (!productsCursor) return;
+    setProductsLoadingMore(true);
+    try {
+      const data = await fetch(`/api/products?limit=${PRODUCT_PAGE_SIZE}&cursor=${encodeURIComponent(productsCursor)}`).then((r) => r.json());
+      setProducts((prev) => [...prev, ...(data.products || [])]);
+      setProductsCursor(data.next_cursor || null);
+    } catch {}
+    setProductsLoadingMore(false);
+  };
+
+  const loadMoreOrders = async () => {
+    if (!ordersCursor) return;
+    setOrdersLoadingMore(true);
+    try {
+      const data = await fetch(`/api/orders?limit=${ORDER_PAGE_SIZE}&cursor=${encodeURIComponent(ordersCursor)}`).then((r) => r.json());
+      setOrders((prev) => [...prev, ...(data.orders || [])]);
+      setOrdersCursor(data.next_cursor || null);
+    } catch {}
+    setOrdersLoadingMore(false);
+  };
+
   const handleDelete = async (slug: string) => { if (!confirm("Hapus produk ini?")) return; const res = await fetch(`/api/products/${slug}`, { method: "DELETE" }); if (res.ok) setProducts((prev) => prev.filter((p) => p.slug !== slug)); };
   const handleStatusChange = async (orderId: string, newStatus: string) => { await fetch(`/api/orders`, { method: "PUT", headers: { "Content-Type": "application/json" }, body: JSON.stringify({ order_id: orderId, status: newStatus }) }); setOrders((prev) => prev.map((o) => (o.id === orderId ? { ...o, status: newStatus } : o))); };
 
@@ -88,7 +122,11 @@ export default function SellerDashboard() {
 
   if (loading) return <div className="min-h-screen bg-gray-50 flex items-center justify-center"><div className="text-gray-400">Memuat...</div></div>;
 
-  const totalRevenue = orders.filter((o) => o.status === "paid" || o.status === "completed" || o.status === "shipped").reduce((s, o) => s + o.total, 0);
+  const productCount = `${products.length}${productsCursor ? "+" : ""}`;
+  const totalOrders = orderSummary ? orderSummary.total_orders : orders.length;
+  const totalRevenue = orderSummary
+    ? REVENUE_STATUSES.reduce((s, status) => s + (orderSummary.amount_by_status[status] || 0), 0)
+    : orders.filter((o) => REVENUE_STATUSES.includes(o.status)).reduce((s, o) => s + o.total, 0);
 
   return (
     <div className="min-h-screen bg-gray-50">
@@ -103,13 +141,13 @@ export default function SellerDashboard() {
       </header>
       <div className="max-w-6xl mx-auto px-4 py-6">
         <div className="grid grid-cols-3 gap-4 mb-6">
-          <div className="bg-white rounded-lg border p-4"><p className="text-sm text-gray-500">Total Produk</p><p className="text-2xl font-bold" data-testid="text-total-products">{products.length}</p></div>
-          <div className="bg-white rounded-lg border p-4"><p className="text-sm text-gray-500">Total Pesanan</p><p className="text-2xl font-bold" data-testid="text-total-orders">{orders.length}</p></div>
+          <div className="bg-white rounded-lg border p-4"><p className="text-sm text-gray-500">Total Produk</p><p className="text-2xl font-bold" data-testid="text-total-products">{productCount}</p></div>
+          <div className="bg-white rounded-lg border p-4"><p className="text-sm text-gray-500">Total Pesanan</p><p className="text-2xl font-bold" data-testid="text-total-orders">{totalOrders}</p></div>
           <div className="bg-white rounded-lg border p-4"><p className="text-sm text-gray-500">Pendapatan</p><p className="text-2xl font-bold text-green-600" data-testid="text-revenue">{formatPrice(totalRevenue)}</p></div>
         </div>
         <div className="flex gap-2 mb-4">
-          <button onClick={() => setTab("products")} className={`px-4 py-2 rounded-lg text-sm font-medium transition ${tab === "products" ? "bg-gray-900 text-white" : "bg-white border text-gray-700"}`} data-testid="tab-products">Produk ({products.length})</button>
-          <button onClick={() => setTab("orders")} className={`px-4 py-2 rounded-lg text-sm font-medium transition ${tab === "orders" ? "bg-gray-900 text-white" : "bg-white border text-gray-700"}`} data-testid="tab-orders">Pesanan ({orders.length})</button>
+          <button onClick={() => setTab("products")} className={`px-4 py-2 rounded-lg text-sm font-medium transition ${tab === "products" ? "bg-gray-900 text-white" : "bg-white border text-gray-700"}`} data-testid="tab-products">Produk ({productCount})</button>
+          <button onClick={() => setTab("orders")} className={`px-4 py-2 rounded-lg text-sm font-medium transition ${tab === "orders" ? "bg-gray-900 text-white" : "bg-white border text-gray-700"}`} data-testid="tab-orders">Pesanan ({totalOrders})</button>
           <button onClick={() => setTab("settings")} className={`px-4 py-2 rounded-lg text-sm font-medium transition ${tab === "settings" ? "bg-gray-900 text-white" : "bg-white border text-gray-700"}`} data-testid="tab-settings">Pengaturan</button>
         </div>
         {tab === "products" && (
@@ -134,6 +172,11 @@ export default function SellerDashboard() {
                 </div>
               ))}
               {products.length === 0 && <div className="text-center py-12 text-gray-400">Belum ada produk</div>}
+              {productsCursor && (
+                <button onClick={loadMoreProducts} disabled={productsLoadingMore} className="w-full py-2.5 bg-white border rounded-lg text-sm font-medium text-gray-700 hover:bg-gray-50 transition disabled:opacity-50" data-testid="button-load-more-products">
+                  {productsLoadingMore ? "Memuat..." : "Muat Produk Lainnya"}
+                </button>
+              )}
             </div>
           </div>
         )}
@@ -186,6 +229,11 @@ export default function SellerDashboard() {
               </div>
             ))}
             {orders.length === 0 && <div className="text-center py-12 text-gray-400">Belum ada pesanan</div>}
+            {ordersCursor && (
+              <button onClick={loadMoreOrders} disabled={ordersLoadingMore} className="w-full py-2.5 bg-white border rounded-lg text-sm font-medium text-gray-700 hover:bg-gray-50 transition disabled:opacity-50" data-testid="button-load-more-orders">
+                {ordersLoadingMore ? "Memuat..." : "Muat Pesanan Lainnya"}
+              </button>
+            )}
           </div>
         )}
         {tab === "settings" && (
@@ -1,6 +1,8 @@
+import ResponsiveImage, { Renditions } from "@/components/ResponsiveImage";
+
 interface Variant { price: number | null; price_modifier: number; }
 interface ProductCardProps {
-  product: { name: string; slug: string; price: number; original_price: number | null; primary_image: string; sold_count: number; rating: number; variants?: Variant[] };
+  product: { name: string; slug: string; price: number; original_price: number | null; primary_image: string; primary_image_renditions?: Renditions | null; sold_count: number; rating: number; variants?: Variant[] };
   formatPrice: (price: number) => string;
   formatSoldCount: (count: number) => string;
   onClick: () => void;
@@ -19,7 +21,7 @@ export default function ProductCard({ product, formatPrice, formatSoldCount, onC
   return (
     <div className="bg-white rounded-lg border overflow-hidden cursor-pointer hover:shadow-md transition" onClick={onClick} data-testid={`product-card-${product.slug}`}>
       <div className="aspect-square relative">
-        <img src={product.primary_image} alt={product.name} className="w-full h-full object-cover" />
+        <ResponsiveImage src={product.primary_image} renditions={product.primary_image_renditions} sizes="(min-width: 1280px) 20vw, (min-width: 1024px) 25vw, (min-width: 768px) 33vw, 50vw" alt={product.name} className="w-full h-full object-cover" />
         {product.original_price && product.original_price > min && (
           <span className="absolute top-2 left-2 bg-red-500 text-white text-xs px-1.5 py-0.5 rounded">{Math.round((1 - min / product.original_price) * 100)}%</span>
         )}
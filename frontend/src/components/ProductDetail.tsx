@@ -1,9 +1,10 @@
 "use client";
 
 import { useState, useMemo } from "react";
+import ResponsiveImage, { Renditions } from "@/components/ResponsiveImage";
 
 interface Variant { variant_type: string; variant_name: string; price: number | null; price_modifier: number; stock: number; is_available: boolean; }
-interface Product { name: string; slug: string; price: number; original_price: number | null; category: string; description: string; sold_count: number; stock: number; rating: number; primary_image: string; images: string[]; variants: Variant[]; }
+interface Product { name: string; slug: string; price: number; original_price: number | null; category: string; description: string; sold_count: number; stock: number; rating: number; primary_image: string; primary_image_renditions?: Renditions | null; images: string[]; image_renditions?: (Renditions | null)[]; variants: Variant[]; }
 interface ProductDetailProps { product: Product; formatPrice: (price: number) => string; formatSoldCount: (count: number) => string; onClose: () => void; onAddToCart: (product: Product, variantName?: string, quantity?: number) => void; }
 
 function getVariantPrice(v: Variant, basePrice: number): number {
@@ -15,7 +16,9 @@ export default function ProductDetail({ product, formatPrice, formatSoldCount, o
   const [selectedImage, setSelectedImage] = useState(0);
   const [selectedVariants, setSelectedVariants] = useState<Record<string, string>>({});
   const [quantity, setQuantity] = useState(1);
-  const images = product.images.length > 0 ? product.images : [product.primary_image];
+  const images = product.images.length > 0
+    ? product.images.map((src, i) => ({ src, renditions: product.image_renditions?.[i] ?? null }))
+    : [{ src: product.primary_image, renditions: product.primary_image_renditions ?? null }];
 
   const variantTypes = useMemo(() => {
     const types: string[] = [];
@@ -67,10 +70,10 @@ export default function ProductDetail({ product, formatPrice, formatSoldCount, o
           <button onClick={onClose} className="absolute top-3 right-3 z-10 w-8 h-8 bg-white rounded-full shadow flex items-center justify-center" data-testid="button-close-detail">
             <svg xmlns="http://www.w3.org/2000/svg" className="h-5 w-5" fill="none" viewBox="0 0 24 24" stroke="currentColor"><path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M6 18L18 6M6 6l12 12" /></svg>
           </button>
-          <div className="aspect-square rounded-lg overflow-hidden mb-3"><img src={images[selectedImage]} alt={product.name} className="w-full h-full object-cover" /></div>
+          <div className="aspect-square rounded-lg overflow-hidden mb-3"><ResponsiveImage src={images[selectedImage].src} renditions={images[selectedImage].renditions} sizes="(min-width: 512px) 512px, 100vw" alt={product.name} className="w-full h-full object-cover" /></div>
           {images.length > 1 && (
             <div className="flex gap-2 overflow-x-auto mb-4">
-              {images.map((img, i) => (<button key={i} onClick={() => setSelectedImage(i)} className={`w-16 h-16 rounded-lg overflow-hidden flex-shrink-0 border-2 ${i === selectedImage ? "border-gray-900" : "border-transparent"}`}><img src={img} alt="" className="w-full h-full object-cover" /></button>))}
+              {images.map((img, i) => (<button key={i} onClick={() => setSelectedImage(i)} className={`w-16 h-16 rounded-lg overflow-hidden flex-shrink-0 border-2 ${i === selectedImage ? "border-gray-900" : "border-transparent"}`}><ResponsiveImage src={img.src} renditions={img.renditions} sizes="64px" alt="" className="w-full h-full object-cover" /></button>))}
             </div>
           )}
           <h2 className="text-lg font-bold mb-1">{product.name}</h2>
@@ -0,0 +1,25 @@
+export interface Rendition { width: number; height: number; webp?: string; avif?: string; }
+export type Renditions = Partial<Record<"thumb" | "card" | "detail", Rendition>>;
+
+interface ResponsiveImageProps { src: string; renditions?: Renditions | null; sizes: string; alt: string; className?: string; }
+
+function srcSet(renditions: Renditions, format: "avif" | "webp"): string {
+  return Object.values(renditions)
+    .filter((r): r is Rendition => !!r && !!r[format])
+    .map((r) => `${r[format]} ${r.width}w`)
+    .join(", ");
+}
+
+// Serves the server-generated AVIF/WebP renditions; the original upload is only the fallback src.
+export default function ResponsiveImage({ src, renditions, sizes, alt, className }: ResponsiveImageProps) {
+  if (!renditions) return <img src={src} alt={alt} className={className} loading="lazy" decoding="async" />;
+  const avif = srcSet(renditions, "avif");
+  const webp = srcSet(renditions, "webp");
+  return (
+    <picture className="contents">
+      {avif && <source type="image/avif" srcSet={avif} sizes={sizes} />}
+      {webp && <source type="image/webp" srcSet={webp} sizes={sizes} />}
+      <img src={src} alt={alt} className={className} loading="lazy" decoding="async" />
+    </picture>
+  );
+}